@@ -11,6 +11,13 @@
 ------------------------------------
 This module is useful for representing apertures. It uses algorithms from :ref:`util.math.aperture` in :mod:`util.math <aopy.util.math>`.
 
+Each :class:`Aperture` keeps a :class:`CompactAperture`, an immutable summary of its open pixels, so that
+code which works on many frames can index only the open pixels, instead of masking full arrays::
+
+    ap = Aperture(response)
+    values = ap.compact.take(phase_cube)
+    phase_cube = ap.compact.put(values)
+
 """
 from __future__ import (absolute_import, unicode_literals, division,
                         print_function)
@@ -21,8 +28,125 @@ import numpy as np
 
 import warnings
 
-__all__ = ['Aperture']
+__all__ = ['Aperture', 'CompactAperture']
 
+class CompactAperture(object):
+    """An immutable, compact representation of the open pixels of an aperture.
+    
+    :param mask: The aperture, as a 2D array, where non-zero pixels are open.
+    
+    The mask is stored packed, eight pixels to a byte, along with the flat indices of the open pixels,
+    the extents of the open pixels in each row and column, and the bounding box of the open pixels. All of
+    the arrays are read-only.
+    
+    """
+    def __init__(self, mask):
+        super(CompactAperture, self).__init__()
+        mask = np.asarray(mask) != 0
+        if mask.ndim != 2:
+            raise ValueError("{0!r} mask dimensions should be 2, not {1:d}".format(self, mask.ndim))
+        self._shape = mask.shape
+        self._packed = np.packbits(mask.ravel())
+        self._indices = np.flatnonzero(mask)
+        self._pixels = np.unravel_index(self._indices, self._shape)
+        
+        # The first and last open column in each row with open pixels, and vice versa.
+        self._rows = np.flatnonzero(mask.any(axis=1))
+        self._row_extents = (np.argmax(mask[self._rows,:], axis=1),
+            mask.shape[1] - 1 - np.argmax(mask[self._rows,::-1], axis=1))
+        self._columns = np.flatnonzero(mask.any(axis=0))
+        self._column_extents = (np.argmax(mask[:,self._columns], axis=0),
+            mask.shape[0] - 1 - np.argmax(mask[::-1,self._columns], axis=0))
+        
+        for array in (self._packed, self._indices, self._rows, self._columns) + self._pixels + self._row_extents + self._column_extents:
+            array.flags.writeable = False
+        
+    def __repr__(self):
+        """Represent this object."""
+        return "<{0} shape={1!r} npix={2:d}>".format(self.__class__.__name__, self.shape, self.npix)
+        
+    @property
+    def shape(self):
+        """The shape of the full aperture. **Read-Only**"""
+        return self._shape
+        
+    @property
+    def npix(self):
+        """The number of open pixels. **Read-Only**"""
+        return self._indices.shape[0]
+        
+    @property
+    def packed(self):
+        """The aperture mask, flattened and packed into bits with :func:`numpy.packbits`. **Read-Only**"""
+        return self._packed
+        
+    @property
+    def mask(self):
+        """The aperture, as a new boolean mask, unpacked from :attr:`packed`."""
+        size = self._shape[0] * self._shape[1]
+        return np.unpackbits(self._packed)[:size].reshape(self._shape).astype(np.bool)
+        
+    @property
+    def indices(self):
+        """The flat indices of the open pixels, in C order. **Read-Only**"""
+        return self._indices
+        
+    @property
+    def rows(self):
+        """The rows which have open pixels. **Read-Only**"""
+        return self._rows
+        
+    @property
+    def row_extents(self):
+        """The ``(first, last)`` open column in each of :attr:`rows`. **Read-Only**"""
+        return self._row_extents
+        
+    @property
+    def columns(self):
+        """The columns which have open pixels. **Read-Only**"""
+        return self._columns
+        
+    @property
+    def column_extents(self):
+        """The ``(first, last)`` open row in each of :attr:`columns`. **Read-Only**"""
+        return self._column_extents
+        
+    @property
+    def bounding_box(self):
+        """The bounding box of the open pixels, as a pair of slices. **Read-Only**"""
+        if self.npix == 0:
+            return (slice(0, 0), slice(0, 0))
+        return (slice(self._rows[0], self._rows[-1] + 1), slice(self._columns[0], self._columns[-1] + 1))
+        
+    def take(self, array):
+        """Take the open pixels from an array.
+        
+        :param array: An array with shape ``(..., nx, ny)``, for any number of frames.
+        :returns: The open pixels, with shape ``(..., npix)``.
+        
+        """
+        array = np.asarray(array)
+        if array.shape[-2:] != self._shape:
+            raise ValueError("Array should have shape (...) + {0!r}, not {1!r}".format(self._shape, array.shape))
+        return array[(Ellipsis,) + self._pixels]
+        
+    def put(self, values, out=None):
+        """Put values into the open pixels of an array.
+        
+        :param values: The values, with shape ``(..., npix)``, for any number of frames.
+        :param out: The array to fill, with shape ``(..., nx, ny)``. By default, a new array is made, which
+            is zero outside of the aperture.
+        :returns: The array.
+        
+        """
+        values = np.asarray(values)
+        if values.shape[-1] != self.npix:
+            raise ValueError("Values should have {0:d} pixels, not {1:d}".format(self.npix, values.shape[-1]))
+        if out is None:
+            out = np.zeros(values.shape[:-1] + self._shape, dtype=values.dtype)
+        out[(Ellipsis,) + self._pixels] = values
+        return out
+        
 class Aperture(object):
     """A basic aperture object, for handling response, mask, and edge-mask functions.
     
@@ -32,6 +156,8 @@ class Aperture(object):
     """
     def __init__(self, response):
         self._response = None
+        self._pupil = None
+        self._compact = None
         self._edgemask = False
         super(Aperture, self).__init__()
         self.response = response
@@ -48,18 +174,32 @@ class Aperture(object):
         """A pretty string printing of this aperture."""
         return "Aperture shape {shape:s} open {per:.0f}%".format(
             shape = self.__shape_str__(),
-            per = np.sum(self.pupil) / np.sum(np.ones_like(self.pupil)) * 100,
+            per = self.compact.npix / self._response.size * 100,
         )
         
+    def __array__(self, dtype=None):
+        """The pupil, so that an aperture can be used wherever a mask is expected."""
+        return np.asarray(self.pupil, dtype=dtype)
+        
     @property
     def pupil(self):
-        """A boolean mask of the pupil plane. **Read-Only**"""
-        return np.array(self._response != 0.0).astype(np.int)
+        """A boolean mask of the pupil plane, as integers. **Read-Only**"""
+        if self._pupil is None:
+            self._pupil = (self._response != 0.0).astype(np.int)
+            self._pupil.flags.writeable = False
+        return self._pupil
+        
+    @property
+    def compact(self):
+        """The :class:`CompactAperture` of the open pixels of the pupil. **Read-Only**"""
+        if self._compact is None:
+            self._compact = CompactAperture(self._response)
+        return self._compact
         
     @property
     def response(self):
-        """The original response function."""
-        return np.copy(self._response)
+        """The original response function. This array is read-only, and shared, not copied."""
+        return self._response
         
     @response.setter
     def response(self,response):
@@ -72,6 +212,8 @@ class Aperture(object):
             self._edgemask = False
         self._response = response
         self._response.flags.writeable = False
+        self._pupil = None
+        self._compact = None
         
     @property
     def edgemask(self):
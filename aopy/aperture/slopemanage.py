@@ -18,6 +18,94 @@ from __future__ import (absolute_import, unicode_literals, division,
 
 import numpy as np
 
+from .core import Aperture, CompactAperture
+
+class SlopeManagementPlan(object):
+    """A slope management plan for a fixed aperture.
+    
+    :param ap: The aperture, as a boolean mask, or an :class:`~aopy.aperture.core.Aperture`.
+    
+    The edges of the aperture are found once, when the plan is made. Applying the plan to
+    a frame of slopes, or to a stack of frames, is then a pair of sums and a pair of
+    scatter operations, with no per-row python loops.
+    
+    The aperture must have space on the edges for correction.
+    
+    """
+    def __init__(self, ap):
+        super(SlopeManagementPlan, self).__init__()
+        compact = ap.compact if isinstance(ap, Aperture) else None
+        ap = np.asarray(ap) != 0
+        if not (ap.ndim == 2 and ap.shape[0] == ap.shape[1]):
+            raise ValueError("slopemanage requires a square aperture. ap.shape={!r}".format(ap.shape))
+        n = ap.shape[0]
+        self._ap = ap
+        self._ap.flags.writeable = False
+        if compact is None:
+            compact = CompactAperture(ap)
+        
+        # Columns of the aperture, along which the y slopes are managed.
+        self._columns = compact.columns
+        left, right = compact.column_extents
+        self._check_edges("row", self._columns, left, right, n)
+        self._y_edges = (left - 1, right + 1)
+        
+        # Rows of the aperture, along which the x slopes are managed.
+        self._rows = compact.rows
+        bottom, top = compact.row_extents
+        self._check_edges("column", self._rows, bottom, top, n)
+        self._x_edges = (bottom - 1, top + 1)
+        
+    @staticmethod
+    def _check_edges(name, index, low, high, n):
+        """Ensure that there is space outside the aperture edges."""
+        for bad, k in [(low == 0, 0), (high == n - 1, n - 1)]:
+            if bad.any():
+                j = index[np.argmax(bad)]
+                raise ValueError("Not enough space to edge correct, {name} {j} ends at k={k}".format(name=name, j=j, k=k))
+        
+    @property
+    def ap(self):
+        """The aperture, as a boolean mask. **Read-Only**"""
+        return self._ap
+        
+    @property
+    def shape(self):
+        """The shape of a frame of slopes. **Read-Only**"""
+        return self._ap.shape
+        
+    def __call__(self, xs, ys):
+        """Apply slope management. See :meth:`apply`."""
+        return self.apply(xs, ys)
+        
+    def apply(self, xs, ys):
+        """Apply slope management to a frame, or a stack of frames.
+        
+        :param xs: The x slopes, with frames along the last two axes.
+        :param ys: The y slopes, with frames along the last two axes.
+        :returns: ``(xs, ys)``, new arrays of the managed slopes.
+        
+        """
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        if not (xs.shape == ys.shape):
+            raise ValueError("slopemanage requires the xs and ys to have the same shape. xs{!r} != ys{!r}".format(xs.shape, ys.shape))
+        if not (xs.shape[-2:] == self.shape):
+            raise ValueError("slopemanage requires the aperture to have the same shape as xs and ys. xs{!r} != ap{!r}".format(xs.shape, self.shape))
+        
+        xs_c = np.multiply(xs, self._ap, dtype=np.result_type(xs, np.float32))
+        ys_c = np.multiply(ys, self._ap, dtype=np.result_type(ys, np.float32))
+        
+        ysr_sum = -0.5 * ys_c.sum(axis=-2)[..., self._columns]
+        xsc_sum = -0.5 * xs_c.sum(axis=-1)[..., self._rows]
+        
+        for edge in self._y_edges:
+            ys_c[..., edge, self._columns] = ysr_sum
+        for edge in self._x_edges:
+            xs_c[..., self._rows, edge] = xsc_sum
+        
+        return (xs_c, ys_c)
+    
 def slope_management(ap, xs, ys):
     """
     Slope management for the fast fourier transform.
@@ -28,62 +116,155 @@ def slope_management(ap, xs, ys):
     
     The slopes must be within an aperture that has space on the edges for correction.
     
-    """
-    
-    ap = np.array(ap).astype(np.int)
-    xs = np.array(xs)
-    ys = np.array(ys)
+    When managing many frames with the same aperture, make a :class:`SlopeManagementPlan` once and re-use it.
     
+    """
+    xs = np.asarray(xs)
     if not (xs.ndim == 2 and xs.shape[0] == xs.shape[1]):
         raise ValueError("slopemanage requires a square input slope array. xs.shape={!r}".format(xs.shape))
-    if not (xs.shape == ys.shape):
-        raise ValueError("slopemanage requires the xs and ys to have the same shape. xs{!r} != ys{!r}".format(xs.shape, ys.shape))
+    ap = np.asarray(ap)
     if not (ap.shape == xs.shape):
         raise ValueError("slopemanage requires the aperture to have the same shape as xs and ys. xs{!r} != ap{!r}".format(xs.shape, ap.shape))
+    return SlopeManagementPlan(ap).apply(xs, ys)
+    
+    
+class EdgeExtensionPlan(object):
+    """An edge extension plan for a fixed aperture.
+    
+    :param ap: The aperture, as a boolean mask.
     
-    n = xs.shape[0]
+    Edge extension fills the slopes outside the aperture so that the slopes are periodic
+    and (nearly) curl free, in three steps:
     
-    xs_s = xs * ap
-    ys_s = ys * ap
+    1. Each loop of four slopes on the edge of the aperture, where three slopes are
+       known, is closed by setting the fourth slope. Loops are closed in raster order,
+       and a slope is only set once.
+    2. The x slopes are extended along each column (in y) from the first and last known
+       slope, and the y slopes are extended along each row (in x).
+    3. The last x slope in each row, and the last y slope in each column, are set so that
+       each row and column sums to zero, closing the loop across the periodic boundary.
     
-    xs_c = np.copy(xs_s)
-    ys_c = np.copy(ys_s)
+    The loop-closure and extension index maps are found once, when the plan is made, so that
+    applying the plan to a frame, or to a stack of frames, uses only array operations.
     
-    ysr_sum = np.sum(ys_s, axis=0)
-    apr_sum = np.sum(ap, axis=0)
+    The x slopes are differences along the last axis, ``xs[i,j] = phi[i,j+1] - phi[i,j]``, and the
+    y slopes along the second to last axis, ``ys[i,j] = phi[i+1,j] - phi[i,j]``.
     
-    xsc_sum = np.sum(xs_s, axis=1)
-    apc_sum = np.sum(ap, axis=1)
+    The aperture must not reach the last row or column, where the periodic loops are closed.
     
-    for j in range(n):
-        if apr_sum[j] != 0:
-            loc = np.where(ap[:,j] != 0)[0]
-            left = loc[0]
-            right = loc[-1]
+    """
             
-            if left == 0:
-                raise ValueError("Not enough space to edge correct, row {j} ends at k={k}".format(j=j, k=0))
-            if right == n:
-                raise ValueError("Not enough space to edge correct, row {j} ends at k={k}".format(j=j, k=n))
+    _LOOP_SIGNS = np.array([1, -1, 1, -1])
             
-            ys_c[left-1, j] = - 0.5 * ysr_sum[j]
-            ys_c[right+1, j] = -0.5 * ysr_sum[j]
+    def __init__(self, ap):
+        super(EdgeExtensionPlan, self).__init__()
+        ap = np.asarray(ap) != 0
+        if not (ap.ndim == 2 and ap.shape[0] == ap.shape[1]):
+            raise ValueError("edge extension requires a square aperture. ap.shape={!r}".format(ap.shape))
+        n = ap.shape[0]
+        # The last column of x slopes and the last row of y slopes close the periodic loops,
+        # so they must be outside of the aperture.
+        if ap[:,n-1].any():
+            raise ValueError("Not enough space to edge extend, row {j} ends at k={k}".format(j=np.argmax(ap[:,n-1]), k=n-1))
+        if ap[n-1,:].any():
+            raise ValueError("Not enough space to edge extend, column {j} ends at k={k}".format(j=np.argmax(ap[n-1,:]), k=n-1))
+        self._ap = ap
+        self._ap.flags.writeable = False
+        size = n * n
+        index = np.arange(size).reshape((n, n))
         
-        if apc_sum[j] != 0:
-            loc = np.where(ap[j,:] != 0)[0]
-            bottom = loc[0]
-            top = loc[-1]
+        # The x and y slopes are held together in one flat vector of length 2 * n * n.
+        valid = np.concatenate((ap.ravel(), ap.ravel()))
+        self._aperture = valid.copy()
             
-            if bottom == 0:
-                raise ValueError("Not enough space to edge correct, column {j} ends at k={k}".format(j=j, k=0))
-            if top == n:
-                raise ValueError("Not enough space to edge correct, column {j} ends at k={k}".format(j=j, k=n))
+        # Each loop at (i,j) is xs[i,j] - xs[i+1,j] + ys[i,j+1] - ys[i,j] = 0
+        i, j = np.mgrid[0:n-1,0:n-1]
+        members = np.column_stack((index[i,j].ravel(), index[i+1,j].ravel(),
+            size + index[i,j+1].ravel(), size + index[i,j].ravel()))
+        known = valid[members]
+        members = members[known.sum(axis=1) == 3]
+        missing = np.argmin(valid[members], axis=1)
+        targets = members[np.arange(members.shape[0]), missing]
+        targets, first = np.unique(targets, return_index=True)
+        members, missing = members[first], missing[first]
+        coefficients = -self._LOOP_SIGNS[missing,np.newaxis] * self._LOOP_SIGNS[np.newaxis,:]
+        coefficients[np.arange(members.shape[0]), missing] = 0
+        self._fill_targets = targets
+        self._fill_members = members
+        self._fill_coefficients = coefficients.astype(np.float64)
+        valid[targets] = True
             
-            xs_c[j, bottom-1] = -0.5 * xsc_sum[j]
-            xs_c[j, top+1]    = -0.5 * xsc_sum[j]
+        # Extend the x slopes in y, and the y slopes in x, from the first and last known slope.
+        rows, cols = np.indices((n, n))
+        xvalid = valid[:size].reshape((n, n))
+        yvalid = valid[size:].reshape((n, n))
             
-    return (xs_c, ys_c)
+        has_x = xvalid.any(axis=0)[np.newaxis,:]
+        low = np.argmax(xvalid, axis=0)[np.newaxis,:]
+        high = n - 1 - np.argmax(xvalid[::-1,:], axis=0)[np.newaxis,:]
+        outside_x = has_x & ((rows < low) | (rows > high))
+        sources_x = index[np.clip(rows, low, high), cols]
+        
+        has_y = yvalid.any(axis=1)[:,np.newaxis]
+        low = np.argmax(yvalid, axis=1)[:,np.newaxis]
+        high = n - 1 - np.argmax(yvalid[:,::-1], axis=1)[:,np.newaxis]
+        outside_y = has_y & ((cols < low) | (cols > high))
+        sources_y = size + index[rows, np.clip(cols, low, high)]
+        
+        self._extend_targets = np.concatenate((index[outside_x], size + index[outside_y]))
+        self._extend_sources = np.concatenate((sources_x[outside_x], sources_y[outside_y]))
+        
+    @property
+    def ap(self):
+        """The aperture, as a boolean mask. **Read-Only**"""
+        return self._ap
     
+    @property
+    def shape(self):
+        """The shape of a frame of slopes. **Read-Only**"""
+        return self._ap.shape
+        
+    def __call__(self, xs, ys):
+        """Apply edge extension. See :meth:`apply`."""
+        return self.apply(xs, ys)
+        
+    def apply(self, xs, ys):
+        """Apply edge extension to a frame, or a stack of frames.
+        
+        :param xs: The x slopes, with frames along the last two axes.
+        :param ys: The y slopes, with frames along the last two axes.
+        :returns: ``(xs, ys)``, new arrays of the extended slopes.
+        
+        Slopes outside of the aperture are ignored.
+        """
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        if not (xs.shape == ys.shape):
+            raise ValueError("edge extension requires the xs and ys to have the same shape. xs{!r} != ys{!r}".format(xs.shape, ys.shape))
+        if not (xs.shape[-2:] == self.shape):
+            raise ValueError("edge extension requires the aperture to have the same shape as xs and ys. xs{!r} != ap{!r}".format(xs.shape, self.shape))
+        
+        n = self.shape[0]
+        size = n * n
+        leading = xs.shape[:-2]
+        slopes = np.empty(leading + (2 * size,), dtype=np.result_type(xs, ys, np.float32))
+        slopes[...,:size] = xs.reshape(leading + (size,))
+        slopes[...,size:] = ys.reshape(leading + (size,))
+        slopes *= self._aperture
+        
+        # Close the loops on the aperture edge.
+        closed = slopes[...,self._fill_members] * self._fill_coefficients.astype(slopes.dtype)
+        slopes[...,self._fill_targets] = closed.sum(axis=-1)
+        
+        # Extend the slopes to the edge of the grid.
+        slopes[...,self._extend_targets] = slopes[...,self._extend_sources]
+        
+        # Close the loops across the periodic boundary.
+        xs_e = slopes[...,:size].reshape(leading + (n, n))
+        ys_e = slopes[...,size:].reshape(leading + (n, n))
+        xs_e[...,:,n-1] = -xs_e[...,:,:n-1].sum(axis=-1)
+        ys_e[...,n-1,:] = -ys_e[...,:n-1,:].sum(axis=-2)
+        return (xs_e, ys_e)
     
 def edge_extend(ap, xs, ys):
     """
@@ -92,21 +273,8 @@ def edge_extend(ap, xs, ys):
     :param ap: The aperture, as a boolean mask.
     :param xs: The x slopes.
     :param ys: The y slopes.
-    """
     
-    for k in range(n):
-        for l in range(n):
-            if loop[k,l] == 3:
-                flag = 0
-                total = 0
-                for flval, arr in enumerate([xs_ap, xs_sap, ys_ap, ys_sap]):
-                    if arr[k,l] == 0:
-                        flag = flval + 1
-                    elif flval == 0:
-                        total = total + xs[k,l]
-                    elif flval == 1:
-                        total = total + xs[k,l+1]
-                    elif flval == 2:
-                        total = total + ys[k,l]
-                    elif flval == 3:
-                        total = total + ys[k+1,l]
+    See :class:`EdgeExtensionPlan` for the algorithm. When extending many frames with the
+    same aperture, make a plan once and re-use it.
+    """
+    return EdgeExtensionPlan(ap).apply(xs, ys)
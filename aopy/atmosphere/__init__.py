@@ -6,5 +6,6 @@ and as phase approaching a telescope aperture.
 
 from .screen import Screen
 from .wind import ManyLayerScreen
+from .infinite import InfiniteScreen
 
-__all__ = ['Screen', 'ManyLayerScreen']
\ No newline at end of file
+__all__ = ['Screen', 'ManyLayerScreen', 'InfiniteScreen']
\ No newline at end of file
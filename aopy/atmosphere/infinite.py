@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+#
+#  infinite.py
+#  aopy
+#
+#  Created by Alexander Rudy on 2014-08-02.
+#  Copyright 2014 Alexander Rudy. All rights reserved.
+#
+"""
+Infinite phase screens, which are extruded row by row as the wind blows, following
+Assémat, Wilson & Gendron (2006), "Method for simulating infinitely long and non
+stationary phase screens with optimized memory storage", Optics Express 14, 988.
+
+Each new row of phase is predicted from the last few rows of the screen, and a random
+part is added so that the new row has the correct (von Kármán) covariance with itself
+and with the rows it was predicted from::
+    
+    X = A Z + B b
+
+where ``Z`` are the stencil rows, ``b`` is white noise, :math:`A = C_{xz} C_{zz}^{-1}`
+and :math:`B B^T = C_{xx} - A C_{zx}`. Only a window slightly larger than the output
+screen is kept in memory, so screens can be blown through an aperture indefinitely.
+
+"""
+
+from __future__ import (absolute_import, unicode_literals, division,
+                        print_function)
+
+import numpy as np
+import astropy.units as u
+
+from ..util.units import ensure_quantity
+from .screen import _is_seed_sequence, _spawn_seeds, _generator
+from .wind import BlowingScreen
+
+__all__ = ['InfiniteScreen', 'phase_covariance']
+
+def phase_covariance(r, r0, L0):
+    """The covariance of von Kármán phase between two points.
+    
+    :param r: The separation of the points, in meters.
+    :param float r0: :math:`r_0` fried parameter, in meters.
+    :param float L0: :math:`L_0` outer scale, in meters.
+    :returns: The phase covariance, in square radians.
+    
+    """
+    from scipy.special import gamma, kv
+    r = np.asarray(r, dtype=np.float64)
+    scale = (L0 / r0)**(5/3) * 2**(-5/6) * gamma(11/6) / np.pi**(8/3) * ((24/5) * gamma(6/5))**(5/6)
+    x = 2 * np.pi * r / L0
+    cov = np.empty_like(x)
+    zero = (x == 0.0)
+    cov[zero] = 2**(-1/6) * gamma(5/6)
+    cov[~zero] = x[~zero]**(5/6) * kv(5/6, x[~zero])
+    return scale * cov
+
+def _distances(p, q):
+    """The distances between each pair of points in ``p`` and ``q``."""
+    return np.sqrt(np.sum((p[:,np.newaxis,:] - q[np.newaxis,:,:])**2, axis=-1))
+
+def _extrusion_operators(length, stencil, du, r0, L0):
+    """
+    Make the operators which extrude one new row of phase.
+    
+    :param int length: The length of each row.
+    :param int stencil: The number of previous rows used to predict the new row.
+    :param float du: The pixel size, in meters.
+    :param float r0: :math:`r_0` fried parameter, in meters.
+    :param float L0: :math:`L_0` outer scale, in meters.
+    :returns: ``(A, B)``, where the new row is ``A.dot(Z) + B.dot(b)``, for stencil rows ``Z``
+        flattened oldest first, and white noise ``b``.
+    
+    """
+    j = np.arange(length, dtype=np.float64)
+    zi, zj = np.meshgrid(-np.arange(stencil, 0, -1, dtype=np.float64), j, indexing='ij')
+    z = np.column_stack((zi.ravel(), zj.ravel())) * du
+    x = np.column_stack((np.zeros_like(j), j)) * du
+    
+    czz = phase_covariance(_distances(z, z), r0, L0)
+    cxz = phase_covariance(_distances(x, z), r0, L0)
+    cxx = phase_covariance(_distances(x, x), r0, L0)
+    
+    A = np.dot(cxz, np.linalg.pinv(czz))
+    bbt = cxx - np.dot(A, cxz.T)
+    U, s, _ = np.linalg.svd(bbt)
+    B = U * np.sqrt(np.clip(s, 0.0, None))
+    return A, B
+
+def _extrusion_random(seed):
+    """The random number generator for extruded rows, independent of the initial screen noise."""
+    if _is_seed_sequence(seed):
+        return _generator(_spawn_seeds(seed, 1)[0])
+    if seed is None:
+        return np.random.RandomState()
+    return np.random.RandomState(np.append(seed, 1))
+
+class InfiniteScreen(BlowingScreen):
+    """A blowing Kolmolgorov (von Kármán) Phase Screen which never wraps. A window of phase, slightly larger
+    than the output shape, is extruded row by row from the von Kármán covariance, and new rows and columns
+    are extruded on the upwind side of the window as the wind blows it past the aperture.
+    
+    :param tuple shape: The shape of the screen (x,y), as a tuple.
+    :param float r0: :math:`r_0` fried parameter for the screen.
+    :param int seed: Random number generator seed for :mod:`numpy.random`, or a :class:`numpy.random.Generator`
+        or :class:`numpy.random.SeedSequence`.
+    :param array vel: The velocity array, ``[v_x,v_y]``.
+    :param float dt: Timestep size, in seconds.
+    :param float L0: :math:`L_0` outer scale for the screen, which must be finite. (default ``=100 m``)
+    :param int stencil: The number of rows used to predict each new row.
+    :param int pad: The number of pixels around the output used for interpolation. By default, this is 8
+        for spline interpolation (``order > 1``), and 1 otherwise.
+    :param float du: pixel size, in meters
+    :param int nsh: Number of subharmonics. This has no effect, as the initial window is drawn from the full
+        von Kármán covariance, which includes the largest scales.
+    
+    Memory use depends only on the output shape. Frames should be read in increasing time: each frame is
+    consistent with the frames before it, but the phase which has blown out of the window is discarded, so
+    reading a much earlier frame extrudes new phase, rather than repeating old phase.
+    
+    """
+    def __init__(self, shape, r0, seed=None, vel=None, dt=1, delay=False, order=3, L0=100.0, stencil=2, pad=None, **kwargs):
+        super(InfiniteScreen, self).__init__(shape, r0, seed, vel=vel, tmax=dt, dt=dt, delay=True, order=order, L0=L0, **kwargs)
+        if not self.L0.to('meter').value > 0:
+            raise ValueError("Infinite screens require a finite outer scale, L0 > 0.")
+        if self.shift_method != 'spline':
+            raise ValueError("Infinite screens are not periodic, so they can't be shifted in Fourier space.")
+        if pad is None:
+            pad = 8 if order > 1 else 1
+        self._pad = int(pad)
+        self._stencil = int(stencil)
+        self._shape = tuple(int(s) + 2 * self._pad + 2 for s in self._outshape)
+        self._operators = {}
+        self._origin = None
+        self._random = None
+        if not delay:
+            self.setup()
+    
+    _pad = 0
+    _stencil = 2
+    _operators = None
+    _origin = None
+    _random = None
+    
+    @property
+    def origin(self):
+        """The position of the window in the infinite screen, in pixels. **Read-Only**"""
+        return tuple(self._origin)
+    
+    def _generate_screen(self):
+        """Generate the initial window, with the same covariance as the extruded rows.
+        
+        The first ``stencil`` rows are drawn directly from the von Kármán covariance, and the rest of the
+        window is extruded from them, row by row. A periodic FFT screen would have too little large scale
+        power, so the first frames would not match the rows extruded later.
+        """
+        self._random = _extrusion_random(self.seed)
+        self._origin = np.array([-self._pad - 1, -self._pad - 1])
+        self._ti = 0
+        k = self._stencil
+        length = self._shape[1]
+        du, r0, L0 = self.du.to('meter').value, self.r0.to('meter').value, self.L0.to('meter').value
+        
+        zi, zj = np.meshgrid(np.arange(k, dtype=np.float64), np.arange(length, dtype=np.float64), indexing='ij')
+        z = np.column_stack((zi.ravel(), zj.ravel())) * du
+        U, s, _ = np.linalg.svd(phase_covariance(_distances(z, z), r0, L0))
+        rows = np.dot(U * np.sqrt(np.clip(s, 0.0, None)), self._random.standard_normal(U.shape[1]))
+        
+        window = np.empty(self._shape, dtype=np.float64)
+        window[:k] = rows.reshape((k, length))
+        A, B = self._operator(length)
+        for i in range(k, self._shape[0]):
+            window[i] = np.dot(A, window[i-k:i].ravel()) + np.dot(B, self._random.standard_normal(B.shape[1]))
+        self._screen = window.astype(self.dtype)
+    
+    def _operator(self, length):
+        """The extrusion operators for rows of a given length."""
+        if length not in self._operators:
+            self._operators[length] = _extrusion_operators(length, self._stencil,
+                self.du.to('meter').value, self.r0.to('meter').value, self.L0.to('meter').value)
+        return self._operators[length]
+    
+    def _extrude(self, axis, forward=True):
+        """Extrude one new row (``axis=0``) or column (``axis=1``) onto the end of the window,
+        or onto the start of the window if ``forward`` is ``False``, discarding the row or column
+        at the other end."""
+        window = self._screen if axis == 0 else self._screen.T
+        A, B = self._operator(window.shape[1])
+        k = self._stencil
+        if forward:
+            z = window[-k:].ravel()
+        else:
+            z = window[k-1::-1].ravel()
+        new = np.dot(A, z) + np.dot(B, self._random.standard_normal(B.shape[1]))
+        if forward:
+            window[:-1] = window[1:]
+            window[-1] = new
+            self._origin[axis] += 1
+        else:
+            window[1:] = window[:-1]
+            window[0] = new
+            self._origin[axis] -= 1
+    
+    def get_screen(self, t):
+        """Get a screen at time `t`.
+        
+        :param int t: The timestep at which to retrieve the screen.
+        :returns: The screen for this timestep.
+        """
+        import scipy.ndimage.interpolation
+        shift = (ensure_quantity(t,u.second) * self._vel / self._du).to('').value
+        position = np.floor(-shift).astype(np.int)
+        fraction = -shift - position
+        
+        start = []
+        for axis in range(2):
+            low = position[axis] - self._pad
+            high = position[axis] + self._outshape[axis] + self._pad
+            while low < self._origin[axis]:
+                self._extrude(axis, forward=False)
+            while high > self._origin[axis] + self._shape[axis] - 1:
+                self._extrude(axis, forward=True)
+            start.append(low - self._origin[axis])
+        
+        window = self._screen[start[0]:start[0] + self._outshape[0] + 2 * self._pad + 1,
+                              start[1]:start[1] + self._outshape[1] + 2 * self._pad + 1]
+        if (fraction != 0.0).any():
+            window = scipy.ndimage.interpolation.shift(window, -fraction, order=self._order,
+                mode='nearest', prefilter=(self._order > 1))
+        return np.array(window[self._pad:self._pad + self._outshape[0], self._pad:self._pad + self._outshape[1]])
+    
+    @property
+    def screen(self):
+        """Counter movement screen"""
+        self._ti += 1
+        return self.get_screen(self._ti * self._dt)
+    
+    def __len__(self):
+        """Infinite screens have no length."""
+        raise TypeError("An infinite screen has no length.")
+    
+    @property
+    def screens(self):
+        """An infinite iterator through this screen over time.
+        
+        Use like::
+            
+            for screen in infinite.screens:
+                print(screen[0,0])
+        
+        
+        """
+        while True:
+            yield self.screen
+    
+    @property
+    def all(self):
+        """Infinite screens can't be evaluated all at once."""
+        raise TypeError("An infinite screen can't be evaluated all at once.")
+
@@ -20,14 +20,16 @@ from __future__ import (absolute_import, unicode_literals, division,
 
 import warnings
 
+import six
 import numpy as np
 import astropy.units as u
 
 from aopy.util.basic import _ConsoleContext
 from aopy.util.units import ensure_quantity
+from aopy.util.fft import get_backend
 
 
-def _generate_filter(shape,r0,du,L0=0,nsh=0):
+def _generate_filter(shape,r0,du,L0=0,nsh=0,dtype=np.float64):
     """Generate the filter for this screen.
     
     :param shape: Shape of the desired screen.
@@ -35,6 +37,7 @@ def _generate_filter(shape,r0,du,L0=0,nsh=0):
     :param du: :math:`du` pixel size, in meters
     :param L0: :math:`L_0` outer scale for the screen, in meters
     :param nsh: Number of subharmonics to use. Results are good below ``nsh=8``
+    :param dtype: The floating point type of the filter, which sets the type of the screens.
     :returns: ``(f,shf)``, a tuple where ``f`` is the filter, ``shf`` is the subharmonic filter.
     
     """
@@ -52,6 +55,7 @@ def _generate_filter(shape,r0,du,L0=0,nsh=0):
     f = np.sqrt(0.023) * np.power(2.0 * np.pi / r0,5/6) * np.power(k2,-11/12) * np.sqrt(dkx * dky)
     
     f[n//2,m//2] = 0.0
+    f = f.astype(dtype, copy=False)
     
     if nsh > 0:
         shf = np.zeros((8,nsh))
@@ -73,16 +77,18 @@ def _generate_filter(shape,r0,du,L0=0,nsh=0):
     
     return f, shf
 
-def _generate_screen_with_noise(f,noise=None,shf=None,shnoise=None,du=1.0):
+def _generate_screen_with_noise(f,noise=None,shf=None,shnoise=None,du=1.0,fft=None):
     """
     Generate a screen from a given grid of noise.
     
     :param f: Filter, from :func:`_generate_filter`
     :param noise: Noise, shame shape as ``f``, using a 'standard normal' distribution.
+        A stack of noise grids, with shape ``(k, n, m)``, generates a stack of ``k`` screens.
     :param shf: Subharmonic filter, from :func:`_generate_filter`
-    :param shnoise: Subharmonic noise with a specific format.
+    :param shnoise: Subharmonic noise with a specific format. For a stack of screens, this has shape ``(k, 4)``.
     :param du: Pixel size, in meters
-    :returns: A screen with a shape matching ``f``
+    :param fft: The FFT backend, see :func:`~aopy.util.fft.get_backend`.
+    :returns: A screen with a shape matching ``f``, or a stack of screens matching ``noise``, with the type of ``f``.
     
     Noise is properly generated by :func:`_generate_screen`, but if you want to 
     generate your own noise, you can use :mod:`numpy.random` as follows.
@@ -102,38 +108,108 @@ def _generate_screen_with_noise(f,noise=None,shf=None,shnoise=None,du=1.0):
         shnoise = (_shn[:4] + 1j*_shn[4:])/np.sqrt(2.0)
     
     """
-    import scipy.fftpack
-    rn = noise if noise is not None else np.ones(f.shape)
-    frn = scipy.fftpack.fftshift(scipy.fftpack.fft2(rn)) * np.sqrt(np.prod(f.shape))
-    s = scipy.fftpack.ifft2(scipy.fftpack.ifftshift(frn*f))
+    fft = get_backend(fft)
+    rn = np.asarray(noise, dtype=f.dtype) if noise is not None else np.ones(f.shape, dtype=f.dtype)
+    frn = fft.fftshift(fft.fft2(rn), axes=(-2,-1)) * f.dtype.type(np.sqrt(np.prod(f.shape)))
+    s = fft.ifft2(fft.ifftshift(frn*f, axes=(-2,-1)))
     if shf is not None:
-        shn = shnoise if shnoise is not None else np.zeros((8,),dtype=np.complex)
-        n,m = f.shape
-        dkx = 2.0*np.pi/(n*du)
-        dky = 2.0*np.pi/(m*du)
-        y, x = (np.mgrid[0:n,0:m]).astype(np.float) * du
-        rn = np.ones((8,),dtype=np.complex)
-        nsh = shf.shape[1]
-        for i in range(nsh):            
-            rn[0:4] = shn
-            rn[7] = np.conj(rn[0])
-            rn[6] = np.conj(rn[1])
-            rn[5] = np.conj(rn[2])
-            rn[4] = np.conj(rn[3])
-            dkx = dkx/3.0
-            dky = dky/3.0
-            s = s + rn[0]*shf[0,i]*np.exp(1j*(-dkx*x-dky*y))
-            s = s + rn[1]*shf[1,i]*np.exp(1j*(-dky*y))
-            s = s + rn[2]*shf[2,i]*np.exp(1j*(dkx*x-dky*y))
-            s = s + rn[3]*shf[3,i]*np.exp(1j*(-dkx*y))
-            s = s + rn[4]*shf[4,i]*np.exp(1j*(dkx*y))
-            s = s + rn[5]*shf[5,i]*np.exp(1j*(-dkx*x+dky*y))
-            s = s + rn[6]*shf[6,i]*np.exp(1j*(dky*y))
-            s = s + rn[7]*shf[7,i]*np.exp(1j*(dkx*x+dky*y))
-    return np.real(s)
+        s += _generate_subharmonics(f.shape, shf, shnoise, du)
+    return np.real(s).astype(f.dtype, copy=False)
+    
+def _spectral_filter(f):
+    """
+    Prepare a filter for :func:`_generate_screen_with_spectral_noise`.
+    
+    :param f: Filter, from :func:`_generate_filter`
+    :returns: The filter, shifted to the un-centered FFT layout, and scaled by the number of pixels.
     
+    """
+    return np.fft.ifftshift(f) * f.dtype.type(np.prod(f.shape))
+    
+def _generate_screen_with_spectral_noise(sf,noise=None,shf=None,shnoise=None,du=1.0,fft=None):
+    """
+    Generate a screen from a given grid of complex noise in the frequency domain.
+    
+    :param sf: Spectral filter, from :func:`_spectral_filter`
+    :param noise: Complex noise, same shape as ``sf``, with independent 'standard normal' real and imaginary parts.
+        A stack of noise grids, with shape ``(k, n, m)``, generates a stack of ``k`` screens.
+    :param shf: Subharmonic filter, from :func:`_generate_filter`
+    :param shnoise: Subharmonic noise, see :func:`_generate_screen_with_noise`.
+    :param du: Pixel size, in meters
+    :param fft: The FFT backend, see :func:`~aopy.util.fft.get_backend`.
+    :returns: A screen with a shape matching ``sf``, or a stack of screens matching ``noise``, with the type of ``sf``.
+    
+    This skips the forward FFT of the noise in :func:`_generate_screen_with_noise`, and both
+    shifts. The transform of real white noise is Hermitian complex white noise, and the real
+    part of the screen made from complex white noise ``Z`` is the screen made from its Hermitian
+    part, ``(Z(k) + conj(Z(-k)))/2``, because the filter is real and even. So the screens have
+    the same statistics as those from :func:`_generate_screen_with_noise`, but not the same values
+    for a given seed.
+    
+    **Noise Generation**
+    To produce correct spectral noise from a given ``seed``, use::
+        
+        import numpy.random
+        _rn = numpy.random.RandomState(seed).randn(2, *sf.shape)
+        noise = _rn[0] + 1j*_rn[1]
+        
+    """
+    fft = get_backend(fft)
+    ctype = np.result_type(sf, np.complex64)
+    rn = np.asarray(noise, dtype=ctype) if noise is not None else np.ones(sf.shape, dtype=ctype)
+    s = fft.ifft2(rn * sf)
+    if shf is not None:
+        s += _generate_subharmonics(sf.shape, shf, shnoise, du)
+    return np.real(s).astype(sf.dtype, copy=False)
+    
+
+def _generate_subharmonics(shape,shf,shnoise=None,du=1.0):
+    """
+    Generate the subharmonic part of a screen.
+    
+    :param shape: Shape of the screen.
+    :param shf: Subharmonic filter, from :func:`_generate_filter`
+    :param shnoise: Subharmonic noise, see :func:`_generate_screen_with_noise`. Noise with shape ``(k, 4)``
+        generates a stack of ``k`` subharmonic screens.
+    :param du: Pixel size, in meters
+    :returns: The (complex) subharmonic screen, with shape ``shape``, or ``(k,) + shape``.
+    
+    Each subharmonic level adds eight plane waves, each of which is separable into a
+    factor along each axis. The factors are evaluated as 1-D exponentials, and the waves
+    for all levels are summed as a single product of ``(n, k)`` and ``(k, m)`` matrices.
+    
+    """
+    shn = np.asarray(shnoise) if shnoise is not None else np.zeros((4,),dtype=np.complex128)
+    n,m = shape
+    nsh = shf.shape[1]
+    dkx = 2.0*np.pi/(n*du) / 3.0**np.arange(1, nsh + 1)
+    dky = 2.0*np.pi/(m*du) / 3.0**np.arange(1, nsh + 1)
+    y = np.arange(n, dtype=np.float64) * du
+    x = np.arange(m, dtype=np.float64) * du
+    
+    # The noise is the same for each level, and conjugate-symmetric, rn[7-i] = conj(rn[i])
+    rn = np.empty(shn.shape[:-1] + (8,),dtype=np.complex128)
+    rn[...,0:4] = shn
+    rn[...,4:8] = np.conj(rn[...,3::-1])
+    a = rn[...,np.newaxis] * shf
+    
+    ey = np.exp(1j * np.outer(y, dky))
+    eyx = np.exp(1j * np.outer(y, dkx))
+    ex = np.exp(1j * np.outer(dkx, x))
+    
+    # Waves along y alone (1, 3, 4, 6) make up a single column.
+    column = (np.dot(a[...,1,:], np.conj(ey).T) + np.dot(a[...,3,:], np.conj(eyx).T)
+            + np.dot(a[...,4,:], eyx.T) + np.dot(a[...,6,:], ey.T))
+    
+    # Waves along both axes (0, 2, 5, 7), factored as exp(i ky y) * exp(i kx x).
+    waves = np.broadcast_to(np.hstack([np.conj(ey), ey]), column.shape[:-1] + (n, 2 * nsh))
+    left = np.concatenate([waves, column[...,np.newaxis]], axis=-1)
+    right = np.concatenate([a[...,0,:,np.newaxis] * np.conj(ex) + a[...,2,:,np.newaxis] * ex,
+                            a[...,5,:,np.newaxis] * np.conj(ex) + a[...,7,:,np.newaxis] * ex,
+                            np.ones(column.shape[:-1] + (1,m))], axis=-2)
+    return np.matmul(left, right)
 
-def _generate_screen(f,seed=None,shf=None,du=None):
+def _generate_screen(f,seed=None,shf=None,du=None,fft=None,spectral=False):
     """
     Generate a screen with noise.
     
@@ -141,14 +217,95 @@ def _generate_screen(f,seed=None,shf=None,du=None):
     :param seed: Random number seed, to make noise suitable.
     :param shf: Subharmonic filter, from :func:`_generate_filter`
     :param du: Pixel size, in meters
+    :param fft: The FFT backend, see :func:`~aopy.util.fft.get_backend`.
+    :param bool spectral: Generate noise in the frequency domain, see :func:`_generate_screen_with_spectral_noise`.
     :returns: A screen with a shape matching ``f``
     
+    """
+    rn, shn = _generate_noise(f.shape,seed,spectral)
+    if spectral:
+        return _generate_screen_with_spectral_noise(_spectral_filter(f),rn,shf,shn,du,fft)
+    return _generate_screen_with_noise(f,rn,shf,shn,du,fft)
+    
+def _generate_noise(shape,seed=None,spectral=False):
+    """
+    Generate the noise for a screen.
+    
+    :param shape: Shape of the screen.
+    :param seed: Random number seed. A :class:`numpy.random.Generator` or :class:`numpy.random.SeedSequence`
+        draws the noise and the subharmonic noise from independent child streams, see :func:`_spawn_seeds`.
+        Any other seed is passed to :class:`numpy.random.RandomState`, as in ``screengen.pro``, and the
+        same seed is used for both the noise and the subharmonic noise.
+    :param bool spectral: Generate complex noise for :func:`_generate_screen_with_spectral_noise`.
+    :returns: ``(noise, shnoise)``, the noise and the subharmonic noise.
+    
     """
     import numpy.random
-    rn = numpy.random.RandomState(seed).randn(*f.shape)
-    _shn = numpy.random.RandomState(seed).randn(8)
+    size = (2,) + tuple(shape) if spectral else tuple(shape)
+    if _is_seed_sequence(seed):
+        rng, shrng = [_generator(child) for child in _spawn_seeds(seed, 2)]
+        _rn = rng.standard_normal(size)
+        _shn = shrng.standard_normal(8)
+    else:
+        _rn = numpy.random.RandomState(seed).randn(*size)
+        _shn = numpy.random.RandomState(seed).randn(8)
+    rn = _rn[0] + 1j*_rn[1] if spectral else _rn
     shn = (_shn[:4] + 1j*_shn[4:])/np.sqrt(2.0)
-    return _generate_screen_with_noise(f,rn,shf,shn,du)
+    return rn, shn
+    
+def _is_seed_sequence(seed):
+    """Whether ``seed`` is a :class:`numpy.random.Generator` or :class:`numpy.random.SeedSequence`.
+    
+    These are only available with numpy >= 1.17.
+    """
+    import numpy.random
+    types = tuple(getattr(numpy.random, name) for name in ('Generator', 'SeedSequence') if hasattr(numpy.random, name))
+    return len(types) > 0 and isinstance(seed, types)
+    
+def _spawn_seeds(seed, k):
+    """
+    Spawn independent child seeds.
+    
+    :param seed: A :class:`numpy.random.Generator` or :class:`numpy.random.SeedSequence`.
+    :param int k: The number of children.
+    :returns: A list of ``k`` children, of the same type as ``seed``.
+    
+    Children of a :class:`~numpy.random.SeedSequence` are spawned from it, and so are independent of each
+    other and of the children spawned by any other process, which makes them suitable for parallel generation.
+    Children of a :class:`~numpy.random.Generator` are spawned from a :class:`~numpy.random.SeedSequence`
+    seeded by that generator, and use the same bit generator, e.g. PCG64 or Philox.
+    
+    """
+    import numpy.random
+    if isinstance(seed, numpy.random.SeedSequence):
+        return seed.spawn(k)
+    entropy = seed.integers(0, 2**63, size=4, dtype=np.uint64)
+    children = numpy.random.SeedSequence([int(e) for e in entropy]).spawn(k)
+    return [numpy.random.Generator(type(seed.bit_generator)(child)) for child in children]
+    
+def _generator(seed):
+    """A :class:`numpy.random.Generator` for a seed, using PCG64 for a :class:`~numpy.random.SeedSequence`."""
+    import numpy.random
+    if isinstance(seed, numpy.random.Generator):
+        return seed
+    return numpy.random.default_rng(seed)
+    
+def _generate_noises(shape,seeds,spectral=False,dtype=np.float64):
+    """
+    Generate the noise for a stack of screens.
+    
+    :param shape: Shape of each screen.
+    :param seeds: A sequence of random number seeds.
+    :param bool spectral: Generate complex noise for :func:`_generate_screen_with_spectral_noise`.
+    :param dtype: The floating point type of the noise.
+    :returns: ``(noise, shnoise)``, stacks of noise and subharmonic noise, one for each seed.
+    
+    """
+    rn = np.empty((len(seeds),) + tuple(shape), dtype=np.result_type(dtype, np.complex64) if spectral else dtype)
+    shn = np.empty((len(seeds), 4), dtype=np.complex128)
+    for i, seed in enumerate(seeds):
+        rn[i], shn[i] = _generate_noise(shape,seed,spectral)
+    return rn, shn
 
 class Screen(_ConsoleContext):
     """A static Kolmolgorov Phase Screen Class. This class builds a Komologorv Filter and then generates a phase screen for that filter.
@@ -156,18 +313,25 @@ class Screen(_ConsoleContext):
     
     :param tuple shape: The shape of the screen (x,y), as a tuple.
     :param float r0: :math:`r_0` fried parameter for the screen, in meters (or relative to ``du`` appropriately). Accepts an :mod:`astropy` :class:`~astropy.units.Quantity`.
-    :param int seed: Random number generator seed for :mod:`numpy.random`
+    :param int seed: Random number generator seed for :mod:`numpy.random`. This can also be a
+        :class:`numpy.random.Generator` or :class:`numpy.random.SeedSequence` (with numpy >= 1.17),
+        from which independent streams are spawned for each screen. See :func:`_generate_noise`.
     :param float du: Pixel size, in meters
     :param float L0: :math:`L_0` outer scale for the screen. Accepts an :mod:`astropy` :class:`~astropy.units.Quantity`.
     :param int nsh: Number of subharmonics. (default``=0`` for no subharmonics)
     :param bool delay: Delay initialization until :meth:`setup` is called.
+    :param dtype: The floating point type of the screens, ``float64`` (the default) or ``float32``.
+    :param fft: The FFT backend used to generate screens. See :func:`~aopy.util.fft.get_backend`.
+    :param bool spectral: Generate noise directly in the frequency domain. This skips one FFT and two shifts
+        for each screen, and gives statistically equivalent screens, but not the same screen for a given seed.
+        By default, screens are made from real noise, as in ``screengen.pro``, see :func:`_generate_screen_with_noise`.
     
     The screen object is callable. Calling the screen generates a new random screen without changing the filter, and returns the new random screen::
         
         new_screen_array = MyScreen()
     
     """
-    def __init__(self, shape, r0, seed=None, du=1.0, L0=None, nsh=0, delay=False):
+    def __init__(self, shape, r0, seed=None, du=1.0, L0=None, nsh=0, delay=False, fft=None, spectral=False, dtype=np.float64):
         super(Screen, self).__init__()
         
         if not isinstance(shape,tuple) and len(shape) == 2:
@@ -180,6 +344,7 @@ class Screen(_ConsoleContext):
         # Generated Quantities
         self._shf = None
         self._filter = None
+        self._sf = None
         self._screen = None
         
         # Parameters
@@ -188,6 +353,11 @@ class Screen(_ConsoleContext):
         self._du = ensure_quantity(du,u.meter)
         self._L0 = ensure_quantity(L0,u.meter)
         self._nsh = nsh
+        self._fft = fft
+        self._spectral = bool(spectral)
+        self._dtype = np.dtype(dtype)
+        if self._dtype.kind != 'f':
+            raise ValueError("'dtype' must be a floating point type, got {0!r}".format(self._dtype))
         self.seed = seed
         
         if not delay:
@@ -196,6 +366,7 @@ class Screen(_ConsoleContext):
     # Variable Setup
     _shf = None
     _filter = None
+    _sf = None
     _screen = None
     _shape = tuple()
     _r0 = None
@@ -203,6 +374,9 @@ class Screen(_ConsoleContext):
     _L0 = None
     _nsh = None
     _seed = None
+    _fft = None
+    _spectral = False
+    _dtype = np.dtype(np.float64)
         
     @property
     def shape(self):
@@ -229,16 +403,35 @@ class Screen(_ConsoleContext):
         """Number of sub-harmonics. **Read Only**"""
         return self._nsh
         
+    @property
+    def fft(self):
+        """The :class:`~aopy.util.fft.FFTBackend` used to generate screens. **Read Only**"""
+        return get_backend(self._fft)
+        
+    @property
+    def dtype(self):
+        """The floating point type of the screens. **Read Only**"""
+        return self._dtype
+        
+    @property
+    def spectral(self):
+        """Whether noise is generated directly in the frequency domain. **Read Only**"""
+        return self._spectral
+        
     @property
     def seed(self):
-        """Random Number Generation Seed. Setting this attribute will automatically regenerate the underlying screen."""
+        """Random Number Generation Seed. Setting this attribute will automatically regenerate the underlying screen.
+        
+        Each screen generated from a :class:`numpy.random.Generator` or :class:`numpy.random.SeedSequence` uses
+        newly spawned streams, so regenerating the screen gives a new, independent screen.
+        """
         return self._seed
         
     @seed.setter
     def seed(self,seed):
         """Random Number Generation Seed"""
-        if not (seed is None or isinstance(seed, int) or (isinstance(seed, np.ndarray) and seed.dtype == np.int)):
-            raise ValueError("'seed' must be an integer or an array of integers.")
+        if not (seed is None or isinstance(seed, int) or (isinstance(seed, np.ndarray) and seed.dtype == np.int) or _is_seed_sequence(seed)):
+            raise ValueError("'seed' must be an integer, an array of integers, or a numpy Generator or SeedSequence.")
         self._seed = seed
         if self._filter is not None:
             self._generate_screen()
@@ -275,7 +468,8 @@ class Screen(_ConsoleContext):
         (with subharmonics, if requested) that is used to generate the screen."""
         self._filter, self._shf = _generate_filter(self.shape, 
             self.r0.to('meter').value, self.du.to('meter').value,
-            self.L0.to('meter').value, self.nsh)
+            self.L0.to('meter').value, self.nsh, self.dtype)
+        self._sf = _spectral_filter(self._filter) if self.spectral else None
         
     def _generate_screen(self):
         """Use :meth:`setup` to control this method.
@@ -283,13 +477,73 @@ class Screen(_ConsoleContext):
         Generate the actual screen, using the filters produced by :meth:`_generate_filter`
         
         """
-        self._screen = _generate_screen(self._filter, self.seed, self._shf, self.du.to('meter').value)
+        rn, shn = _generate_noise(self._filter.shape, self.seed, self.spectral)
+        self._screen = self._generate_screen_with_noise(rn, shn)
+        
+    def _generate_screen_with_noise(self, noise, shnoise):
+        """Generate a screen, or a stack of screens, from noise made by :func:`_generate_noise`."""
+        du = self.du.to('meter').value
+        if self.spectral:
+            return _generate_screen_with_spectral_noise(self._sf, noise, self._shf, shnoise, du, self.fft)
+        return _generate_screen_with_noise(self._filter, noise, self._shf, shnoise, du, self.fft)
         
     def __call__(self):
         """Generates and returns a new independent screen."""
         self._generate_screen()
         return self.screen
         
+    batch_size = 16
+    """Default number of screens generated together by :meth:`generate_batch`."""
+        
+    def generate_batch(self, k, seeds=None, out=None, batch_size=None):
+        """Generate a stack of independent screens, without changing the current screen.
+        
+        The screens are generated in batches of ``batch_size``, using one stacked FFT for each
+        batch, and re-using this screen's filter.
         
+        :param int k: The number of screens.
+        :param seeds: A sequence of ``k`` seeds, one for each screen. The screen for each seed
+            matches the screen generated by setting :attr:`seed`. A single :class:`numpy.random.Generator`
+            or :class:`numpy.random.SeedSequence` spawns an independent child for each screen. By default,
+            children are spawned from :attr:`seed` if it is a generator or seed sequence, and otherwise each
+            screen is seeded randomly.
+        :param out: An array with shape ``(k, n, m)`` to hold the screens, such as a :class:`numpy.memmap`,
+            or the filename of a ``.npy`` file to create as a memory mapped array.
+        :param int batch_size: The number of screens to generate at once. Defaults to :attr:`batch_size`.
+        :returns: The stack of screens, with shape ``(k, n, m)``. This is ``out``, if it was provided.
         
+        """
+        k = int(k)
+        if seeds is None and _is_seed_sequence(self.seed):
+            seeds = self.seed
+        if seeds is None:
+            seeds = [None] * k
+        elif _is_seed_sequence(seeds):
+            seeds = _spawn_seeds(seeds, k)
+        else:
+            seeds = list(seeds)
+        if len(seeds) != k:
+            raise ValueError("Expected {0:d} seeds, got {1:d}.".format(k, len(seeds)))
+        if self._filter is None:
+            self._generate_filter()
+        
+        shape = (k,) + self._filter.shape
+        if out is None:
+            out = np.empty(shape, dtype=self.dtype)
+        elif isinstance(out, six.string_types):
+            from numpy.lib.format import open_memmap
+            out = open_memmap(out, mode='w+', dtype=self.dtype, shape=shape)
+        if out.shape != shape:
+            raise ValueError("Output should have shape {0!r}. Found {1!r}.".format(shape, out.shape))
+        batch_size = int(batch_size or self.batch_size)
+        
+        for start in range(0, k, batch_size):
+            batch = slice(start, start + batch_size)
+            out[batch] = self._generate_screen_with_noise(*_generate_noises(self._filter.shape, seeds[batch], self.spectral, self.dtype))
+        if isinstance(out, np.memmap):
+            out.flush()
+        return out
+        
+        
+    
     
\ No newline at end of file
@@ -16,15 +16,40 @@ from __future__ import (absolute_import, unicode_literals, division,
 
 # Python
 import warnings, logging
+import collections
+import threading
+import multiprocessing
 
 # Numpy
 import numpy as np
 
 import astropy.units as u
 from ..util.units import ensure_quantity
-from ..util.math import fast_shift
+from ..util.math import Shifter
+from ..util.basic import thread_map
 
-from .screen import Screen, _generate_screen
+from .screen import Screen, _generate_screen, _is_seed_sequence, _spawn_seeds
+
+def _wrapped_spline_filter(screen, order, dtype, pad=32):
+    """Spline filter a periodic screen.
+    
+    :func:`scipy.ndimage.interpolation.spline_filter` mirrors the screen at its edges, which gives the wrong
+    spline coefficients where a shifted screen wraps around. Instead, the screen is padded periodically before
+    filtering, and the padding is discarded afterwards, leaving coefficients which are accurate across the seam.
+    
+    :param screen: The periodic screen.
+    :param int order: The spline interpolation order. Orders below 2 require no filtering.
+    :param dtype: The floating point type of the coefficients.
+    :param int pad: The periodic padding.
+    :returns: The spline coefficients for the screen, as a C-contiguous array.
+    """
+    import scipy.ndimage.interpolation
+    if order < 2:
+        return np.ascontiguousarray(screen, dtype=dtype)
+    padded = np.pad(screen, pad, mode='wrap')
+    filtered = scipy.ndimage.interpolation.spline_filter(padded, order, output=dtype)
+    # A contiguous copy, so that shifting doesn't copy the padded screen on every frame.
+    return np.ascontiguousarray(filtered[pad:-pad,pad:-pad])
 
 class BlowingScreen(Screen):
     """A blowing Kolmolgorov Phase Screen Class. This class builds a Komologorv Filter and then generates a phase screen for that filter. The phase screen is then read out in parts (interpolated, where necessary) so that it appears to "blow" in a frozen-flow style across as screen of the desired shape. Once a single phase screen has been generated, it is cached in the object. For a new phase screen, set a different :attr:`seed` value.
@@ -39,9 +64,19 @@ class BlowingScreen(Screen):
     :param float dt: Timestep size, in seconds.
     :param float du: pixel size, in meters
     :param int nsh: Number of subharmonics. (default``=0`` for no subharmonics)
+    :param int order: The spline interpolation order, for sub-pixel shifts.
+    :param str shift_method: How to make sub-pixel shifts, either ``'spline'`` to interpolate with splines
+        of order ``order``, or ``'fourier'`` to multiply the spectrum of the screen by a phase ramp. Fourier
+        shifts are exact for these periodic screens, and don't smooth high frequency power, but keep the
+        complex spectrum of the whole screen in memory, and use one inverse FFT of the whole screen per frame,
+        which makes them roughly 3 to 10 times slower per frame than spline shifts (slowest for small outputs).
+        Fourier mode also enlarges the screen to a fast FFT size, so the same ``seed`` produces a different
+        screen in each mode, unless the screen is already a fast FFT size.
+    :param str cache: A file which holds :attr:`all` of the screens on disk, rather than in memory, either
+        a numpy ``.npy`` file, which is memory mapped, or an HDF5 (``.hdf5`` or ``.h5``) file.
     
     """ 
-    def __init__(self, shape, r0, seed=None, vel=None, tmax=100, dt=1, delay=False, order=3, **kwargs):
+    def __init__(self, shape, r0, seed=None, vel=None, tmax=100, dt=1, delay=False, order=3, shift_method='spline', cache=None, **kwargs):
         super(BlowingScreen, self).__init__(shape, r0, seed, delay=True, **kwargs)
         # Sanitize Velocities
         if vel is None:
@@ -58,9 +93,15 @@ class BlowingScreen(Screen):
         self._stepshape = tuple(np.fix((np.array(self.shape) + np.abs(self._vel) * np.ceil(1.0 * u.s / self._du)).to('').value).astype(np.int))
         self._shape = tuple(np.fix((np.array(self.shape) + np.abs(self._vel) * np.ceil(self._tmax / self._du)).to('').value).astype(np.int))
         self._order = order
+        if shift_method not in ('spline', 'fourier'):
+            raise ValueError("Shift method must be 'spline' or 'fourier', not {0!r}".format(shift_method))
+        self._shift_method = shift_method
+        self._prepare_shifts()
         
         # Setup generated variables
+        self._cache = cache
         self._all = None
+        self._frames = None
         self._ti = 0
         self._filtered_screen = None
         if not delay:
@@ -76,12 +117,24 @@ class BlowingScreen(Screen):
     _order = None
     _ti = None
     _filtered_screen = None
+    _shifter = None
+    _buffers = None
+    _shift_method = 'spline'
+    _spectra = None
+    _cache = None
+    _cache_file = None
+    _frames = None
     
     @property
     def velocity(self):
         """The wind velocity vector for this screen. A 1-dimensional array with ``[v_x,v_y]``. **Read-Only**"""
         return self._vel
         
+    @property
+    def shift_method(self):
+        """The method used for sub-pixel shifts, ``'spline'`` or ``'fourier'``. **Read-Only**"""
+        return self._shift_method
+        
     @property
     def dt(self):
         """Timestep"""
@@ -115,29 +168,120 @@ class BlowingScreen(Screen):
         
     def _generate_screen(self):
         """Ensure filtered screen is generated."""
-        import scipy.ndimage.interpolation
         super(BlowingScreen, self)._generate_screen()
-        self._filtered_screen = scipy.ndimage.interpolation.spline_filter(self._screen, self._order)
+        self._reset_frames()
+        if self._shift_method == 'fourier':
+            self._spectra = self.fft.fft2(self._screen[np.newaxis])
+        else:
+            self._filtered_screen = _wrapped_spline_filter(self._screen, self._order, self.dtype)
+    
+    
+    def _prepare_shifts(self):
+        """Prepare the shifter and buffers used by :meth:`get_screen`.
+        
+        Frames are read from windows of the screen, padded by enough pixels for spline interpolation,
+        so the shifter is cached for the screen and output shapes. Screens shifted in Fourier space are
+        enlarged to a size with a fast FFT.
+        """
+        if self._shift_method == 'fourier':
+            from scipy.fftpack import next_fast_len
+            self._shape = tuple(next_fast_len(int(s)) for s in self._shape)
+        self._shifter = Shifter.cached(self._shape, self._outshape, pad=self._order // 2 + 1)
+        self._buffers = threading.local()
+        
+    def _shift_buffers(self):
+        """The window and interpolation buffers for :meth:`_shift`, for the current thread."""
+        buffers = getattr(self._buffers, 'shift', None)
+        if buffers is None:
+            buffers = self._buffers.shift = (np.empty(self._shifter.window_shape, dtype=self.dtype),
+                np.empty(self._shifter.window_shape, dtype=self.dtype))
+        return buffers
+    
+    def _shift(self, screen, filtered, shift):
+        """Shift a single layer.
+        
+        :param screen: The layer.
+        :param filtered: The spline coefficients of the layer.
+        :param shift: The shift, in pixels.
+        :returns: A view of the shifted layer, which is overwritten by the next shift.
+        
+        The integer part of the shift is taken as a wrapped window of the layer, and the fractional
+        part is interpolated with a single spline evaluation on that window.
+        """
+        import scipy.ndimage.interpolation
+        window, interped = self._shift_buffers()
+        floor = np.floor(shift)
+        fraction = shift - floor
+        if (fraction != 0.0).any():
+            # Interpolate from the spline coefficients, which are already filtered.
+            self._shifter.take(filtered, floor, out=window)
+            scipy.ndimage.interpolation.shift(window, fraction, output=interped,
+                order=self._order, mode='nearest', prefilter=False)
+            return self._shifter.crop(interped)
+        else:
+            self._shifter.take(screen, floor, out=window)
+            return self._shifter.crop(window)
+        
+    def _layers(self):
+        """The layers of this screen, and their spline coefficients."""
+        return self._screen[np.newaxis], self._filtered_screen[np.newaxis]
         
+    def _shifts(self, t):
+        """The shift of each layer at times `t`, in pixels, with shape ``t.shape + (layers, 2)``."""
+        t = ensure_quantity(t,u.second)
+        t = t.reshape(t.shape + (1, 1))
+        return (t * self._vel.reshape((-1, 2)) / self._du).to(1).value
+        
+    def _fourier_screens(self, shifts):
+        """Shift the layers in Fourier space, and sum them.
+        
+        :param shifts: The shifts, in pixels, with shape ``(nt, layers, 2)``.
+        :returns: The screens, with shape ``(nt, n, m)``.
+        
+        A shift is a phase ramp on the spectrum of each periodic layer. The ramps are separable, so
+        they are applied as a product of 1-D ramps, summed over layers, and each screen is made with
+        a single inverse FFT.
+        """
+        n, m = self._outshape
+        ramps = [np.exp(-2j * np.pi * shifts[...,axis,np.newaxis] * np.fft.fftfreq(length)).astype(self._spectra.dtype)
+            for axis, length in enumerate(self._shape)]
+        spectra = np.einsum('tli,tlj,lij->tij', ramps[0], ramps[1], self._spectra)
+        return self.fft.ifft2(spectra)[:,:n,:m].real.astype(self.dtype)
         
     def get_screen(self,t):
         """Get a screen at time `t`.
         
         :param int t: The timestep at which to retrieve the screen.
         :returns: The screen for this timestep.
+        
+        Layers are shifted one at a time, and accumulated directly into the output screen.
         """
-        import scipy.ndimage.interpolation
-        shift = (ensure_quantity(t,u.second) * self._vel / self._du).to('').value
-        shifted = fast_shift(
-            source = self._filtered_screen,
-            shift = shift,
-            order = self._order,
-            mode = 'wrap', #So we go in circles!
-            prefilter = False, #Because we already filtered it!
-            shape = self._outshape,
-        )
+        shifts = self._shifts(t)
+        if self._shift_method == 'fourier':
+            return self._fourier_screens(shifts[np.newaxis])[0]
+        shifted = np.zeros(self._outshape, dtype=self.dtype)
+        for shift, screen, filtered in zip(shifts, *self._layers()):
+            shifted += self._shift(screen, filtered, shift)
         return shifted
         
+    def get_screens(self, ts, batch_size=None):
+        """Get screens at many times.
+        
+        :param ts: The timesteps at which to retrieve screens.
+        :param int batch_size: The number of screens to shift at once in Fourier space. Defaults to :attr:`batch_size`.
+        :returns: An array of screens, with shape ``(len(ts), n, m)``.
+        """
+        ts = ensure_quantity(ts,u.second).reshape((-1,))
+        screens = np.empty((len(ts),) + self._outshape, dtype=self.dtype)
+        if self._shift_method == 'fourier':
+            batch_size = batch_size or self.batch_size
+            for start in range(0, len(ts), batch_size):
+                screens[start:start + batch_size] = self._fourier_screens(self._shifts(ts[start:start + batch_size]))
+        else:
+            for i, t in enumerate(ts):
+                screens[i] = self.get_screen(t)
+        return screens
+        
     @property
     def screen(self):
         """Counter movement screen"""
@@ -146,7 +290,7 @@ class BlowingScreen(Screen):
         
     def __len__(self):
         """Length"""
-        return (self._tmax // self._dt).to('').value
+        return int((self._tmax // self._dt).to('').value)
         
     @property
     def screens(self):
@@ -162,25 +306,168 @@ class BlowingScreen(Screen):
         for _i in range(len(self)):
             yield self.screen
             
+    @property
+    def cache(self):
+        """The file which holds :attr:`all` of the screens, or ``None`` to hold them in memory. **Read-Only**"""
+        return self._cache
+        
     @property
     def all(self):
-        """An array of all possible screens. This array is lazily evaluated. **Read-Only**"""
-        if self._all is not None:
-            return self._all
+        """An array of all possible screens. This array is lazily evaluated, with :meth:`compute_all`,
+        and is memory mapped from :attr:`cache` if it is set. **Read-Only**"""
+        if self._all is None:
+            self.compute_all()
+        return self._all
+        
+    @property
+    def frames(self):
+        """A lazy, indexable view of all possible screens, which computes screens when they are accessed,
+        and keeps recently used screens. **Read-Only**
+        
+        Use like::
+            
+            screen = blowing.frames[10]
+            
+        """
+        if self._frames is None:
+            self._frames = LazyScreens(self)
+        return self._frames
+        
+    def _reset_frames(self):
+        """Discard computed screens, which are out of date when the screen is regenerated."""
+        self.close_cache()
+        self._frames = None
+        
+    def close_cache(self):
+        """Close the HDF5 :attr:`cache` file, if it is open, and discard :attr:`all`. It is opened again
+        when :attr:`all` is used."""
+        self._all = None
+        if self._cache_file is not None:
+            self._cache_file.close()
+            self._cache_file = None
+        
+    @property
+    def concurrent(self):
+        """Whether screens can be computed concurrently in threads. Spline shifts use :mod:`scipy.ndimage`,
+        which releases the GIL, and Fourier shifts release the GIL if the FFT backend does
+        (see :meth:`~aopy.util.fft.FFTBackend.concurrent`). **Read-Only**"""
+        if self._shift_method == 'fourier':
+            return self.fft.concurrent()
+        return True
+        
+    def compute_all(self, workers=None, chunk_size=None):
+        """Compute all possible screens, in chunks of screens spread over a group of threads.
+        
+        The screens are written to :attr:`cache` if it is set, and the cache is overwritten. When
+        :attr:`concurrent` is not set, the chunks are computed serially, without starting any threads.
+        
+        :param int workers: The number of threads. Defaults to the number of CPUs.
+        :param int chunk_size: The number of screens in each chunk. Defaults to :attr:`batch_size`.
+        :returns: The screens, with shape ``(len(self), n, m)``, as an array, a read-only memory mapped
+            array for a ``.npy`` cache, or a :class:`h5py.Dataset` for an HDF5 cache, which stays open until
+            :meth:`close_cache` is called, or the screens are computed again.
+        """
+        nt = int(len(self))
+        shape = (nt,) + self._outshape
+        workers = int(workers or multiprocessing.cpu_count())
+        if workers < 1:
+            raise ValueError("workers must be positive, got {0:d}".format(workers))
+        chunk_size = max(int(chunk_size or self.batch_size), 1)
+        self.close_cache()
+        
+        if self._cache is None:
+            output = np.empty(shape, dtype=self.dtype)
+        elif self._cache.endswith('.hdf5') or self._cache.endswith('.h5'):
+            import h5py
+            cache = h5py.File(self._cache, 'w')
+            output = cache.create_dataset('screens', shape=shape, dtype=self.dtype, chunks=(1,) + self._outshape)
         else:
-            self._all = np.zeros((len(self),)+self._outshape)
-            for ti in self.looper(range(len(self))):
-                self._all[ti,...] = self.get_screen(ti * self._dt)
-            self._all.flags.writeable = False
-            return self._all
-
+            from numpy.lib.format import open_memmap
+            output = open_memmap(self._cache, mode='w+', dtype=self.dtype, shape=shape)
+            
+        def _compute_chunk(start):
+            ts = np.arange(start, min(start + chunk_size, nt)) * self._dt
+            output[start:start + len(ts)] = self.get_screens(ts)
+            
+        starts = range(0, nt, chunk_size)
+        if workers == 1 or len(starts) <= 1 or not self.concurrent:
+            for start in self.looper(starts):
+                _compute_chunk(start)
+        else:
+            thread_map(_compute_chunk, starts, min(workers, len(starts)))
+                
+        if self._cache is None:
+            output.flags.writeable = False
+        elif isinstance(output, np.ndarray):
+            output.flush()
+            output = np.load(self._cache, mmap_mode='r')
+        else:
+            cache.close()
+            self._cache_file = h5py.File(self._cache, 'r')
+            output = self._cache_file['screens']
+        self._all = output
+        return self._all
+        
+class LazyScreens(object):
+    """A lazy, indexable view of the screens of a :class:`BlowingScreen`, with one screen per timestep.
+    
+    Screens are computed when they are accessed, and the most recently used screens are kept.
+    
+    :param screen: The :class:`BlowingScreen`.
+    :param int cache_size: The number of screens to keep. Defaults to :attr:`cache_size`.
+    """
+    
+    cache_size = 32
+    """The number of recently used screens to keep."""
+    
+    def __init__(self, screen, cache_size=None):
+        super(LazyScreens, self).__init__()
+        self.screen = screen
+        if cache_size is not None:
+            self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        
+    def __len__(self):
+        """The number of screens."""
+        return int(len(self.screen))
+        
+    def __iter__(self):
+        """Iterate over the screens."""
+        for t in range(len(self)):
+            yield self[t]
+        
+    def _get(self, t):
+        """Get a single screen, from the cache if possible."""
+        frame = self._cache.pop(t, None)
+        if frame is None:
+            frame = self.screen.get_screen(t * self.screen.dt)
+            frame.flags.writeable = False
+        self._cache[t] = frame
+        while len(self._cache) > max(self.cache_size, 0):
+            self._cache.popitem(last=False)
+        return frame
+        
+    def __getitem__(self, index):
+        """Get a screen, or a stack of screens for a slice or sequence of timesteps."""
+        if isinstance(index, slice):
+            return np.array([self._get(t) for t in range(*index.indices(len(self)))]).reshape((-1,) + self.screen._outshape)
+        if np.ndim(index) > 0:
+            return np.array([self[t] for t in index]).reshape(np.shape(index) + self.screen._outshape)
+        t = int(index)
+        if t < 0:
+            t += len(self)
+        if not 0 <= t < len(self):
+            raise IndexError("Screen index {0!r} out of range for {1:d} screens.".format(index, len(self)))
+        return self._get(t)
+        
 class ManyLayerScreen(BlowingScreen):
     """A blowing Kolmolgorov Phase Screen Class with multiple layer support. This class builds a Komologorv Filter and then generates a phase screen for each layer with that filter. The phase screens are then read out in parts (interpolated, where necessary) so that they appears to "blow" in a frozen-flow style across as screen of the desired shape. Once a set of phase screens has been generated, they are cached in the object. For a new phase screen, set a different :attr:`seed` value.
     
     :param tuple shape: The shape of the screen (x,y), as a tuple.
     :param float r0: :math:`r_0` fried parameter for the screen.
     :param float L0: :math:`L_0` outer scale for the screen.
-    :param int seed: Random number generator seed for :mod:`numpy.random`
+    :param int seed: Random number generator seed for :mod:`numpy.random`. A :class:`numpy.random.Generator` or
+        :class:`numpy.random.SeedSequence` spawns an independent stream for each layer.
     :param array vel: The velocity array, at least 2-dimensional, ``[[v_x1,v_y1],[v_x2,v_y2]]``
     :param array strength: The relative strengths of each layer. (by default, all layers have the same strength.)
     :param float tmax: The amount of time to generate phase for, in seconds. Timesteps 
@@ -188,6 +475,8 @@ class ManyLayerScreen(BlowingScreen):
     :param float dt: Timestep size, in seconds.
     :param float du: Pixel size, in meters.
     :param int nsh: Number of subharmonics. (default``=0`` for no subharmonics)
+    :param str shift_method: How to make sub-pixel shifts, ``'spline'`` or ``'fourier'``. See
+        :class:`BlowingScreen` for the speed and seeding differences between the two.
     
     """ 
     def __init__(self, shape, r0, seed=None, vel=None, strength=None, delay=False, **kwargs):
@@ -207,10 +496,12 @@ class ManyLayerScreen(BlowingScreen):
         super(ManyLayerScreen, self).__init__(shape, r0, seed, vel=None, delay=True, **kwargs)
         
         self._vel = vel
-        self._shape = tuple(np.fix((np.array(self.shape) + np.abs(np.max(self._vel,axis=0)) * np.ceil(self._tmax / self._du)).to('').value))
+        self._shape = tuple(np.fix((np.array(self._outshape) + np.max(np.abs(self._vel),axis=0) * np.ceil(self._tmax / self._du)).to('').value).astype(np.int))
         
-        self._screens = np.zeros((self._vel.shape[0],)+self._shape)
-        self._filtered_screens = np.zeros_like(self._screens)
+        self._prepare_shifts()
+        
+        self._screens = np.zeros((self._vel.shape[0],)+self._shape, dtype=self.dtype)
+        self._filtered_screens = np.zeros_like(self._screens) if self._shift_method == 'spline' else None
         
         if not delay:
             self.setup()
@@ -222,34 +513,24 @@ class ManyLayerScreen(BlowingScreen):
         
         :param seed: The random number generator seed.
         """
-        import scipy.ndimage.interpolation
+        self._reset_frames()
         norm = np.sum(self._strength)
-        for i, strength in enumerate(self._strength):
-            screen = _generate_screen(self._filter, self.seed, self._shf, self.du.to('meter').value) * (strength/norm)
+        if _is_seed_sequence(self.seed):
+            seeds = _spawn_seeds(self.seed, len(self._strength))
+        else:
+            seeds = [self.seed] * len(self._strength)
+        for i, (seed, strength) in enumerate(zip(seeds, self._strength)):
+            screen = _generate_screen(self._filter, seed, self._shf, self.du.to('meter').value, self.fft, self.spectral) * self.dtype.type(strength/norm)
             self._screens[i,...] = screen
-            self._filtered_screens[i,...] = scipy.ndimage.interpolation.spline_filter(screen, self._order)
+            if self._shift_method == 'spline':
+                self._filtered_screens[i,...] = _wrapped_spline_filter(screen, self._order, self.dtype)
+        if self._shift_method == 'fourier':
+            self._spectra = self.fft.fft2(self._screens)
             
         
         
-    def get_screen(self,t):
-        """Get a screen at time `t`.
+    def _layers(self):
+        """The layers of this screen, and their spline coefficients."""
+        return self._screens, self._filtered_screens
         
-        :param int t: The timestep at which to retrieve the screen.
-        :returns: The screen for this timestep.
-        """
-        import scipy.ndimage.interpolation
-        shifts = (ensure_quantity(t,u.second) * self._vel / self._du).to(1).value
-        shifted = np.zeros((len(shifts),) + self._outshape)
-        for i,(shift,screen) in enumerate(zip(shifts, self._filtered_screens)):
-            shifted[i,...] = fast_shift(
-                source = screen,
-                shift = shift,
-                order = self._order,
-                mode = 'wrap', #So we go in circles!
-                prefilter = False, #Because we already filtered it!
-                # prefilter=True means **apply the prefilter**. Since we are using filtered screens, don't worry!
-                shape = self._outshape,
-            )
-        shifted = np.sum(shifted, axis=0)
-        return shifted
-        
\ No newline at end of file
+
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# 
+#  cli.py
+#  aopy
+#  
+#  Created by Alexander Rudy on 2014-08-02.
+#  Copyright 2014 Alexander Rudy. All rights reserved.
+# 
+
+from __future__ import (absolute_import, unicode_literals, division,
+                        print_function)
+
+import pyshell
+import six
+import os, os.path
+
+class ReconstructTelemetry(pyshell.CLIEngine):
+    """Reconstruct phase from slope telemetry."""
+    
+    defaultcfg = False
+    
+    def init(self):
+        """Initialize!"""
+        super(ReconstructTelemetry, self).init()
+        self.parser.add_argument('-o', dest="output", default=None, help="The output phase file.")
+        
+    def after_configure(self):
+        """Add positional arguments to the file."""
+        super(ReconstructTelemetry, self).after_configure()
+        self.parser.add_argument('--ap', type=six.text_type, default=None, help="A FITS file with the aperture, enables slope management.")
+        self.parser.add_argument('--filter', type=six.text_type, default='mod_hud', help="The reconstruction filter.")
+        self.parser.add_argument('--manage-tt', dest='manage_tt', action='store_true', help="Remove and restore tip/tilt.")
+        self.parser.add_argument('--extend', action='store_true', help="Use edge extension instead of slope management.")
+        self.parser.add_argument('--batch-size', dest='batch_size', type=int, default=64, help="Frames to reconstruct at once.")
+        self.parser.add_argument('--float32', action='store_true', help="Reconstruct in single precision.")
+        self.parser.add_argument('--fft-backend', dest='fft_backend', type=six.text_type, help='FFT backend (numpy, scipy or fftw)', default=None)
+        self.parser.add_argument('--hdf5', type=six.text_type, default='slopes', help='Data path for HDF5 files.')
+        self.parser.add_argument('--ext', type=int, default=0, help='FITS extension with the slopes.')
+        self.parser.add_argument('file', help="The input slope telemetry file.", metavar="slopes.fits")
+        
+    def get_reconstructor(self, n):
+        """Make the reconstructor."""
+        import numpy as np
+        dtype = np.float32 if self.opts.float32 else np.float64
+        if self.opts.ap is None:
+            if self.opts.manage_tt or self.opts.extend:
+                self.parser.error("--manage-tt and --extend require an aperture, see --ap.")
+            from .ftr import FourierTransformReconstructor
+            return FourierTransformReconstructor(n, filter=self.opts.filter, fft=self.opts.fft_backend, dtype=dtype)
+        from astropy.io import fits
+        from .slopemanage import SlopeManagedFTR
+        ap = fits.getdata(self.opts.ap).astype(bool)
+        reconstructor = SlopeManagedFTR(n, ap, filter=self.opts.filter, manage_tt=self.opts.manage_tt,
+            extend=self.opts.extend, dtype=dtype)
+        reconstructor.fft = self.opts.fft_backend
+        return reconstructor
+        
+    def do(self):
+        """Reconstruct the telemetry."""
+        from .pipeline import reconstruct_file, _open_slopes
+        
+        if self.opts.output is None:
+            root, ext = os.path.splitext(self.opts.file)
+            self.opts.output = root + '_phase' + ext
+        
+        with _open_slopes(self.opts.file, ext=self.opts.ext, path=self.opts.hdf5) as slopes:
+            n = slopes.shape[-1]
+        
+        reconstructor = self.get_reconstructor(n)
+        nt = reconstruct_file(reconstructor, self.opts.file, self.opts.output,
+            batch_size=self.opts.batch_size, ext=self.opts.ext, path=self.opts.hdf5)
+        self.log.info("Reconstructed {0:d} frames to '{1:s}'".format(nt, self.opts.output))
+
+if __name__ == '__main__':
+    ReconstructTelemetry.script()
@@ -20,6 +20,8 @@ from __future__ import (absolute_import, unicode_literals, division,
 import abc
 import six
 import collections
+import threading
+import multiprocessing
 
 # Scientific Python Imports
 import numpy as np
@@ -28,6 +30,8 @@ from astropy.utils import lazyproperty
 
 # Local imports
 from ..util.math import complexmp, ignoredivide
+from ..util.fft import get_backend
+from ..util.basic import thread_map
 
 FTRFilter = collections.namedtuple("FTRFilter", ["gx", "gy", "name"])
 
@@ -40,16 +44,27 @@ class FourierTransformReconstructor(object):
     _gy = None
     _n = 0
     _dzero = None
+    _denominator = None
+    _kernels = None
+    _half_kernels = None
+    _local = None
+    _rfft = False
+    _fft = None
+    _dtype = np.dtype(np.float64)
     _filtername = "UNDEFINED"
     
     def __repr__(self):
         """Represent this object."""
         return "<{0} ({1:d}x{2:d}) filter='{3}'>".format(self.__class__.__name__, self.n, self.n, self.name)
     
-    def __init__(self, n, filter=None):
+    def __init__(self, n, filter=None, rfft=False, fft=None, dtype=np.float64):
         super(FourierTransformReconstructor, self).__init__()
         self._n = n
         self._filtername = "Unknown"
+        self._local = threading.local()
+        self.rfft = rfft
+        self.fft = fft
+        self.dtype = dtype
         if filter is not None:
             self.use(filter)
         
@@ -78,6 +93,57 @@ class FourierTransformReconstructor(object):
         """Shape of the reconstructed grid."""
         return (self.n, self.n)
         
+    @property
+    def rfft(self):
+        """Whether to use real-input FFTs for reconstruction.
+        
+        Slopes are always real, so their transforms are Hermitian, and only half of the
+        spectrum needs to be computed. When this is set, reconstruction uses :func:`numpy.fft.rfftn`
+        and :func:`numpy.fft.irfftn` style transforms with the half-spectrum filter kernels from :attr:`half_kernels`.
+        """
+        return self._rfft
+        
+    @rfft.setter
+    def rfft(self, value):
+        """Set the real-input FFT mode."""
+        self._rfft = bool(value)
+        
+    @property
+    def dtype(self):
+        """The floating point type used for reconstruction, ``float64`` or ``float32``.
+        
+        Slopes are converted to this type, the filter kernels are kept in the matching complex
+        type, and the reconstructed phase has this type. Single precision halves the memory and
+        bandwidth used, and is accurate to about one part in :math:`10^6`.
+        """
+        return self._dtype
+        
+    @dtype.setter
+    def dtype(self, value):
+        """Set the reconstruction type."""
+        dtype = np.dtype(value)
+        if dtype.kind != 'f':
+            raise ValueError("dtype must be a floating point type, got {0!r}".format(dtype))
+        self._dtype = dtype
+        self._kernels = None
+        self._half_kernels = None
+        
+    @property
+    def fft(self):
+        """The :class:`~aopy.util.fft.FFTBackend` used for reconstruction.
+        
+        Set this to a backend instance or name to use that backend, or to ``None`` to follow
+        the global default from :func:`~aopy.util.fft.set_backend`.
+        """
+        return get_backend(self._fft)
+        
+    @fft.setter
+    def fft(self, value):
+        """Set the FFT backend."""
+        if value is not None:
+            get_backend(value)
+        self._fft = value
+        
     @property
     def gx(self):
         """The x filter"""
@@ -88,6 +154,8 @@ class FourierTransformReconstructor(object):
         """Set the x filter"""
         self._gx = self._validate_filter(gx)
         self._denominator = None
+        self._kernels = None
+        self._half_kernels = None
         self._filtername = "Unknown"
         
     @property
@@ -100,6 +168,8 @@ class FourierTransformReconstructor(object):
         """Set and validate the y filter"""
         self._gy = self._validate_filter(gy)
         self._denominator = None
+        self._kernels = None
+        self._half_kernels = None
         self._filtername = "Unknown"
         
         
@@ -111,12 +181,16 @@ class FourierTransformReconstructor(object):
         :param _filter: The filter array to check.
         :returns: The filter, correctly typed and checked for consistency.
         """
-        gf = np.asarray(_filter).astype(np.complex)
-        if gf.shape != (self.n, self.n):
-            raise ValueError("Filter should be same shape as input data. Found {0}, expected {1}.".format(gf.shape, (self.n, self.n)))
-        if not np.isfinite(gf).all():
-            raise ValueError("Filter must be finite at all points!")
-        return gf
+        return _validate_filter(_filter, self.n)
+        
+    def _set_filter(self, gx, gy, name):
+        """Set already validated filter components, and reset everything derived from them."""
+        self._gx = gx
+        self._gy = gy
+        self._denominator = None
+        self._kernels = None
+        self._half_kernels = None
+        self._filtername = name
         
     @property
     def denominator(self):
@@ -127,28 +201,210 @@ class FourierTransformReconstructor(object):
         self._denominator[(self._denominator == 0.0)] = 1.0 #Fix non-hermetian parts.
         return self._denominator
         
-    def apply_filter(self, xs_ft, ys_ft):
+    @property
+    def kernels(self):
+        """The combined filter kernels, ``(conj(gx)/denominator, conj(gy)/denominator)``.
+        
+        The kernels are computed once per filter, and are reset whenever :attr:`gx` or :attr:`gy` is set.
+        They have the complex type matching :attr:`dtype`. **Read-Only**
+        """
+        if self._kernels is None:
+            ctype = np.result_type(self.dtype, np.complex64)
+            kx = (np.conj(self.gx) / self.denominator).astype(ctype)
+            ky = (np.conj(self.gy) / self.denominator).astype(ctype)
+            kx.flags.writeable = False
+            ky.flags.writeable = False
+            self._kernels = (kx, ky)
+        return self._kernels
+        
+    @property
+    def half_kernels(self):
+        """The filter kernels in half-spectrum form, for use with real-input FFTs.
+        
+        The kernels are made Hermitian, ``(K(k) + conj(K(-k)))/2``, and then truncated to the
+        non-negative frequencies of the last axis. Applied to the transform of real slopes, this
+        gives exactly the real part of the full-spectrum reconstruction. **Read-Only**
+        """
+        if self._half_kernels is None:
+            flip = -np.arange(self.n) % self.n
+            half = self.n // 2 + 1
+            kernels = []
+            for kernel in self.kernels:
+                hermitian = 0.5 * (kernel + np.conj(kernel[np.ix_(flip, flip)]))
+                hermitian = np.ascontiguousarray(hermitian[:, :half])
+                hermitian.flags.writeable = False
+                kernels.append(hermitian)
+            self._half_kernels = tuple(kernels)
+        return self._half_kernels
+        
+    def _filter_buffers(self, shape, dtype):
+        """Preallocated ``(estimate, scratch)`` buffers for :meth:`_apply_filter_into`, private to the calling thread."""
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None or buffers[0].shape != shape or buffers[0].dtype != dtype:
+            buffers = self._local.buffers = (np.empty(shape, dtype=dtype), np.empty(shape, dtype=dtype))
+        return buffers
+        
+    def _filter_kernels(self, xs_ft, ys_ft):
+        """The kernels for the transforms, and the shape and type of the estimate."""
+        kx, ky = self.half_kernels if self.rfft else self.kernels
+        return kx, ky, np.broadcast(xs_ft, kx).shape, np.result_type(xs_ft, ys_ft, kx)
+        
+    def _apply_filter_into(self, xs_ft, ys_ft):
+        """Apply the filter, writing the estimate into a buffer owned by this reconstructor, which
+        is re-used by the next call from the same thread."""
+        kx, ky, shape, dtype = self._filter_kernels(xs_ft, ys_ft)
+        est_ft, scratch = self._filter_buffers(shape, dtype)
+        np.multiply(xs_ft, kx, out=est_ft)
+        np.multiply(ys_ft, ky, out=scratch)
+        est_ft += scratch
+        return est_ft
+        
+    def apply_filter(self, xs_ft, ys_ft, out=None):
         """Apply the filter to the FFT'd values.
         
         :param xs_ft: The x fourier transform
         :param ys_ft: THe y fourier transform
+        :param out: An array in which to put the estimate. By default, a new array is returned.
         :returns: The filtered estimate, fourier transformed.
         
+        When :attr:`rfft` is set, the transforms should be half-spectra, from :func:`numpy.fft.rfftn`.
+        
         """
-        return (xs_ft * np.conj(self.gx) + ys_ft * np.conj(self.gy))/self.denominator
+        kx, ky, shape, dtype = self._filter_kernels(xs_ft, ys_ft)
+        if out is None:
+            out = np.empty(shape, dtype=dtype)
+        np.multiply(xs_ft, kx, out=out)
+        out += ys_ft * ky
+        return out
         
     def reconstruct(self, xs, ys, axes=(0,1)):
         """The reconstruction method"""
         
-        xs_ft = scipy.fftpack.fftn(xs, axes=axes)
-        ys_ft = scipy.fftpack.fftn(ys, axes=axes)
+        xs = np.asarray(xs, dtype=self.dtype)
+        ys = np.asarray(ys, dtype=self.dtype)
+        if self.rfft:
+            return self._reconstruct_rfft(xs, ys, axes=axes)
+        
+        fft = self.fft
+        xs_ft = fft.fftn(xs, axes=axes)
+        ys_ft = fft.fftn(ys, axes=axes)
+        
+        est_ft = self._apply_filter_into(xs_ft, ys_ft)
+        
+        estimate = np.real(fft.ifftn(est_ft, axes=axes))
+        
+        return estimate.astype(self.dtype, copy=False)
+        
+    def prepare(self, batch=None):
+        """Prepare this reconstructor, so that the first frame is reconstructed at steady-state latency.
+        
+        This computes the filter kernels, allocates the filter buffers, and asks the FFT
+        backend to plan its transforms (see :class:`~aopy.util.fft.FFTWPlanCache`).
+        
+        :param int batch: Prepare for batches of this many frames, as used by :meth:`reconstruct_many`.
+            By default, prepares for single frames.
+        :returns: A reference to this instance (``self``)
+        """
+        if batch is None:
+            shape, axes = self.shape, (0,1)
+        else:
+            shape, axes = (batch,) + self.shape, (1,2)
+        kx, ky = self.half_kernels if self.rfft else self.kernels
+        self._filter_buffers(shape[:-1] + kx.shape[-1:], kx.dtype)
+        self.fft.prepare(shape, dtype=self.dtype, axes=axes, real=self.rfft)
+        return self
+        
+    def _reconstruct_rfft(self, xs, ys, axes=(0,1)):
+        """Reconstruct using real-input FFTs. See :attr:`rfft`."""
+        fft = self.fft
+        xs_ft = fft.rfftn(xs, axes=axes)
+        ys_ft = fft.rfftn(ys, axes=axes)
+        
+        est_ft = self._apply_filter_into(xs_ft, ys_ft)
+        
+        shape = [np.shape(xs)[axis] for axis in axes]
+        return fft.irfftn(est_ft, s=shape, axes=axes).astype(self.dtype, copy=False)
         
-        est_ft = self.apply_filter(xs_ft, ys_ft)
+    batch_size = 64
+    """Default number of frames transformed together by :meth:`reconstruct_many`."""
+    
+    def reconstruct_many(self, xs, ys, batch_size=None):
+        """Reconstruct a cube of slopes, with time along the first axis.
+        
+        The frames are transformed in batches of ``batch_size``, using a single stacked
+        FFT for each batch, so that the temporary complex arrays are bounded by the
+        batch size and not by the length of the cube.
         
-        estimate = np.real(scipy.fftpack.ifftn(est_ft, axes=axes))
+        :param xs: The x slopes, with shape ``(nt, n, n)``.
+        :param ys: The y slopes, with shape ``(nt, n, n)``.
+        :param int batch_size: The number of frames to reconstruct at once. Defaults to :attr:`batch_size`.
+        :returns: The reconstructed phase, with shape ``(nt, n, n)``.
         
+        """
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        if xs.shape != ys.shape:
+            raise ValueError("Slope cubes must have the same shape. xs{0!r} != ys{1!r}".format(xs.shape, ys.shape))
+        if xs.ndim != 3 or xs.shape[1:] != self.shape:
+            raise ValueError("Slope cubes should have shape (nt, {0:d}, {0:d}). Found {1!r}.".format(self.n, xs.shape))
+        batch_size = int(batch_size or self.batch_size)
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive, got {0:d}".format(batch_size))
+        
+        estimate = np.empty(xs.shape, dtype=self.dtype)
+        for start in range(0, xs.shape[0], batch_size):
+            batch = slice(start, start + batch_size)
+            estimate[batch] = self.reconstruct(xs[batch], ys[batch], axes=(1,2))
         return estimate
         
+    def reconstruct_parallel(self, xs, ys, workers=None, batch_size=None):
+        """Reconstruct a cube of slopes, with time along the first axis, using a pool of threads.
+        
+        The cube is split into batches of ``batch_size`` frames, as in :meth:`reconstruct_many`,
+        and the batches are reconstructed by a pool of ``workers`` threads. The FFTs and array
+        operations release the GIL, so the batches are reconstructed concurrently. Each thread
+        uses its own filter buffers, and the results are returned in frame order.
+        
+        Threads only help when the FFT backend releases the GIL (see
+        :meth:`~aopy.util.fft.FFTBackend.concurrent`). The ``scipy`` backend does not on versions of
+        scipy before 1.4, where it uses :mod:`scipy.fftpack`, so with that backend (and :attr:`rfft`
+        unset) the batches are reconstructed serially, without starting any threads.
+        
+        :param xs: The x slopes, with shape ``(nt, n, n)``.
+        :param ys: The y slopes, with shape ``(nt, n, n)``.
+        :param int workers: The number of threads. Defaults to the number of CPUs.
+        :param int batch_size: The number of frames in each batch. Defaults to spreading the
+            frames evenly over the threads, but no more than :attr:`batch_size` frames.
+        :returns: The reconstructed phase, with shape ``(nt, n, n)``.
+        
+        """
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        if xs.shape != ys.shape:
+            raise ValueError("Slope cubes must have the same shape. xs{0!r} != ys{1!r}".format(xs.shape, ys.shape))
+        if xs.ndim != 3 or xs.shape[1:] != self.shape:
+            raise ValueError("Slope cubes should have shape (nt, {0:d}, {0:d}). Found {1!r}.".format(self.n, xs.shape))
+        workers = int(workers or multiprocessing.cpu_count())
+        if workers < 1:
+            raise ValueError("workers must be positive, got {0:d}".format(workers))
+        if batch_size is None:
+            batch_size = min(self.batch_size, -(-xs.shape[0] // workers))
+        batch_size = max(int(batch_size), 1)
+        
+        self.prepare(batch=batch_size)
+        estimate = np.empty(xs.shape, dtype=self.dtype)
+        def _reconstruct_batch(start):
+            batch = slice(start, start + batch_size)
+            estimate[batch] = self.reconstruct(xs[batch], ys[batch], axes=(1,2))
+        
+        starts = range(0, xs.shape[0], batch_size)
+        if workers == 1 or len(starts) == 1 or not self.fft.concurrent(real=self.rfft):
+            for start in starts:
+                _reconstruct_batch(start)
+            return estimate
+        thread_map(_reconstruct_batch, starts, min(workers, len(starts)))
+        return estimate
+    
     def __call__(self, xs, ys, axes=(0,1)):
         """Reconstruct the phase.
         
@@ -159,33 +415,86 @@ class FourierTransformReconstructor(object):
         return self.reconstruct(xs, ys, axes=axes)
         
     _REGISTRY = {}
+    
+    _FILTER_CACHE = collections.OrderedDict()
+    
+    filter_cache_size = 32
+    """The maximum number of generated filters kept by :meth:`use`, in least-recently-used order."""
         
     @classmethod
     def register(cls, name, filter=None):
-        """Register a filter generating function."""
+        """Register a filter generating function.
+        
+        Registering a filter under an existing name discards any cached filters generated by the old function.
+        """
         
         def _register(filterfunc):
             """Filter Function"""
             cls._REGISTRY[name] = filterfunc
+            cls.clear_filter_cache(name)
             return filterfunc
         
         if six.callable(name):
             filterfunc = name
-            cls._REGISTRY[filterfunc.__name__] = filterfunc
-            return filterfunc
-        elif isinstance(name, six.text_type) and filter is None:
-            return _register
-        elif isinstance(name, six.text_type) and six.callable(filter):
+            name = filterfunc.__name__
             return _register(filterfunc)
+        elif isinstance(name, six.string_types) and filter is None:
+            return _register
+        elif isinstance(name, six.string_types) and six.callable(filter):
+            return _register(filter)
         else:
             raise TypeError("Filter must be a callable, or a name, and used as a decorator.")
     
+    @classmethod
+    def clear_filter_cache(cls, name=None):
+        """Discard cached filters.
+        
+        :param name: Only discard filters generated for this registered name. By default, discards all cached filters.
+        """
+        for key in list(cls._FILTER_CACHE.keys()):
+            if name is None or key[0] == name:
+                del cls._FILTER_CACHE[key]
+        
+    @classmethod
+    def _cached_filter(cls, name, n):
+        """Get a generated, validated and read-only filter from the cache, generating it if necessary."""
+        key = (name, n)
+        cached = cls._FILTER_CACHE.pop(key, None)
+        if cached is None:
+            gx, gy, filtername = cls._REGISTRY[name](n)
+            gx = _validate_filter(gx, n)
+            gy = _validate_filter(gy, n)
+            gx.flags.writeable = False
+            gy.flags.writeable = False
+            cached = FTRFilter(gx, gy, filtername)
+        cls._FILTER_CACHE[key] = cached
+        while len(cls._FILTER_CACHE) > max(cls.filter_cache_size, 0):
+            cls._FILTER_CACHE.popitem(last=False)
+        return cached
+    
     def use(self, filter):
-        """Use a particular filter."""
-        self.gx, self.gy, name = self._REGISTRY[filter](self.n)
-        self._filtername = name
+        """Use a particular filter.
         
+        Generated filters are cached by name and size (see :attr:`filter_cache_size`), so that
+        many reconstructors of the same size share one read-only copy of the filter.
+        """
+        self._set_filter(*self._cached_filter(filter, self.n))
         
+        
+
+def _validate_filter(_filter, n):
+    """Ensure that a filter has shape ``(n, n)``, and is finite.
+    
+    :param _filter: The filter array to check.
+    :param int n: The size of the reconstructor.
+    :returns: The filter, as a new complex array.
+    """
+    gf = np.array(_filter, dtype=np.complex128)
+    if gf.shape != (n, n):
+        raise ValueError("Filter should be same shape as input data. Found {0}, expected {1}.".format(gf.shape, (n, n)))
+    if not np.isfinite(gf).all():
+        raise ValueError("Filter must be finite at all points!")
+    return gf
 
 @FourierTransformReconstructor.register("mod_hud")
 def mod_hud_filter(n):
@@ -201,8 +510,8 @@ def mod_hud_filter(n):
     gx = np.exp(1j*fy/2)*(np.exp(1j*fx) - 1)
     gy = np.exp(1j*fx/2)*(np.exp(1j*fy) - 1)
 
-    gx[n/2,:] = 0.0
-    gy[:,n/2] = 0.0
+    gx[n//2,:] = 0.0
+    gy[:,n//2] = 0.0
     
     return FTRFilter(gx, gy, "mod_hud")
 
@@ -224,8 +533,8 @@ def fried_filter(n):
     gx = (np.exp(1j*fy/2) + 1)*(np.exp(1j*fx) - 1)
     gy = (np.exp(1j*fx/2) + 1)*(np.exp(1j*fy) - 1)
     
-    gx[n/2,:] = 0.0
-    gy[:,n/2] = 0.0
+    gx[n//2,:] = 0.0
+    gy[:,n//2] = 0.0
     
     return FTRFilter(gx, gy, "fried")
 
@@ -249,8 +558,8 @@ def ideal_filter(n):
     
     # the filter is anti-Hermitian here. The real_part takes care
     # of it, but simpler to just zero it out.
-    gx[n/2,:] = 0.0
-    gy[:,n/2] = 0.0
+    gx[n//2,:] = 0.0
+    gy[:,n//2] = 0.0
     
     return FTRFilter(gx, gy, "ideal")
     
\ No newline at end of file
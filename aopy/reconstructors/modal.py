@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+#  modal.py
+#  aopy
+#
+#  Created by Alexander Rudy on 2014-08-02.
+#  Copyright 2014 Alexander Rudy. All rights reserved.
+#
+"""
+:mod:`modal` – A least-squares modal reconstructor
+==================================================
+
+The modal reconstructor fits Zernike modes to the slopes from a Shack-Hartmann
+wavefront sensor, by least squares. The interaction matrix (the slopes of each
+mode) and its pseudo-inverse are computed once for the sensor geometry, and shared
+between reconstructors with the same geometry, so that turning a cube of slopes
+into Zernike coefficients is a single matrix multiply::
+
+    from aopy.reconstructors.modal import ModalReconstructor
+
+    MR = ModalReconstructor(n, ap, nmodes=66)
+    coeffs = MR.coefficients(xs, ys)
+    phase = MR.reconstruct(xs, ys)
+
+
+.. autoclass:: ModalReconstructor
+    :members:
+
+"""
+
+from __future__ import (absolute_import, unicode_literals, division,
+                        print_function)
+
+import numpy as np
+
+from ..wavefront.zernike import ZernikeBasis, ZernikeSlopeBasis
+
+__all__ = ['ModalReconstructor']
+
+class ModalReconstructor(object):
+    """A least-squares Zernike modal reconstructor for an ``n x n`` Shack-Hartmann wavefront sensor.
+
+    :param int n: The number of subapertures across the sensor.
+    :param ap: The illuminated subapertures, a mask with shape ``(n, n)``. Defaults to the subapertures
+        within the Zernike radius.
+    :param int nmodes: The number of Zernike modes to fit, starting from linear Noll index 0.
+    :param float radius: The Zernike radius, in subapertures. Defaults to ``n/2``.
+
+    Slopes are the phase difference across each subaperture, and phase is reconstructed at the
+    subaperture centers. As for the :class:`~aopy.reconstructors.ftr.FourierTransformReconstructor`, x slopes
+    are differences along the last axis, and y slopes along the second to last axis. Piston can't be sensed,
+    so it is always zero.
+    """
+
+    def __repr__(self):
+        """Represent this object."""
+        return "<{0} n={1:d} nmodes={2:d}>".format(self.__class__.__name__, self.n, self.nmodes)
+
+    def __init__(self, n, ap=None, nmodes=36, radius=None):
+        super(ModalReconstructor, self).__init__()
+        self._n = int(n)
+        self._radius = self._n / 2.0 if radius is None else float(radius)
+        # x slopes are differences along the last axis, as in the Fourier transform reconstructors.
+        Y, X = (np.mgrid[0:self._n,0:self._n] - (self._n - 1) / 2.0) / self._radius
+        self._slope_basis = ZernikeSlopeBasis((X, Y), nmodes, ap)
+        self._basis = ZernikeBasis((X, Y), nmodes, self._slope_basis.aperture)
+        # Slopes per subaperture are slopes per unit radius, divided by the radius.
+        self._matrix = self._slope_basis.projector * self._radius
+        self._matrix.flags.writeable = False
+
+    @property
+    def n(self):
+        """The number of subapertures across the sensor. **Read-Only**"""
+        return self._n
+
+    @property
+    def shape(self):
+        """The shape of the slope grids. **Read-Only**"""
+        return (self._n, self._n)
+
+    @property
+    def nmodes(self):
+        """The number of Zernike modes. **Read-Only**"""
+        return self._basis.nmodes
+
+    @property
+    def radius(self):
+        """The Zernike radius, in subapertures. **Read-Only**"""
+        return self._radius
+
+    @property
+    def ap(self):
+        """The illuminated subapertures. **Read-Only**"""
+        return self._basis.aperture
+
+    @property
+    def basis(self):
+        """The :class:`~aopy.wavefront.zernike.ZernikeBasis` of the reconstructed phase. **Read-Only**"""
+        return self._basis
+
+    @property
+    def slope_basis(self):
+        """The :class:`~aopy.wavefront.zernike.ZernikeSlopeBasis` of the sensor. **Read-Only**"""
+        return self._slope_basis
+
+    @property
+    def matrix(self):
+        """The reconstruction matrix, with shape ``(2 * npix, nmodes)``, which turns the x slopes followed by
+        the y slopes of the illuminated subapertures into Zernike coefficients. **Read-Only**"""
+        return self._matrix
+
+    def coefficients(self, xs, ys):
+        """Reconstruct Zernike coefficients from slopes, with a single matrix multiply.
+
+        :param xs: The x slopes, with shape ``(..., n, n)``, for any number of frames.
+        :param ys: The y slopes, with shape ``(..., n, n)``.
+        :returns: The Zernike coefficients, with shape ``(..., nmodes)``.
+        """
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        if xs.shape != ys.shape:
+            raise ValueError("Slopes must have the same shape. xs{0!r} != ys{1!r}".format(xs.shape, ys.shape))
+        if xs.shape[-2:] != self.shape:
+            raise ValueError("Slopes should have shape (..., {0:d}, {0:d}). Found {1!r}.".format(self.n, xs.shape))
+        slopes = np.concatenate((xs[...,self.ap], ys[...,self.ap]), axis=-1)
+        return np.dot(slopes, self._matrix)
+
+    def reconstruct(self, xs, ys):
+        """Reconstruct phase from slopes.
+
+        :param xs: The x slopes, with shape ``(..., n, n)``, for any number of frames.
+        :param ys: The y slopes, with shape ``(..., n, n)``.
+        :returns: The phase, with shape ``(..., n, n)``, which is zero outside of the aperture.
+        """
+        return self._basis.synthesize(self.coefficients(xs, ys))
+
+    def __call__(self, xs, ys):
+        """Reconstruct phase from slopes, see :meth:`reconstruct`."""
+        return self.reconstruct(xs, ys)
+
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+#  pipeline.py
+#  aopy
+#
+#  Created by Alexander Rudy on 2014-08-02.
+#  Copyright 2014 Alexander Rudy. All rights reserved.
+#
+"""
+:mod:`pipeline` – Streaming reconstruction of telemetry
+=======================================================
+
+These functions reconstruct phase from slope telemetry files which are too large to
+hold in memory. Slopes are read lazily, in batches of frames, reconstructed in batches,
+and the phase is written to the output file one batch at a time, so the memory used is
+set by the batch size, and not by the length of the telemetry.
+
+Slope telemetry is stored as a single cube with shape ``(nt, 2, n, n)``, where
+``[:,0,...]`` are the x slopes and ``[:,1,...]`` are the y slopes. Supported formats are
+FITS (memory mapped), HDF5 (read in chunks) and numpy ``.npy`` files (memory mapped).
+Phase is written as a cube with shape ``(nt, n, n)``, in any of the same formats.
+
+To reconstruct a telemetry file with slope management::
+
+    from aopy.reconstructors.slopemanage import SlopeManagedFTR
+    from aopy.reconstructors.pipeline import reconstruct_file
+
+    FTR = SlopeManagedFTR(n, ap, filter='mod_hud', manage_tt=True)
+    reconstruct_file(FTR, "slopes.fits", "phase.fits", batch_size=128)
+
+
+.. autofunction:: reconstruct_file
+
+.. autofunction:: reconstruct_batches
+
+.. autofunction:: read_slopes
+
+.. autofunction:: write_phase
+
+"""
+
+from __future__ import (absolute_import, unicode_literals, division,
+                        print_function)
+
+import contextlib
+
+import numpy as np
+
+__all__ = ['read_slopes', 'reconstruct_batches', 'write_phase', 'reconstruct_file']
+
+def _file_format(filename):
+    """Determine the format of a telemetry file from its extension."""
+    if filename.endswith('.hdf5') or filename.endswith('.h5'):
+        return 'hdf5'
+    elif filename.endswith('.npy'):
+        return 'npy'
+    else:
+        return 'fits'
+
+@contextlib.contextmanager
+def _open_slopes(filename, ext=0, path='slopes'):
+    """Open a slope cube lazily, yielding an array-like object with shape ``(nt, 2, n, n)``."""
+    fmt = _file_format(filename)
+    if fmt == 'hdf5':
+        import h5py
+        with h5py.File(filename, 'r') as f:
+            yield f[path]
+    elif fmt == 'npy':
+        yield np.load(filename, mmap_mode='r')
+    else:
+        from astropy.io import fits
+        with fits.open(filename, memmap=True) as HDUs:
+            yield HDUs[ext].data
+
+def read_slopes(filename, batch_size=64, ext=0, path='slopes', dtype=np.float64):
+    """Read batches of slope frames lazily from a telemetry file.
+
+    :param filename: The telemetry file.
+    :param int batch_size: The number of frames in each batch.
+    :param int ext: The FITS extension which holds the slopes.
+    :param str path: The HDF5 dataset which holds the slopes.
+    :param dtype: The floating point type of the batches.
+    :returns: A generator of ``(xs, ys)`` batches, each with shape ``(batch_size, n, n)``.
+
+    """
+    with _open_slopes(filename, ext=ext, path=path) as slopes:
+        if len(slopes.shape) != 4 or slopes.shape[1] != 2:
+            raise ValueError("Slope telemetry should have shape (nt, 2, n, n). Found {0!r}.".format(slopes.shape))
+        for start in range(0, slopes.shape[0], batch_size):
+            batch = np.asarray(slopes[start:start + batch_size], dtype=dtype)
+            yield (batch[:,0,...], batch[:,1,...])
+
+def reconstruct_batches(reconstructor, batches):
+    """Reconstruct batches of slopes.
+
+    :param reconstructor: A :class:`~aopy.reconstructors.ftr.FourierTransformReconstructor`, e.g. a
+        :class:`~aopy.reconstructors.slopemanage.SlopeManagedFTR` to apply tip/tilt removal and slope management.
+    :param batches: An iterable of ``(xs, ys)`` batches, each with shape ``(nt, n, n)``.
+    :returns: A generator of phase batches, each with shape ``(nt, n, n)``.
+
+    """
+    for xs, ys in batches:
+        yield reconstructor.reconstruct(xs, ys, axes=(1,2))
+
+def write_phase(filename, batches, shape, path='phase', dtype=np.float64):
+    """Write batches of phase frames incrementally to a file.
+
+    :param filename: The output file.
+    :param batches: An iterable of phase batches, each with shape ``(nt, n, n)``.
+    :param tuple shape: The shape of the full phase cube, ``(nt, n, n)``.
+    :param str path: The HDF5 dataset to write.
+    :param dtype: The floating point type to write, ``float64`` or ``float32``.
+    :returns: The number of frames written.
+
+    """
+    shape = tuple(int(s) for s in shape)
+    dtype = np.dtype(dtype)
+    fmt = _file_format(filename)
+    written = 0
+    if fmt == 'hdf5':
+        import h5py
+        with h5py.File(filename, 'a') as f:
+            if path in f:
+                del f[path]
+            dataset = f.create_dataset(path, shape=shape, dtype=dtype, chunks=(1,) + shape[1:])
+            for batch in batches:
+                dataset[written:written + batch.shape[0]] = batch
+                written += batch.shape[0]
+    elif fmt == 'npy':
+        from numpy.lib.format import open_memmap
+        output = open_memmap(filename, mode='w+', dtype=dtype, shape=shape)
+        for batch in batches:
+            output[written:written + batch.shape[0]] = batch
+            written += batch.shape[0]
+        output.flush()
+        del output
+    else:
+        from astropy.io import fits
+        header = fits.Header()
+        header['SIMPLE'] = True
+        header['BITPIX'] = -8 * dtype.itemsize
+        header['NAXIS'] = len(shape)
+        for i, length in enumerate(shape[::-1]):
+            header['NAXIS{0:d}'.format(i + 1)] = length
+        stream = fits.StreamingHDU(filename, header)
+        try:
+            for batch in batches:
+                stream.write(np.ascontiguousarray(batch, dtype=dtype))
+                written += batch.shape[0]
+        finally:
+            stream.close()
+    if written != shape[0]:
+        raise ValueError("Wrote {0:d} frames, expected {1:d}.".format(written, shape[0]))
+    return written
+
+def reconstruct_file(reconstructor, infile, outfile, batch_size=64, ext=0, path='slopes', outpath='phase'):
+    """Reconstruct a slope telemetry file into a phase file, in bounded memory.
+
+    :param reconstructor: A :class:`~aopy.reconstructors.ftr.FourierTransformReconstructor`. Slopes
+        are read, and phase is written, with the :attr:`~aopy.reconstructors.ftr.FourierTransformReconstructor.dtype`
+        of the reconstructor.
+    :param infile: The slope telemetry file, see :func:`read_slopes`.
+    :param outfile: The phase output file, see :func:`write_phase`.
+    :param int batch_size: The number of frames to read, reconstruct and write at once.
+    :param int ext: The FITS extension which holds the slopes.
+    :param str path: The HDF5 dataset which holds the slopes.
+    :param str outpath: The HDF5 dataset to write.
+    :returns: The number of frames reconstructed.
+
+    """
+    with _open_slopes(infile, ext=ext, path=path) as slopes:
+        nt, _, n, m = slopes.shape
+    if (n, m) != reconstructor.shape:
+        raise ValueError("Slope frames {0!r} do not match the reconstructor {1!r}.".format((n, m), reconstructor.shape))
+    batches = read_slopes(infile, batch_size=batch_size, ext=ext, path=path, dtype=reconstructor.dtype)
+    phase = reconstruct_batches(reconstructor, batches)
+    return write_phase(outfile, phase, (nt, n, m), path=outpath, dtype=reconstructor.dtype)
+
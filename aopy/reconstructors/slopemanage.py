@@ -5,15 +5,16 @@ from __future__ import (absolute_import, unicode_literals, division,
 import numpy as np
 
 from .ftr import FourierTransformReconstructor
+from ..aperture.slopemanage import SlopeManagementPlan, EdgeExtensionPlan
 
 class SlopeManagedFTR(FourierTransformReconstructor):
     """An FTR Reconstructor with slope management"""
     
     _ap = None
     
-    def __init__(self, n, ap, filter=None, manage_tt=False, suppress_tt=None, extend=False):
+    def __init__(self, n, ap, filter=None, manage_tt=False, suppress_tt=None, extend=False, dtype=np.float64):
         self._ap = ap
-        super(SlopeManagedFTR, self).__init__(n=n, filter=filter)
+        super(SlopeManagedFTR, self).__init__(n=n, filter=filter, dtype=dtype)
         self.manage_tt = manage_tt
         if suppress_tt is None:
             self.suppress_tt = manage_tt
@@ -21,6 +22,8 @@ class SlopeManagedFTR(FourierTransformReconstructor):
             self.suppress_tt = bool(suppress_tt)
         self.extend = extend
         self.x, self.y = np.meshgrid(np.arange(n) - n/2, np.arange(n) - n/2)
+        self._slope_plan = None
+        self._extend_plan = None
         
     
     @property
@@ -28,32 +31,76 @@ class SlopeManagedFTR(FourierTransformReconstructor):
         """Aperture used for slope management."""
         return self._ap
     
-    def reconstruct(self, xs, ys):
-        """Reconstruct."""
+    @property
+    def slope_plan(self):
+        """The :class:`~aopy.aperture.slopemanage.SlopeManagementPlan` for this aperture. **Read-Only**"""
+        if self._slope_plan is None:
+            self._slope_plan = SlopeManagementPlan(self.ap)
+        return self._slope_plan
+        
+    @property
+    def extend_plan(self):
+        """The :class:`~aopy.aperture.slopemanage.EdgeExtensionPlan` for this aperture. **Read-Only**"""
+        if self._extend_plan is None:
+            self._extend_plan = EdgeExtensionPlan(self.ap)
+        return self._extend_plan
+        
+    def prepare(self, batch=None):
+        """Prepare this reconstructor, including the slope management plan. See :meth:`FourierTransformReconstructor.prepare`."""
+        if self.extend:
+            self.extend_plan
+        else:
+            self.slope_plan
+        return super(SlopeManagedFTR, self).prepare(batch=batch)
+    
+    def reconstruct(self, xs, ys, axes=(0,1)):
+        """Reconstruct.
+        
+        :param xs: The x slopes.
+        :param ys: The y slopes.
+        :param axes: The axes of each frame. These must be the last two axes, so a stack of
+            frames can be reconstructed with ``axes=(1,2)``.
+        
+        """
+        xs = np.asarray(xs, dtype=self.dtype)
+        ys = np.asarray(ys, dtype=self.dtype)
+        if tuple(np.arange(xs.ndim)[list(axes)]) != (xs.ndim - 2, xs.ndim - 1):
+            raise ValueError("Slope managed frames must be along the last two axes, not {0!r}".format(axes))
         if self.manage_tt:
             xs, xt = remove_tilt(self.ap, xs)
             ys, yt = remove_tilt(self.ap, ys)
         if self.extend:
-            xs, ys = edge_extend(self.ap, xs, ys)
+            xs, ys = self.extend_plan(xs, ys)
         else:
-            xs, ys = slope_management(self.ap, xs, ys)
-        phi = super(SlopeManagedFTR, self).reconstruct(xs, ys)
-        if not self.suppress_tt:
-            return phi + (x * xt) + (y * yt)
+            xs, ys = self.slope_plan(xs, ys)
+        phi = super(SlopeManagedFTR, self).reconstruct(xs, ys, axes=axes)
+        if self.manage_tt and not self.suppress_tt:
+            xt = np.asarray(xt)[..., np.newaxis, np.newaxis]
+            yt = np.asarray(yt)[..., np.newaxis, np.newaxis]
+            return phi + (self.x.astype(self.dtype) * xt) + (self.y.astype(self.dtype) * yt)
         return phi
     
 
 def remove_tilt(ap, sl):
-    """Remove tip or tilt from slopes."""
-    tt = np.sum(sl * ap) / np.sum(ap)
-    sl_nt = sl - tt * ap
+    """Remove tip or tilt from slopes.
+    
+    :param ap: The aperture, as a boolean mask, or an :class:`~aopy.aperture.core.Aperture`.
+    :param sl: The slopes, with frames along the last two axes.
+    :returns: ``(sl_nt, tt)``, the slopes with the average removed, and the average slope of each frame.
+    
+    The results have the same floating point type as ``sl``.
+    """
+    ap = np.asarray(ap) != 0
+    sl = np.asarray(sl)
+    tt = np.mean(sl[..., ap], axis=-1)
+    sl_nt = sl - np.asarray(tt)[..., np.newaxis, np.newaxis] * ap
     return (sl_nt, tt)
     
-def _check_slopeargs(ap, xs, ys):
+def _check_slopeargs(ap, xs, ys, dtype=np.float64):
     """Check arguments to the slope management function, and prepare them."""
     ap = np.array(ap, dtype=np.int)
-    xs = np.array(xs, dtype=np.float)
-    ys = np.array(ys, dtype=np.float)
+    xs = np.array(xs, dtype=dtype)
+    ys = np.array(ys, dtype=dtype)
     
     if not (xs.ndim == 2 and xs.shape[0] == xs.shape[1]):
         raise ValueError("slopemanage requires a square input slope array. xs.shape={0!r}".format(xs.shape))
@@ -67,173 +114,35 @@ def _check_slopeargs(ap, xs, ys):
             raise ValueError("slopemanage requires that {0} be finite.".format(name))
     return (ap, xs, ys)
 
-def slope_management(ap, xs, ys):
+def slope_management(ap, xs, ys, dtype=np.float64):
     """
     Slope management for the fast fourier transform.
     
     :param ap: The aperture, as a boolean mask.
     :param xs: The x slopes.
     :param ys: The y slopes.
+    :param dtype: The floating point type of the managed slopes.
     
     The slopes must be within an aperture that has space on the edges for correction.
     
-    """
-    ap, xs, ys = _check_slopeargs(ap, xs, ys)
-    
-    n = xs.shape[0]
-    
-    xs_s = xs * ap
-    ys_s = ys * ap
-    
-    xs_c = np.copy(xs_s)
-    ys_c = np.copy(ys_s)
-    
-    ysr_sum = np.sum(ys_s, axis=0)
-    apr_sum = np.sum(ap, axis=0)
-    
-    xsc_sum = np.sum(xs_s, axis=1)
-    apc_sum = np.sum(ap, axis=1)
-    
-    for j in range(n):
-        if apr_sum[j] != 0:
-            loc = np.where(ap[:,j] != 0)[0]
-            left = loc[0]
-            right = loc[-1]
-            
-            if left == 0:
-                raise ValueError("Not enough space to edge correct, row {j} ends at k={k}".format(j=j, k=0))
-            if right == n:
-                raise ValueError("Not enough space to edge correct, row {j} ends at k={k}".format(j=j, k=n))
-            
-            ys_c[left-1, j] = - 0.5 * ysr_sum[j]
-            ys_c[right+1, j] = -0.5 * ysr_sum[j]
-        
-        if apc_sum[j] != 0:
-            loc = np.where(ap[j,:] != 0)[0]
-            bottom = loc[0]
-            top = loc[-1]
+    When managing many frames with the same aperture, make a :class:`~aopy.aperture.slopemanage.SlopeManagementPlan` once and re-use it.
             
-            if bottom == 0:
-                raise ValueError("Not enough space to edge correct, column {j} ends at k={k}".format(j=j, k=0))
-            if top == n:
-                raise ValueError("Not enough space to edge correct, column {j} ends at k={k}".format(j=j, k=n))
-            
-            xs_c[j, bottom-1] = -0.5 * xsc_sum[j]
-            xs_c[j, top+1]    = -0.5 * xsc_sum[j]
-            
-    return (xs_c, ys_c)
+    """
+    ap, xs, ys = _check_slopeargs(ap, xs, ys, dtype)
+    return SlopeManagementPlan(ap).apply(xs, ys)
     
     
-def edge_extend(ap, xs, ys):
+def edge_extend(ap, xs, ys, dtype=np.float64):
     """
     Edge Extension for the fast fourier transform.
     
     :param ap: The aperture, as a boolean mask.
     :param xs: The x slopes.
     :param ys: The y slopes.
+    :param dtype: The floating point type of the extended slopes.
+    
+    See :class:`~aopy.aperture.slopemanage.EdgeExtensionPlan` for the algorithm. When extending
+    many frames with the same aperture, make a plan once and re-use it.
     """
-    ap, xs, ys = _check_slopeargs(ap, xs, ys)
-    
-    xs_ap = ap.copy()
-    ys_ap = ap.copy()
-    xs_sap = np.roll(ap, 0, -1)
-    ys_sap = np.roll(ap, -1, 0)
-    
-    loop = xs_ap + ys_ap + xs_sap + ys_sap
-    
-    for k in range(n):
-        for l in range(n):
-            if loop[k,l] == 3:
-                flag = 0
-                total = 0
-                for flval, arr in enumerate([xs_ap, xs_sap, ys_ap, ys_sap]):
-                    if arr[k,l] == 0:
-                        flag = flval + 1
-                if flag != 1:
-                    total = total + xs[k,l]
-                if flag != 2:
-                    total = total - xs[k,l+1]
-                if flag != 3:
-                    total = total - ys[k,l]
-                if flag != 4:
-                    total = total + ys[k+1,l]
-                
-                if flag == 1:
-                    xs[k,l] = -total
-                    xs_ap[k,l] = 1
-                elif flag == 2:
-                    xs[k,l+1] = total
-                    xs_ap[k,l+1] = 1
-                elif flag == 3:
-                    ys[k,l] = total
-                    ys_ap[k,l] = 1
-                elif flat == 4:
-                    ys[k+1,l] = -total
-                    ys_ap[k+1, l] = 1
-    
-    xout = ~xs_ap.astype(np.bool)
-    yout = ~ys_ap.astype(np.bool)
-    
-    xtop0 = xs_ap.copy()
-    yleft0 = ys_ap.copy()
-    xbot0 = xs_ap.copy()
-    yright0 = ys_ap.copy()
-
-    xtop = np.zeros_like(ap)
-    yleft = np.zeros_like(ap)
-    xbot = np.zeros_like(ap)
-    yright = np.zeros_like(ap)
-    
-    for k in range(n):
-        found1 = 0
-        found2 = 0
-        found3 = 0
-        found4 = 0
-        for l in range(n):
-            l2 = N-1-l
-            if found1 == 0:
-                if xtop0[k,l] == 1:
-                    found1 = 1
-            if found2 == 0:
-                if xbot0[k, l2] == 1:
-                    xbot[k, l2] == 1
-                    found2 = 1
-            if found3 == 0:
-                if yleft0[l, k] == 0:
-                    yleft[l, k] = 1
-                    found3 = 1
-            if found4 == 0:
-                if yright0[l2, k] == 0:
-                    yright[l2, k] = 1
-                    found4 = 1
-
-    for k in range(n):
-        toploc = np.nonzero(xtop[k, :] == 1)
-        if len(toploc) == 1:
-            val = xs[k, toploc[0]]
-            for l in range(toploc[0]):
-                xs[k, l] = val
-                xs_ap[k, l] = 1
-        botloc = np.nonzero(xbot[k, :] == 1)
-        if len(botloc) == 1:
-            val = xs[k, botloc[0]]
-            for l in range(botloc[0]+1, n):
-                xs[k, l] = val
-                xs_ap[k, l] = 1
-        leftloc = np.nonzero(yleft[:,k] == 1)
-        if len(leftloc) == 1:
-            val = ys[leftloc[0], k]
-            for l in range(leftloc[0]):
-                ys[l, k] = val
-                ys_ap[l, k] = 1
-        rightloc = np.nonzero(yright[:,k] == 1)
-        if len(rightloc) == 1:
-            val = ys[rightloc[0], k]
-            for l in range(rightloc[0] + 1, n):
-                ys[l, k] = val
-                ys_ap[l, k] = 1
-    for k in rnage(n):
-        xs[n-1, k] = - xs[0:n-1, k].sum()
-        ys[k, n-1] = - ys[k, 0:n-1].sum()
-        
-    return (xs, ys)
+    ap, xs, ys = _check_slopeargs(ap, xs, ys, dtype)
+    return EdgeExtensionPlan(ap).apply(xs, ys)
@@ -16,9 +16,13 @@
 from __future__ import (absolute_import, unicode_literals, division,
                         print_function)
 
+import sys
 import collections
+import threading
 
-__all__ = ['istype', 'resolve', 'configure_class', 'ConsoleContext', '_ConsoleContext']
+import six
+
+__all__ = ['istype', 'resolve', 'configure_class', 'ConsoleContext', '_ConsoleContext', 'thread_map']
 
 def is_type_factory(ttype):
     """Return a function which checks if an object can be cast as a given 
@@ -74,6 +78,38 @@ def configure_class(configuration):
         raise ValueError("Can't understand {}".format(configuration))
     return class_obj
 
+def thread_map(function, items, workers):
+    """Call a function on each item, with a group of threads.
+    
+    :param function: The function, which is called with one item at a time.
+    :param items: A sequence of items.
+    :param int workers: The number of threads.
+    
+    Items are handed out to the threads one at a time. Plain threads are used, rather than a
+    :class:`multiprocessing.pool.ThreadPool`, which polls for up to 0.1s when it is joined. The first
+    error raised by the function is raised again here, once all of the threads have stopped.
+    """
+    remaining = iter(items)
+    lock = threading.Lock()
+    errors = []
+    def _worker():
+        while not errors:
+            with lock:
+                item = next(remaining, remaining)
+            if item is remaining:
+                return
+            try:
+                function(item)
+            except Exception:
+                errors.append(sys.exc_info())
+    threads = [threading.Thread(target=_worker) for i in range(max(int(workers), 1))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        six.reraise(*errors[0])
+    
 class _ConsoleContext(object):
     """Allow a switch between range and progress-bar"""
     _console = False
@@ -10,13 +10,48 @@
 :mod:`fft` - Tools for Fast Fourier Transforms
 ==============================================
 
+FFT Backends
+------------
+
+All of the fourier transforms in :mod:`aopy` are routed through an :class:`FFTBackend`,
+so that the FFT implementation can be chosen once, globally, with :func:`set_backend`,
+or for individual objects, which accept an ``fft`` keyword. Backends are named:
+
+- ``numpy``: :mod:`numpy.fft`, always available.
+- ``scipy``: :mod:`scipy.fft`, which supports multithreading through ``workers=``. Falls
+  back to :mod:`scipy.fftpack` on older versions of scipy. This is the default.
+- ``fftw``: :mod:`pyfftw`, with the interface plan cache enabled, multithreading through
+  ``workers=``, and wisdom persistence with :meth:`FFTWBackend.save_wisdom` and
+  :meth:`FFTWBackend.load_wisdom`.
+- ``fftw-planned``: :class:`FFTWPlanCache`, an opt-in cache of pre-planned :mod:`pyfftw`
+  transforms with aligned buffers, which persists FFTW wisdom to disk.
+
+Backends are used like::
+    
+    from aopy.util.fft import get_backend, set_backend
+    set_backend('scipy', workers=-1)
+    get_backend().fftn(data, axes=(1,2))
+    
+
+.. autofunction:: get_backend
+
+.. autofunction:: set_backend
+
 """
 
 from __future__ import (absolute_import, unicode_literals, division,
                         print_function)
 
+import abc
+import six
+import threading
+import multiprocessing
+
 import numpy as np
 
+__all__ = ['FFTBackend', 'NumpyBackend', 'ScipyBackend', 'FFTWBackend', 'FFTWPlanCache', 'get_backend', 'set_backend',
+    'fftishift', 'ifftishift']
+
 def fftishift(i, n=None):
     """Shift an FFT index, or an array of fft indicies.
     
@@ -37,4 +72,416 @@ def ifftishift(k, n=None):
         n = k.shape[0]
     p2 = n-(n+1)//2
     ivalues = np.concatenate((np.arange(p2, n), np.arange(p2)))
-    return ivalues[k]
\ No newline at end of file
+    return ivalues[k]
+    
+@six.add_metaclass(abc.ABCMeta)
+class FFTBackend(object):
+    """An FFT implementation.
+    
+    :param int workers: The number of threads to use for each transform, where supported.
+        ``-1`` uses every core on the machine.
+    
+    """
+    
+    name = None
+    
+    def __init__(self, workers=None):
+        super(FFTBackend, self).__init__()
+        self.workers = workers
+        
+    def __repr__(self):
+        """Represent this backend."""
+        return "<{0} workers={1!r}>".format(self.__class__.__name__, self.workers)
+        
+    @property
+    def threads(self):
+        """The number of threads requested by :attr:`workers`, as a positive integer."""
+        if self.workers is None:
+            return 1
+        if self.workers < 0:
+            return multiprocessing.cpu_count() + 1 + self.workers
+        return int(self.workers)
+        
+    def concurrent(self, real=False):
+        """Whether transforms release the GIL, so that transforms called from different threads run concurrently.
+        
+        :param bool real: Whether to ask about the real-input transforms, :meth:`rfftn` and :meth:`irfftn`.
+        """
+        return True
+        
+    @abc.abstractmethod
+    def fftn(self, a, s=None, axes=None):
+        """N-dimensional forward FFT."""
+        raise NotImplementedError
+        
+    @abc.abstractmethod
+    def ifftn(self, a, s=None, axes=None):
+        """N-dimensional inverse FFT."""
+        raise NotImplementedError
+        
+    @abc.abstractmethod
+    def rfftn(self, a, s=None, axes=None):
+        """N-dimensional forward FFT of real input, returning the half-spectrum."""
+        raise NotImplementedError
+        
+    @abc.abstractmethod
+    def irfftn(self, a, s=None, axes=None):
+        """N-dimensional inverse of :meth:`rfftn`."""
+        raise NotImplementedError
+        
+    def fft2(self, a, s=None, axes=(-2,-1)):
+        """2-dimensional forward FFT."""
+        return self.fftn(a, s=s, axes=axes)
+        
+    def ifft2(self, a, s=None, axes=(-2,-1)):
+        """2-dimensional inverse FFT."""
+        return self.ifftn(a, s=s, axes=axes)
+        
+    def prepare(self, shape, dtype=np.float64, axes=(-2,-1), real=False):
+        """Prepare to transform arrays of a given shape.
+        
+        :param tuple shape: The shape of the (real-space) arrays which will be transformed.
+        :param dtype: The type of the real-space arrays.
+        :param tuple axes: The axes to transform.
+        :param bool real: Whether to prepare the real-input transforms, :meth:`rfftn` and :meth:`irfftn`.
+        
+        Backends which plan their transforms ahead of time override this method. By default, it does nothing.
+        """
+        pass
+        
+    @staticmethod
+    def fftshift(x, axes=None):
+        """Shift the zero-frequency component to the center of the spectrum."""
+        return np.fft.fftshift(x, axes=axes)
+        
+    @staticmethod
+    def ifftshift(x, axes=None):
+        """The inverse of :meth:`fftshift`."""
+        return np.fft.ifftshift(x, axes=axes)
+        
+    _REGISTRY = {}
+    
+    @classmethod
+    def register(cls, backend):
+        """Register an FFT backend class by its :attr:`name`."""
+        cls._REGISTRY[backend.name] = backend
+        return backend
+        
+@FFTBackend.register
+class NumpyBackend(FFTBackend):
+    """FFTs from :mod:`numpy.fft`. These are always single threaded."""
+    
+    name = "numpy"
+    
+    def fftn(self, a, s=None, axes=None):
+        """N-dimensional forward FFT."""
+        return np.fft.fftn(a, s=s, axes=axes)
+        
+    def ifftn(self, a, s=None, axes=None):
+        """N-dimensional inverse FFT."""
+        return np.fft.ifftn(a, s=s, axes=axes)
+        
+    def rfftn(self, a, s=None, axes=None):
+        """N-dimensional forward FFT of real input, returning the half-spectrum."""
+        return np.fft.rfftn(a, s=s, axes=axes)
+        
+    def irfftn(self, a, s=None, axes=None):
+        """N-dimensional inverse of :meth:`rfftn`."""
+        return np.fft.irfftn(a, s=s, axes=axes)
+        
+@FFTBackend.register
+class ScipyBackend(FFTBackend):
+    """FFTs from :mod:`scipy.fft`, using ``workers`` threads.
+    
+    On versions of scipy without :mod:`scipy.fft`, this uses :mod:`scipy.fftpack`, which
+    is single threaded, and :mod:`numpy.fft` for the real-input transforms. The :mod:`scipy.fftpack`
+    transforms hold the GIL, so they don't run concurrently in threads.
+    """
+    
+    name = "scipy"
+    
+    def __init__(self, workers=None):
+        super(ScipyBackend, self).__init__(workers=workers)
+        try:
+            import scipy.fft
+        except ImportError:
+            import scipy.fftpack
+            self._module = None
+            self._fftpack = scipy.fftpack
+        else:
+            self._module = scipy.fft
+            self._fftpack = None
+            
+    def concurrent(self, real=False):
+        """Whether transforms release the GIL. The :mod:`scipy.fftpack` transforms don't."""
+        return real or self._module is not None
+        
+    def fftn(self, a, s=None, axes=None):
+        """N-dimensional forward FFT."""
+        if self._module is None:
+            return self._fftpack.fftn(a, shape=s, axes=axes)
+        return self._module.fftn(a, s=s, axes=axes, workers=self.workers)
+        
+    def ifftn(self, a, s=None, axes=None):
+        """N-dimensional inverse FFT."""
+        if self._module is None:
+            return self._fftpack.ifftn(a, shape=s, axes=axes)
+        return self._module.ifftn(a, s=s, axes=axes, workers=self.workers)
+        
+    def rfftn(self, a, s=None, axes=None):
+        """N-dimensional forward FFT of real input, returning the half-spectrum."""
+        if self._module is None:
+            return np.fft.rfftn(a, s=s, axes=axes)
+        return self._module.rfftn(a, s=s, axes=axes, workers=self.workers)
+        
+    def irfftn(self, a, s=None, axes=None):
+        """N-dimensional inverse of :meth:`rfftn`."""
+        if self._module is None:
+            return np.fft.irfftn(a, s=s, axes=axes)
+        return self._module.irfftn(a, s=s, axes=axes, workers=self.workers)
+        
+@FFTBackend.register
+class FFTWBackend(FFTBackend):
+    """FFTs from :mod:`pyfftw`, using ``workers`` threads.
+    
+    :param int workers: The number of threads to use for each transform.
+    :param str planner_effort: The FFTW planner effort, e.g. ``FFTW_MEASURE``.
+    :param wisdom: A filename from which to load FFTW wisdom, if it exists.
+    
+    The :mod:`pyfftw.interfaces` plan cache is enabled, so that repeated transforms of
+    the same shape and type re-use their FFTW plans.
+    """
+    
+    name = "fftw"
+    
+    def __init__(self, workers=None, planner_effort='FFTW_MEASURE', wisdom=None):
+        super(FFTWBackend, self).__init__(workers=workers)
+        import pyfftw
+        import pyfftw.interfaces.numpy_fft
+        import pyfftw.interfaces.cache
+        pyfftw.interfaces.cache.enable()
+        self._pyfftw = pyfftw
+        self._module = pyfftw.interfaces.numpy_fft
+        self.planner_effort = planner_effort
+        if wisdom is not None:
+            self.load_wisdom(wisdom)
+            
+    def _kwargs(self):
+        """Keyword arguments for :mod:`pyfftw.interfaces` functions."""
+        return dict(threads=self.threads, planner_effort=self.planner_effort)
+        
+    def fftn(self, a, s=None, axes=None):
+        """N-dimensional forward FFT."""
+        return self._module.fftn(a, s=s, axes=axes, **self._kwargs())
+        
+    def ifftn(self, a, s=None, axes=None):
+        """N-dimensional inverse FFT."""
+        return self._module.ifftn(a, s=s, axes=axes, **self._kwargs())
+        
+    def rfftn(self, a, s=None, axes=None):
+        """N-dimensional forward FFT of real input, returning the half-spectrum."""
+        return self._module.rfftn(a, s=s, axes=axes, **self._kwargs())
+        
+    def irfftn(self, a, s=None, axes=None):
+        """N-dimensional inverse of :meth:`rfftn`."""
+        return self._module.irfftn(a, s=s, axes=axes, **self._kwargs())
+        
+    def load_wisdom(self, filename):
+        """Load FFTW wisdom from a file written by :meth:`save_wisdom`.
+        
+        :param filename: The wisdom file. Missing files are ignored.
+        :returns: Whether any wisdom was loaded.
+        """
+        import os.path
+        from six.moves import cPickle as pickle
+        if not os.path.exists(filename):
+            return False
+        with open(filename, 'rb') as stream:
+            wisdom = pickle.load(stream)
+        return any(self._pyfftw.import_wisdom(wisdom))
+        
+    def save_wisdom(self, filename):
+        """Save the accumulated FFTW wisdom to a file.
+        
+        :param filename: The wisdom file.
+        """
+        from six.moves import cPickle as pickle
+        with open(filename, 'wb') as stream:
+            pickle.dump(self._pyfftw.export_wisdom(), stream, protocol=2)
+            
+@FFTBackend.register
+class FFTWPlanCache(FFTWBackend):
+    """Pre-planned :mod:`pyfftw` transforms with aligned buffers, cached by array shape.
+    
+    :param int workers: The number of threads to use for each transform.
+    :param str planner_effort: The FFTW planner effort, e.g. ``FFTW_MEASURE``.
+    :param wisdom: A filename for FFTW wisdom. Wisdom is loaded from this file when the cache
+        is created, and saved to it each time a new plan is made, so that a restarted process
+        can skip the planning cost.
+    
+    Plans are keyed on the transform, the shape of the arrays (``(n, n)`` for single frames,
+    or ``(batch, n, n)``), the dtype and the axes. Use :meth:`prepare` to make plans before
+    the first transform. Arrays are copied into the aligned input buffer of the plan, and the
+    aligned output buffer is copied out, so the results are safe to keep.
+    
+    Each thread keeps its own plans and buffers, so one cache can be shared by threads which
+    transform concurrently. Plans made by later threads re-use the FFTW wisdom of the first.
+    """
+    
+    name = "fftw-planned"
+    
+    def __init__(self, workers=None, planner_effort='FFTW_MEASURE', wisdom=None):
+        super(FFTWPlanCache, self).__init__(workers=workers, planner_effort=planner_effort, wisdom=wisdom)
+        self.wisdom = wisdom
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        
+    @property
+    def _plans(self):
+        """The plans for the calling thread."""
+        plans = getattr(self._local, 'plans', None)
+        if plans is None:
+            plans = self._local.plans = {}
+        return plans
+        
+    def __len__(self):
+        """The number of plans cached for the calling thread."""
+        return len(self._plans)
+        
+    def plan(self, kind, shape, dtype=np.float64, axes=(-2,-1)):
+        """Get the plan for a transform, making it if necessary.
+        
+        :param str kind: The transform, one of ``fftn``, ``ifftn``, ``rfftn`` or ``irfftn``.
+        :param tuple shape: The shape of the real-space array.
+        :param dtype: The type of the array, which sets the precision of the transform.
+        :param tuple axes: The axes to transform.
+        :returns: A :class:`pyfftw.FFTW` object.
+        """
+        shape = tuple(int(length) for length in shape)
+        axes = tuple(int(axis) % len(shape) for axis in axes)
+        ftype = np.empty(0, dtype=dtype).real.dtype
+        key = (kind, shape, ftype.str, axes)
+        plans = self._plans
+        if key not in plans:
+            with self._lock:
+                plans[key] = self._make_plan(kind, shape, ftype, axes)
+                if self.wisdom is not None:
+                    self.save_wisdom(self.wisdom)
+        return plans[key]
+        
+    def _make_plan(self, kind, shape, ftype, axes):
+        """Make a new plan, with aligned buffers."""
+        ctype = np.result_type(ftype, np.complex64)
+        half = list(shape)
+        half[axes[-1]] = shape[axes[-1]] // 2 + 1
+        half = tuple(half)
+        if kind == "fftn" or kind == "ifftn":
+            inputs = self._pyfftw.empty_aligned(shape, dtype=ctype)
+            outputs = self._pyfftw.empty_aligned(shape, dtype=ctype)
+        elif kind == "rfftn":
+            inputs = self._pyfftw.empty_aligned(shape, dtype=ftype)
+            outputs = self._pyfftw.empty_aligned(half, dtype=ctype)
+        elif kind == "irfftn":
+            inputs = self._pyfftw.empty_aligned(half, dtype=ctype)
+            outputs = self._pyfftw.empty_aligned(shape, dtype=ftype)
+        else:
+            raise ValueError("Unknown transform {0!r}".format(kind))
+        direction = 'FFTW_BACKWARD' if kind.startswith("i") else 'FFTW_FORWARD'
+        return self._pyfftw.FFTW(inputs, outputs, axes=axes, direction=direction,
+            flags=(self.planner_effort,), threads=self.threads)
+        
+    def prepare(self, shape, dtype=np.float64, axes=(-2,-1), real=False):
+        """Make the plans for transforming arrays of a given shape.
+        
+        :param tuple shape: The shape of the (real-space) arrays which will be transformed.
+        :param dtype: The type of the real-space arrays.
+        :param tuple axes: The axes to transform.
+        :param bool real: Whether to plan the real-input transforms, :meth:`rfftn` and :meth:`irfftn`.
+        """
+        kinds = ("rfftn", "irfftn") if real else ("fftn", "ifftn")
+        for kind in kinds:
+            self.plan(kind, shape, dtype, axes)
+        
+    def _execute(self, kind, a, shape, axes):
+        """Execute a planned transform of ``a``."""
+        plan = self.plan(kind, shape, a.dtype, axes)
+        plan.input_array[...] = a
+        return plan().copy()
+        
+    @staticmethod
+    def _axes(a, axes):
+        """Normalize the transform axes for ``a``."""
+        if axes is None:
+            return tuple(range(a.ndim))
+        return tuple(axis % a.ndim for axis in axes)
+        
+    def fftn(self, a, s=None, axes=None):
+        """N-dimensional forward FFT."""
+        if s is not None:
+            return super(FFTWPlanCache, self).fftn(a, s=s, axes=axes)
+        a = np.asarray(a)
+        return self._execute("fftn", a, a.shape, self._axes(a, axes))
+        
+    def ifftn(self, a, s=None, axes=None):
+        """N-dimensional inverse FFT."""
+        if s is not None:
+            return super(FFTWPlanCache, self).ifftn(a, s=s, axes=axes)
+        a = np.asarray(a)
+        return self._execute("ifftn", a, a.shape, self._axes(a, axes))
+        
+    def rfftn(self, a, s=None, axes=None):
+        """N-dimensional forward FFT of real input, returning the half-spectrum."""
+        if s is not None:
+            return super(FFTWPlanCache, self).rfftn(a, s=s, axes=axes)
+        a = np.asarray(a)
+        return self._execute("rfftn", a, a.shape, self._axes(a, axes))
+        
+    def irfftn(self, a, s=None, axes=None):
+        """N-dimensional inverse of :meth:`rfftn`."""
+        a = np.asarray(a)
+        axes = self._axes(a, axes)
+        shape = list(a.shape)
+        if s is None:
+            shape[axes[-1]] = 2 * (a.shape[axes[-1]] - 1)
+        else:
+            for axis, length in zip(axes, s):
+                shape[axis] = length
+        return self._execute("irfftn", a, shape, axes)
+        
+_default_backend = None
+_backend_instances = {}
+
+def get_backend(backend=None, **kwargs):
+    """Get an FFT backend.
+    
+    :param backend: An :class:`FFTBackend` instance, which is returned unchanged, the name of
+        a registered backend, or ``None`` for the global default set by :func:`set_backend`.
+    :param kwargs: Keyword arguments used to construct a named backend.
+    :returns: An :class:`FFTBackend` instance.
+    
+    Named backends without keyword arguments are constructed once and shared.
+    """
+    if isinstance(backend, FFTBackend):
+        return backend
+    if backend is None:
+        if _default_backend is None:
+            set_backend(ScipyBackend.name)
+        return _default_backend
+    if backend not in FFTBackend._REGISTRY:
+        raise ValueError("Unknown FFT backend {0!r}, expected one of {1!r}.".format(backend, sorted(FFTBackend._REGISTRY)))
+    if kwargs:
+        return FFTBackend._REGISTRY[backend](**kwargs)
+    if backend not in _backend_instances:
+        _backend_instances[backend] = FFTBackend._REGISTRY[backend]()
+    return _backend_instances[backend]
+    
+def set_backend(backend, **kwargs):
+    """Set the global default FFT backend.
+    
+    :param backend: An :class:`FFTBackend` instance, or the name of a registered backend.
+    :param kwargs: Keyword arguments used to construct a named backend, e.g. ``workers=-1``.
+    :returns: The new default :class:`FFTBackend`.
+    """
+    global _default_backend
+    _default_backend = get_backend(backend, **kwargs)
+    return _default_backend
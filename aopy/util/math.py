@@ -30,11 +30,18 @@ Phase and Aperture Functions
 Other Mathematical Functions
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
+.. autofunction::
+    fast_shift
+
+.. autoclass::
+    Shifter
+    :members:
+
 """
 from __future__ import (absolute_import, unicode_literals, division,
                         print_function)
                   
-import functools, contextlib
+import functools, contextlib, collections, threading
 import numpy as np
 
 
@@ -59,12 +66,12 @@ def depiston(phase,aperture=None,get_piston=False):
     """Remove the piston term from a phase array.
     
     :param phase: The phase to depiston.
-    :param aperture: The aperture over which to consider the phase. This is a boolean mask. Defaults to the full aperture.
+    :param aperture: The aperture over which to consider the phase. This is a boolean mask, or an :class:`~aopy.aperture.core.Aperture`. Defaults to the full aperture.
     :param bool get_piston: Whether to return a value for the piston along with the depiston-ed phase.
     :returns: ``phase`` or ``(phase, piston)``
     """
-    aperture = (np.ones_like(phase) if aperture is None else aperture).astype(np.bool)
-    piston = np.sum(phase[aperture])/np.sum(aperture)
+    aperture = np.ones(phase.shape, dtype=np.bool) if aperture is None else (np.asarray(aperture) != 0)
+    piston = np.mean(phase[aperture])
     if get_piston:
         return (phase - piston, piston)
     else:
@@ -109,6 +116,117 @@ def edgemask(aperture):
     result = scipy.signal.convolve((aperture != 0).astype(np.float),kernel,mode='same')
     return result >= 9
     
+class Shifter(object):
+    """A reusable shift, which takes windows of one output shape from sources of one shape.
+    
+    :param tuple source_shape: The shape of the source arrays.
+    :param tuple shape: The desired output shape, after the shift.
+    :param int pad: The padding used around the output, for interpolation.
+    
+    The integer part of each shift is taken from the source with two 1-D index vectors, one for rows
+    and one for columns, which wrap around the source with modular arithmetic, and are broadcast
+    against each other to take the window. Only the fractional part of each shift is interpolated.
+    Use :meth:`cached` to share shifters between calls with the same shapes.
+    """
+    
+    _CACHE = collections.OrderedDict()
+    
+    cache_size = 32
+    """The maximum number of shifters kept by :meth:`cached`, in least-recently-used order."""
+    
+    def __init__(self, source_shape, shape=None, pad=1):
+        super(Shifter, self).__init__()
+        self.source_shape = tuple(int(s) for s in source_shape)
+        self.shape = self.source_shape if shape is None else tuple(int(s) for s in shape)
+        self.pad = int(pad)
+        self._rows = np.arange(self.shape[0] + 2 * self.pad, dtype=np.intp) - self.pad
+        self._cols = np.arange(self.shape[1] + 2 * self.pad, dtype=np.intp) - self.pad
+        self._local = threading.local()
+        
+    @classmethod
+    def cached(cls, source_shape, shape=None, pad=1):
+        """Get a shifter, reusing one with the same shapes if it exists.
+        
+        :param tuple source_shape: The shape of the source arrays.
+        :param tuple shape: The desired output shape, after the shift.
+        :param int pad: The padding used around the output, for interpolation.
+        """
+        key = (tuple(source_shape), None if shape is None else tuple(shape), pad)
+        shifter = cls._CACHE.pop(key, None)
+        if shifter is None:
+            shifter = cls(source_shape, shape, pad)
+        cls._CACHE[key] = shifter
+        while len(cls._CACHE) > max(cls.cache_size, 0):
+            cls._CACHE.popitem(last=False)
+        return shifter
+        
+    @property
+    def window_shape(self):
+        """The shape of the padded windows. **Read-Only**"""
+        return (self._rows.shape[0], self._cols.shape[0])
+        
+    def indices(self, offset):
+        """The 1-D row and column indices of the window for an integer offset.
+        
+        :param offset: The integer shift, ``(rows, columns)``.
+        :returns: ``(rows, cols)``, with shapes ``(n, 1)`` and ``(1, m)``, to be broadcast against each other.
+        """
+        rows = np.mod(self._rows - int(offset[0]), self.source_shape[0])
+        cols = np.mod(self._cols - int(offset[1]), self.source_shape[1])
+        return rows[:,np.newaxis], cols[np.newaxis,:]
+        
+    def take(self, source, offset, out=None):
+        """Take the padded window for an integer offset, wrapping around the source.
+        
+        :param source: The source array.
+        :param offset: The integer shift, ``(rows, columns)``.
+        :param out: An optional output array, with shape :attr:`window_shape`.
+        :returns: The window, where ``window[i + pad, j + pad] == source[i - offset[0], j - offset[1]]``.
+        """
+        rows, cols = self.indices(offset)
+        if out is None:
+            return source[rows, cols]
+        flat = getattr(self._local, 'flat', None)
+        if flat is None:
+            flat = self._local.flat = np.empty(self.window_shape, dtype=np.intp)
+        np.multiply(rows, self.source_shape[1], out=flat)
+        flat += cols
+        return source.take(flat, out=out)
+        
+    def crop(self, window):
+        """Remove the padding from a window.
+        
+        :param window: A padded window, with shape :attr:`window_shape`.
+        :returns: A view of the window, with the output shape.
+        """
+        x, y = self.shape
+        return window[self.pad:self.pad + x,self.pad:self.pad + y]
+        
+    def __call__(self, source, shift, order=1, mode='wrap', prefilter=True):
+        """Shift the source, clipping to match the output shape.
+        
+        :param source: The source array, with shape :attr:`source_shape`.
+        :param shift: The shift vector.
+        :param int order: The spline interpolation order, ``1 <= order <= 5``.
+        :param mode: What to do at the borders of the window, see :func:`scipy.ndimage.interpolation.shift`.
+        :param bool prefilter: Whether to apply a spline interpolation prefilter to the window.
+        :returns: The shifted array, where ``output[i, j] == source[i - shift[0], j - shift[1]]``.
+        """
+        import scipy.ndimage.interpolation
+        shift = np.asarray(shift, dtype=np.float64)
+        floor = np.floor(shift)
+        fraction = shift - floor
+        shifted = self.take(source, floor.astype(np.intp))
+        if (fraction != 0.0).any():
+            shifted = scipy.ndimage.interpolation.shift(
+                input = shifted,
+                shift = fraction,
+                order = order,
+                mode = mode,
+                prefilter = prefilter,
+            )
+        return self.crop(shifted)
+        
 def fast_shift(source, shift, order=1, mode='wrap', prefilter=True, shape=None, pad=1):
     """Do a fast shift, clipping to match output shape.
     
@@ -122,32 +240,10 @@ def fast_shift(source, shift, order=1, mode='wrap', prefilter=True, shape=None,
     :param shape: The desired output shape, after the shift. The output shape will start from the ``0,0`` index after the shift.
     :param int pad: The padding used around array edges. Padding allows this method to fix the broken `wrap` mode in :mod:`scipy.ndimage`.
     
-    This is a wrapper around :func:`scipy.ndimage.interpolation.shift` which speeds up shifting if the desired output shape is much smaller than the total array shape. It works by only undertaking the non-integer part of the shift in scipy, and using indexing tricks to collect only the target area and a 1-element border.
+    This is a wrapper around :func:`scipy.ndimage.interpolation.shift` which speeds up shifting if the desired output shape is much smaller than the total array shape. It works by only undertaking the non-integer part of the shift in scipy, and using indexing tricks to collect only the target area and a `pad` element border. The indexing is done by a cached :class:`Shifter`, so repeated shifts with the same shapes don't rebuild any index arrays.
     """
-    import scipy.ndimage.interpolation
-    shift = np.array(shift)
-    if shape is None:
-        shape = source.shape
-    _shape = tuple(np.array(shape) + 2*pad)
-    _inds = np.indices(_shape)
-    _floor = np.floor(shift)
-    _shift = (shift - _floor)
-    _start = -1 * _floor - pad    
-    _inds += _start[:,np.newaxis,np.newaxis]
-    r_inds = np.ravel_multi_index(_inds, source.shape, mode='wrap')
-    shifted = source.flat[r_inds]
-    if (_shift != 0.0).any():
-        interped = scipy.ndimage.interpolation.shift(
-            input = shifted,
-            shift = -1*_shift,
-            order = order,
-            mode = mode,
-            prefilter = prefilter,
-        )
-    else:
-        interped = shifted
-    x,y = np.array(shape) + pad
-    return interped[pad:x,pad:y]
+    shifter = Shifter.cached(source.shape, shape, pad)
+    return shifter(source, shift, order=order, mode=mode, prefilter=prefilter)
 
     
 def slow_shift(input, shift, order=1, mode='wrap', prefilter=True, output_shape=None):
@@ -221,6 +221,7 @@ class PhasePlayer(pyshell.CLIEngine):
         self.parser.add_argument('--sigclip', action='store_true', help='use sigma-clipped data (3sig)')
         self.parser.add_argument('--cmap', type=six.text_type, help='colormap', default='binary')
         self.parser.add_argument('--fft', action='store_true', help='FFT data before display')
+        self.parser.add_argument('--fft-backend', dest='fft_backend', type=six.text_type, help='FFT backend (numpy, scipy or fftw)', default=None)
         self.parser.add_argument('-v','--verbose', action='store_true', help='be verbose')
         self.parser.add_argument('--idl', help='IDL Scope to use for .sav files', default='')
         self.parser.add_argument('--hdf5', type=six.text_type, help='Data path for HDF5 files.')
@@ -298,8 +299,9 @@ class PhasePlayer(pyshell.CLIEngine):
         self.ntime = 0
         self.data = self.get_data(self.opts.file)
         if self.opts.fft:
-            import scipy.fftpack
-            self.data = np.abs(scipy.fftpack.fftshift(scipy.fftpack.fftn(self.data, axes=(1,2)), axes=(1,2)))
+            from aopy.util.fft import get_backend
+            fft = get_backend(self.opts.fft_backend)
+            self.data = np.abs(fft.fftshift(fft.fftn(self.data, axes=(1,2)), axes=(1,2)))
         self.ntime = self.data.shape[0]
         
         if self.opts.sigclip:
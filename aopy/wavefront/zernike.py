@@ -48,6 +48,29 @@ Calculating Zernike Slopes
 
 .. autofunction:: zernike_slope_cartesian
 
+Zernike Bases
+-------------
+
+To decompose many phase frames into Zernike modes, or to build many phase frames from
+Zernike coefficients, use a :class:`ZernikeBasis`. It evaluates the modes once on the open
+pixels of an aperture, so that each decomposition is a single matrix multiply::
+    
+    X, Y = np.mgrid[-20:20,-20:20] / 19.0
+    basis = ZernikeBasis((X, Y), 200)
+    coeffs = basis.decompose(phase_cube)
+    phase_cube = basis.synthesize(coeffs)
+    
+
+.. autoclass:: ZernikeBasis
+    :members:
+
+The slopes of the modes are available the same way, from a :class:`ZernikeSlopeBasis`, where the
+slopes are the analytic gradients of the modes at the centers of the subapertures of a Shack-Hartmann
+wavefront sensor. Its :meth:`~ZernikeSlopeBasis.decompose` method is a least-squares modal reconstructor.
+
+.. autoclass:: ZernikeSlopeBasis
+    :members:
+
 Index Conversion Tools
 ----------------------
 
@@ -55,6 +78,8 @@ Index Conversion Tools
 
 .. autofunction:: zern_to_noll
 
+.. autofunction:: noll_table
+
 Zernike Triangle Diagrams
 -------------------------
 
@@ -73,6 +98,8 @@ These functions are used internally to calculated the Zernike polynomials. They
 
 .. autofunction:: zernike_rho
 
+.. autofunction:: zernike_rho_all
+
 .. autofunction:: zernike_rho_slope
 
 .. autofunction:: zernike_phi_slope
@@ -84,6 +111,9 @@ These functions are used internally to calculated the Zernike polynomials. They
 from __future__ import (absolute_import, unicode_literals, division,
                         print_function)
 
+import collections
+import hashlib
+
 import numpy as np
 
 from scipy.misc import factorial
@@ -108,6 +138,83 @@ def zernike_ks(n, m, slope=False):
     kterm = ((-1.0)**ks * factorial(n-ks)) / (factorial(ks) * factorial((n+m)/2.0 - ks) * factorial((n-m)/2.0 - ks))
     return ks, kterm
 
+def _zernike_rho_column(m, nmax, Rho, Rho2=None, slope=False):
+    """
+    Generate the radial components :math:`R_{n}^{m}` for a single `m`, and ``n = m, m+2, ... <= nmax``,
+    with Kintner's three-term recurrence in `n`.
+    
+    :returns: A generator of ``(n, R)`` pairs, or ``(n, R, dR)`` with the radial derivative if `slope` is set.
+    """
+    if Rho2 is None:
+        Rho2 = Rho * Rho
+    if m > nmax:
+        return
+    R4 = np.power(Rho, m)
+    if slope:
+        Rm1 = np.power(Rho, m - 1) if m > 0 else np.zeros_like(Rho)
+        D4 = m * Rm1
+        yield m, R4, D4
+    else:
+        yield m, R4
+    if m + 2 > nmax:
+        return
+    R2 = (m + 2) * R4 * Rho2 - (m + 1) * R4
+    if slope:
+        D2 = (m + 2) * (m + 2) * R4 * Rho - (m + 1) * m * Rm1
+        yield m + 2, R2, D2
+    else:
+        yield m + 2, R2
+    for n in range(m + 4, nmax + 1, 2):
+        K1 = (n + m) * (n - m) * (n - 2) / 2.0
+        K2 = 2.0 * n * (n - 1) * (n - 2)
+        K3 = -1.0 * m * m * (n - 1) - n * (n - 1) * (n - 2)
+        K4 = -1.0 * n * (n + m - 2) * (n - m - 2) / 2.0
+        R = ((K2 / K1) * Rho2 + (K3 / K1)) * R2 + (K4 / K1) * R4
+        if slope:
+            D = ((K2 / K1) * Rho2 + (K3 / K1)) * D2 + (2.0 * K2 / K1) * Rho * R2 + (K4 / K1) * D4
+            yield n, R, D
+            D4, D2 = D2, D
+        else:
+            yield n, R
+        R4, R2 = R2, R
+    
+def zernike_rho_all(nmax, Rho, slope=False):
+    r"""
+    Calculate all of the radial components of the zernike polynomials up to order `nmax`, in one pass.
+    
+    :param int nmax: The maximum Zernike `n` index.
+    :param Rho: The radii on which to calculate.
+    :param bool slope: Whether to also calculate the radial slopes, :math:`\partial R_{n}^{m} / \partial \rho`.
+    :returns: A dictionary of the :math:`R_{n}^{m}` zernike components, keyed by ``(n, m)``, for
+        :math:`0 \le m \le n \le n_{max}` and :math:`n-m` even. If `slope` is set, the values are
+        ``(R, dR)`` pairs of the components and their radial slopes.
+    
+    Each component is calculated from the two before it with the same `m`, using Kintner's three-term recurrence
+    
+    .. math::
+        
+        K_1 R_{n}^{m} = (K_2 \rho^2 + K_3) R_{n-2}^{m} + K_4 R_{n-4}^{m}
+        
+    starting from :math:`R_{m}^{m} = \rho^m` and :math:`R_{m+2}^{m} = (m+2) \rho^{m+2} - (m+1) \rho^m`, where
+    
+    .. math::
+        
+        K_1 = (n+m)(n-m)(n-2)/2, \quad K_2 = 2n(n-1)(n-2),
+        
+        K_3 = -m^2(n-1) - n(n-1)(n-2), \quad K_4 = -n(n+m-2)(n-m-2)/2
+        
+    so there are no factorials to overflow and no cancellation between large terms, and the cost is linear
+    in the number of components. The radial slopes follow from differentiating the same recurrence.
+    
+    """
+    Rho = np.asarray(Rho, dtype=np.float64)
+    Rho2 = Rho * Rho
+    radial = {}
+    for m in range(int(nmax) + 1):
+        for terms in _zernike_rho_column(m, int(nmax), Rho, Rho2, slope=slope):
+            radial[(terms[0], m)] = terms[1:] if slope else terms[1]
+    return radial
+    
 def zernike_rho(n, m, Rho):
     r"""
     Calculate the radial component of the zernike polynomial, often called :math:`R_{n}^{m}`.
@@ -124,13 +231,15 @@ def zernike_rho(n, m, Rho):
         
         R_{n}^{m}(\rho) = \sum_{k=0}^{(n-m)/2} \frac{(-1)^k (n-k)!}{k! ((n+m)/2 - k)! ((n-m)/2 - k)!} \rho^{n-2k}
         
+    but are calculated with the recurrence used by :func:`zernike_rho_all`, which remains accurate for large `n`.
     """
     # The Zernike Polynomials are identically 0 for (m-n) odd.
-    if np.mod(n-m, 2) == 1:
+    Rho = np.asarray(Rho, dtype=np.float64)
+    if np.mod(n-m, 2) == 1 or m > n:
         return np.zeros_like(Rho)
-    ks, kterm = zernike_ks(n, m)
-    R = np.power(Rho[...,np.newaxis], n - 2.0 * ks) * kterm
-    return np.sum(R, axis=-1)
+    for _n, R in _zernike_rho_column(int(m), int(n), Rho):
+        pass
+    return R
     
 def zernike_rho_slope(n, m, Rho):
     r"""
@@ -255,39 +364,89 @@ def zernike_slope_cartesian(n, m, X, Y):
     Y_s = np.sin(Phi) * S_Rho + np.cos(Phi) * S_Phi / DRho
     return X_s, Y_s
     
+#: The maximum Zernike order `n` kept in the Noll index lookup table, see :func:`noll_table`.
+noll_table_order = 64
+
+_NOLL_TABLE = {}
+
+def noll_table(nmax=None):
+    """
+    A lookup table of the Zernike indices for every linear Noll index up to order `nmax`.
+    
+    :param int nmax: The maximum Zernike `n` index. Defaults to :data:`noll_table_order`.
+    :returns: ``(n, m)``, read-only integer arrays with ``(nmax+1)(nmax+2)/2`` entries, indexed by linear Noll index.
+    
+    Tables are built once for each order, and shared.
+    """
+    nmax = noll_table_order if nmax is None else int(nmax)
+    if nmax < 0:
+        raise ValueError("Zernike orders start at 0. nmax={:d}".format(nmax))
+    if nmax not in _NOLL_TABLE:
+        n = np.repeat(np.arange(nmax + 1), np.arange(1, nmax + 2))
+        m = 2 * np.arange(n.shape[0]) - n * (n + 2)
+        n.flags.writeable = False
+        m.flags.writeable = False
+        _NOLL_TABLE[nmax] = (n, m)
+    return _NOLL_TABLE[nmax]
+
 def noll_to_zern(j):
     """
     Convert from linear Noll index to a tuple of Zernike indicies.
     
-    :param int j: Linear Noll Index
+    :param j: Linear Noll Index, or an array of indices.
+    :returns: ``(n, m)``, as integers for a single index, or as integer arrays with the shape of `j`.
     
+    Indices within :data:`noll_table_order` are looked up in :func:`noll_table`, and larger indices are
+    calculated directly.
     """
-    if (j < 0):
-        raise ValueError("Noll indices start at 0. j={:d}".format(j))
-    
-    n = np.ceil((-3 + np.sqrt(9 + 8*j))/2)
-    m = 2*j - n*(n+2)
-    if not int(n) == n:
-        raise ValueError("This should never happen, n={:f} should be an integer.".format(n))
-    if not int(m) == m:
-        raise ValueError("This should never happen, m={:f} should be an integer.".format(m))
+    scalar = (np.ndim(j) == 0)
+    j = np.asarray(j)
+    if j.dtype.kind not in 'iu':
+        if not (np.mod(j, 1) == 0).all():
+            raise ValueError("Noll indices must be integers. j={!r}".format(j))
+        j = j.astype(np.int64)
+    if (j < 0).any():
+        raise ValueError("Noll indices start at 0. j={!r}".format(j))
+    
+    table_n, table_m = noll_table()
+    if j.size == 0 or j.max() < table_n.shape[0]:
+        n, m = table_n[j], table_m[j]
+    else:
+        j = j.astype(np.int64)
+        n = np.ceil((-3 + np.sqrt(9 + 8*j))/2).astype(np.int64)
+        # Correct any rounding in the square root, so that n(n+1)/2 <= j < (n+1)(n+2)/2.
+        n -= ((n * (n+1)) // 2 > j)
+        n += (((n+1) * (n+2)) // 2 <= j)
+        m = 2*j - n*(n+2)
     
-    return (int(n), int(m))
+    if scalar:
+        return (int(n), int(m))
+    return (n, m)
 
 def zern_to_noll(n, m):
     """
     Convert a Zernike index pair, (n,m) to a Linear Noll index.
         
-    :param n: Zernike `n` index.
-    :param m: Zernike `m` index.
+    :param n: Zernike `n` index, or an array of indices.
+    :param m: Zernike `m` index, or an array of indices.
+    :returns: The linear Noll index, as an integer for a single pair, or as an integer array.
     
     """
-    j = (n * (n+1))/2 + (n+m)/2
-    
-    if not int(j) == j:
-        raise ValueError("This should never happen, j={:f} should be an integer.".format(j))
-    
-    return int(j)
+    scalar = (np.ndim(n) == 0 and np.ndim(m) == 0)
+    n = np.asarray(n)
+    m = np.asarray(m)
+    if not ((np.mod(n, 1) == 0).all() and (np.mod(m, 1) == 0).all()):
+        raise ValueError("Zernike indices must be integers. n={!r}, m={!r}".format(n, m))
+    n = n.astype(np.int64)
+    m = m.astype(np.int64)
+    if (np.mod(n + m, 2) != 0).any():
+        raise ValueError("Zernike indices must have n-m even. n={!r}, m={!r}".format(n, m))
+    
+    j = (n * (n+1))//2 + (n+m)//2
+    
+    if scalar:
+        return int(j)
+    return j
 
 def zernike_noll_polar(j, Rho, Phi):
     """
@@ -313,6 +472,250 @@ def zernike_noll_cartesian(j, X, Y):
     Rho, Phi = cartesian_to_polar(X, Y)
     return zernike_noll_polar(j, Rho, Phi)
     
+def _array_hash(*arrays):
+    """A hash of the shapes and contents of some arrays."""
+    digest = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(repr((array.shape, array.dtype.str)).encode('utf-8'))
+        digest.update(array.view(np.uint8).tobytes())
+    return digest.hexdigest()
+
+class ZernikeBasis(object):
+    """
+    A basis of Zernike modes, evaluated once on the open pixels of an aperture on a fixed grid.
+    
+    :param grid: The ``(X, Y)`` coordinates of the grid, scaled so that the Zernike radius is 1.
+    :param int nmodes: The number of modes, starting from linear Noll index 0.
+    :param aperture: The aperture, a boolean mask with the shape of the grid. Defaults to the pixels within
+        the unit circle.
+    
+    The modes are stored as a compact ``(nmodes, npix)`` matrix, where ``npix`` is the number of open pixels
+    in the aperture. Matrices are cached by the contents of the grid and aperture, so many bases on the same
+    grid share one read-only matrix (see :attr:`cache_size`).
+    """
+    
+    _CACHE = collections.OrderedDict()
+    
+    cache_size = 8
+    """The maximum number of basis matrices kept, in least-recently-used order."""
+    
+    def __init__(self, grid, nmodes, aperture=None):
+        super(ZernikeBasis, self).__init__()
+        X, Y = (np.asarray(g, dtype=np.float64) for g in grid)
+        if X.shape != Y.shape:
+            raise ValueError("Grid coordinates must have the same shape. X{0!r} != Y{1!r}".format(X.shape, Y.shape))
+        if aperture is None:
+            aperture = (X**2 + Y**2) <= 1.0
+        aperture = np.asarray(aperture) != 0
+        if aperture.shape != X.shape:
+            raise ValueError("Aperture must have the grid shape {0!r}, not {1!r}".format(X.shape, aperture.shape))
+        self._nmodes = int(nmodes)
+        if self._nmodes < 1:
+            raise ValueError("A basis needs at least one mode, got {0:d}".format(self._nmodes))
+        self._aperture = aperture
+        self._aperture.flags.writeable = False
+        self._key = (type(self).__name__, _array_hash(X, Y, aperture), self._nmodes)
+        self._entry = self._cached(self._key, X[aperture], Y[aperture], self._nmodes)
+        
+    @classmethod
+    def _cached(cls, key, X, Y, nmodes):
+        """Get the cached ``[matrix, projector]`` entry for a basis, computing the matrix if necessary."""
+        cached = cls._CACHE.pop(key, None)
+        if cached is None:
+            matrix = cls._compute(X, Y, nmodes)
+            matrix.flags.writeable = False
+            cached = [matrix, None]
+        cls._CACHE[key] = cached
+        while len(cls._CACHE) > max(cls.cache_size, 0):
+            cls._CACHE.popitem(last=False)
+        return cached
+        
+    @classmethod
+    def clear_cache(cls):
+        """Discard all cached basis matrices."""
+        cls._CACHE.clear()
+        
+    @staticmethod
+    def _compute(X, Y, nmodes):
+        """Evaluate the modes at the points ``(X, Y)``.
+        
+        The polar coordinates are computed once, and all of the radial components are computed in one pass
+        with :func:`zernike_rho_all`.
+        """
+        Rho, Phi = cartesian_to_polar(X, Y)
+        ns, ms = noll_to_zern(np.arange(nmodes))
+        radial = zernike_rho_all(ns[-1], Rho)
+        matrix = np.empty((nmodes, Rho.shape[0]), dtype=np.float64)
+        for j, (n, m) in enumerate(zip(ns.tolist(), ms.tolist())):
+            R = radial[(n, np.abs(m))]
+            if m > 0:
+                R = R * np.cos(m * Phi)
+            elif m < 0:
+                R = R * np.sin(np.abs(m) * Phi)
+            matrix[j] = R * np.sqrt((2 * (n+1))/(1 + int(m == 0)))
+        return matrix
+        
+    @property
+    def nmodes(self):
+        """The number of modes. **Read-Only**"""
+        return self._nmodes
+        
+    @property
+    def shape(self):
+        """The shape of the grid. **Read-Only**"""
+        return self._aperture.shape
+        
+    @property
+    def aperture(self):
+        """The aperture, as a boolean mask. **Read-Only**"""
+        return self._aperture
+        
+    @property
+    def npix(self):
+        """The number of open pixels in the aperture. **Read-Only**"""
+        return self.matrix.shape[-1]
+        
+    @property
+    def matrix(self):
+        """The modes, on the open pixels of the aperture, with shape ``(nmodes, npix)``. **Read-Only**"""
+        return self._entry[0]
+        
+    @property
+    def projector(self):
+        """The least-squares projection onto the modes, the pseudo-inverse of :attr:`matrix`, with shape
+        ``(npix, nmodes)``. This is computed when it is first used, and cached with :attr:`matrix`. **Read-Only**"""
+        if self._entry[1] is None:
+            projector = np.linalg.pinv(self.matrix)
+            projector.flags.writeable = False
+            self._entry[1] = projector
+        return self._entry[1]
+        
+    def decompose(self, phase):
+        """
+        Decompose phase into Zernike coefficients, with a single matrix multiply.
+        
+        :param phase: The phase, with shape ``(..., nx, ny)``, for any number of frames.
+        :returns: The least-squares coefficients, with shape ``(..., nmodes)``.
+        
+        """
+        phase = np.asarray(phase)
+        if phase.shape[-2:] != self.shape:
+            raise ValueError("Phase must have the grid shape {0!r}, not {1!r}".format(self.shape, phase.shape[-2:]))
+        return np.dot(phase[...,self._aperture], self.projector)
+        
+    def synthesize(self, coeffs):
+        """
+        Build phase from Zernike coefficients, with a single matrix multiply.
+        
+        :param coeffs: The coefficients, with shape ``(..., nmodes)``, for any number of frames.
+        :returns: The phase, with shape ``(..., nx, ny)``, which is zero outside of the aperture.
+        
+        """
+        coeffs = np.asarray(coeffs)
+        if coeffs.shape[-1] != self._nmodes:
+            raise ValueError("Coefficients must have {0:d} modes, not {1:d}".format(self._nmodes, coeffs.shape[-1]))
+        phase = np.zeros(coeffs.shape[:-1] + self.shape, dtype=np.result_type(coeffs.dtype, self.matrix.dtype))
+        phase[...,self._aperture] = np.dot(coeffs, self.matrix)
+        return phase
+        
+class ZernikeSlopeBasis(ZernikeBasis):
+    """
+    A basis of the x and y slopes of Zernike modes, evaluated once on the open subapertures of a
+    Shack-Hartmann wavefront sensor on a fixed grid.
+    
+    :param grid: The ``(X, Y)`` coordinates of the subaperture centers, scaled so that the Zernike radius is 1.
+    :param int nmodes: The number of modes, starting from linear Noll index 0.
+    :param aperture: The illuminated subapertures, a boolean mask with the shape of the grid. Defaults to
+        the subapertures within the unit circle.
+    
+    The slopes are the analytic gradients of each mode at the subaperture centers, with respect to ``X``
+    and ``Y``, stored as a compact interaction matrix with shape ``(nmodes, 2, npix)``. Slopes with respect to
+    pixels are these slopes divided by the Zernike radius in pixels. The piston mode has no slope, and
+    so is never reconstructed.
+    """
+    
+    @staticmethod
+    def _compute(X, Y, nmodes):
+        """Evaluate the slopes of the modes at the points ``(X, Y)``.
+        
+        The radial components and their slopes are computed in one pass with :func:`zernike_rho_all`,
+        and converted to cartesian slopes with
+        
+        .. math::
+            
+            \\frac{\\partial Z}{\\partial x} = \\cos\\varphi \\frac{\\partial Z}{\\partial \\rho} - \\frac{\\sin\\varphi}{\\rho} \\frac{\\partial Z}{\\partial \\varphi}
+            
+            \\frac{\\partial Z}{\\partial y} = \\sin\\varphi \\frac{\\partial Z}{\\partial \\rho} + \\frac{\\cos\\varphi}{\\rho} \\frac{\\partial Z}{\\partial \\varphi}
+            
+        """
+        Rho, Phi = cartesian_to_polar(X, Y)
+        ns, ms = noll_to_zern(np.arange(nmodes))
+        radial = zernike_rho_all(ns[-1], Rho, slope=True)
+        center = (Rho == 0)
+        cos_Phi, sin_Phi = np.cos(Phi), np.sin(Phi)
+        matrix = np.empty((nmodes, 2, Rho.shape[0]), dtype=np.float64)
+        for j, (n, m) in enumerate(zip(ns.tolist(), ms.tolist())):
+            R, dR = radial[(n, np.abs(m))]
+            # R / rho, which tends to dR at the center for the modes where it is used (m != 0).
+            R_Rho = np.where(center, dR, R / np.where(center, 1.0, Rho))
+            if m > 0:
+                angular, dangular = np.cos(m * Phi), -m * np.sin(m * Phi)
+            elif m < 0:
+                angular, dangular = np.sin(-m * Phi), -m * np.cos(-m * Phi)
+            else:
+                angular, dangular = 1.0, 0.0
+            norm = np.sqrt((2 * (n+1))/(1 + int(m == 0)))
+            matrix[j,0] = norm * (cos_Phi * dR * angular - sin_Phi * R_Rho * dangular)
+            matrix[j,1] = norm * (sin_Phi * dR * angular + cos_Phi * R_Rho * dangular)
+        return matrix
+        
+    @property
+    def matrix(self):
+        """The slopes of the modes, on the open subapertures, with shape ``(nmodes, 2, npix)``. **Read-Only**"""
+        return self._entry[0]
+        
+    @property
+    def projector(self):
+        """The least-squares modal reconstructor, the pseudo-inverse of :attr:`matrix`, with shape
+        ``(2 * npix, nmodes)``. This is computed when it is first used, and cached with :attr:`matrix`. **Read-Only**"""
+        if self._entry[1] is None:
+            projector = np.linalg.pinv(self.matrix.reshape((self._nmodes, -1)))
+            projector.flags.writeable = False
+            self._entry[1] = projector
+        return self._entry[1]
+        
+    def decompose(self, slopes):
+        """
+        Reconstruct Zernike coefficients from slopes, with a single matrix multiply.
+        
+        :param slopes: The slopes, with shape ``(..., 2, nx, ny)``, where ``[...,0,:,:]`` are the x slopes and
+            ``[...,1,:,:]`` are the y slopes, for any number of frames.
+        :returns: The least-squares coefficients, with shape ``(..., nmodes)``.
+        
+        """
+        slopes = np.asarray(slopes)
+        if slopes.shape[-3:] != (2,) + self.shape:
+            raise ValueError("Slopes must have shape (..., 2) + {0!r}, not {1!r}".format(self.shape, slopes.shape))
+        slopes = slopes[...,self._aperture]
+        return np.dot(slopes.reshape(slopes.shape[:-2] + (-1,)), self.projector)
+        
+    def synthesize(self, coeffs):
+        """
+        Build slopes from Zernike coefficients, with a single matrix multiply.
+        
+        :param coeffs: The coefficients, with shape ``(..., nmodes)``, for any number of frames.
+        :returns: The slopes, with shape ``(..., 2, nx, ny)``, which are zero outside of the aperture.
+        
+        """
+        coeffs = np.asarray(coeffs)
+        if coeffs.shape[-1] != self._nmodes:
+            raise ValueError("Coefficients must have {0:d} modes, not {1:d}".format(self._nmodes, coeffs.shape[-1]))
+        slopes = np.zeros(coeffs.shape[:-1] + (2,) + self.shape, dtype=np.result_type(coeffs.dtype, self.matrix.dtype))
+        values = np.dot(coeffs, self.matrix.reshape((self._nmodes, -1)))
+        slopes[...,self._aperture] = values.reshape(coeffs.shape[:-1] + (2, -1))
+        return slopes
+        
 def cartesian_to_polar(X, Y):
     """
     Convert a coordinate grid/pair from cartesian to polar coordinates.
@@ -93,6 +93,7 @@ package_info['package_data'][PACKAGENAME].extend(c_files)
 package_info['entry_points'] = {
         'console_scripts' : [
             'telempy = telempy.controllers.controller:TelempyController.script',
+            'aopy-reconstruct = aopy.reconstructors.cli:ReconstructTelemetry.script',
         ],
         'telempy.plugins' : [
             'telempy = telempy:configuration'
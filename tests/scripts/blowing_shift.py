@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# 
+#  blowing_shift.py
+#  aopy
+#  
+#  Created by Alexander Rudy on 2014-08-02.
+#  Copyright 2014 Alexander Rudy. All rights reserved.
+# 
+"""
+Benchmark spline and Fourier sub-pixel shifts of a :class:`~aopy.atmosphere.wind.BlowingScreen`,
+comparing frame rates and the high spatial frequency power left in each frame.
+
+Usage: python tests/scripts/blowing_shift.py [nt] [repeats]
+"""
+
+from __future__ import (absolute_import, unicode_literals, division,
+                        print_function)
+
+import sys
+import timeit
+
+import numpy as np
+
+from aopy.atmosphere.wind import BlowingScreen
+
+nt = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+def high_power(screens):
+    """The fraction of power above half the Nyquist frequency."""
+    power = np.abs(np.fft.fft2(screens - screens.mean(axis=(1,2), keepdims=True)))**2
+    k = np.abs(np.fft.fftfreq(screens.shape[1]))
+    high = (k[:,np.newaxis] > 0.25) | (k[np.newaxis,:screens.shape[2]] > 0.25)
+    return power[:,high].sum() / power.sum()
+
+print("{0:>5s} {1:>16s} {2:>12s} {3:>12s}".format("n", "method", "frames/s", "high power"))
+for n in [32, 64, 128]:
+    ts = np.arange(nt) * 1.05
+    for method, kwargs in [("spline", dict(order=3)), ("fourier", dict(shift_method='fourier')),
+        ("fourier batched", dict(shift_method='fourier'))]:
+        S = BlowingScreen((n, n), r0=0.3, du=0.1, seed=5, vel=[1.0, 0.4], tmax=nt * 1.05, **kwargs)
+        if method == "fourier batched":
+            get = lambda : S.get_screens(ts)
+        else:
+            get = lambda : np.array([S.get_screen(t) for t in ts])
+        elapsed = min(timeit.repeat(get, number=1, repeat=repeats))
+        print("{0:5d} {1:>16s} {2:12.1f} {3:12.4f}".format(n, method, nt / elapsed, high_power(get())))
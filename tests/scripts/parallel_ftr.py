@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# 
+#  parallel_ftr.py
+#  aopy
+#  
+#  Created by Alexander Rudy on 2014-08-02.
+#  Copyright 2014 Alexander Rudy. All rights reserved.
+# 
+"""
+Benchmark the scaling of :meth:`~aopy.reconstructors.ftr.FourierTransformReconstructor.reconstruct_parallel`
+for a slope managed reconstructor, with 1, 2 and 4 threads, for each available FFT backend, with and
+without real-input FFTs. Backends which hold the GIL are reconstructed serially, whatever the number of threads.
+
+Usage: python tests/scripts/parallel_ftr.py [nt] [repeats]
+"""
+
+from __future__ import (absolute_import, unicode_literals, division,
+                        print_function)
+
+import sys
+import timeit
+import multiprocessing
+
+import numpy as np
+
+from aopy.reconstructors.slopemanage import SlopeManagedFTR
+from aopy.util.fft import get_backend
+
+nt = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+workers = [1, 2, 4]
+
+backends = []
+for name in ['numpy', 'scipy', 'fftw']:
+    try:
+        backends.append(get_backend(name))
+    except ImportError:
+        print("Backend {0:s} is not available.".format(name))
+
+random = np.random.RandomState(5)
+print("{0:d} CPUs, {1:d} frames".format(multiprocessing.cpu_count(), nt))
+print("{0:>8s} {1:>6s} {2:>5s} {3:>11s} {4:>8s} {5:>12s} {6:>8s}".format("backend", "rfft", "n", "concurrent", "workers", "frames/s", "speedup"))
+for backend in backends:
+    for rfft in [False, True]:
+        for n in [32, 64, 128]:
+            X, Y = np.mgrid[-n/2:n/2,-n/2:n/2] + 0.5
+            ap = (np.sqrt(X**2.0 + Y**2.0) < (n/2 - 2)).astype(np.int)
+            xs = random.randn(nt, n, n) * ap
+            ys = random.randn(nt, n, n) * ap
+            FTR = SlopeManagedFTR(n, ap, filter='mod_hud', manage_tt=True)
+            FTR.rfft = rfft
+            FTR.fft = backend
+            serial = None
+            for worker in workers:
+                FTR.reconstruct_parallel(xs, ys, workers=worker)
+                elapsed = min(timeit.repeat(lambda : FTR.reconstruct_parallel(xs, ys, workers=worker), number=1, repeat=repeats))
+                if serial is None:
+                    serial = elapsed
+                print("{0:>8s} {1!s:>6s} {2:5d} {3!s:>11s} {4:8d} {5:12.1f} {6:8.2f}".format(backend.name, rfft, n,
+                    backend.concurrent(real=rfft), worker, nt / elapsed, serial / elapsed))
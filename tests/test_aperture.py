@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+#  test_aperture.py
+#  aopy
+#
+#  Created by Alexander Rudy on 2014-08-02.
+#  Copyright 2014 Alexander Rudy. All rights reserved.
+#
+
+from __future__ import (absolute_import, unicode_literals, division,
+                        print_function)
+
+import nose.tools as nt
+import numpy as np
+
+from .util import npeq_
+
+from aopy.aperture.core import Aperture, DMAperture, CompactAperture
+from aopy.aperture.slopemanage import SlopeManagementPlan
+from aopy.util.math import depiston
+
+def disk(radius, n=20):
+    """A disk of ones, centered in an ``(n, n)`` array."""
+    x, y = np.mgrid[0:n,0:n] - (n - 1) / 2.0
+    return (np.hypot(x, y) <= radius).astype(np.float)
+
+class test_compact_aperture(object):
+    """aopy.aperture.core.CompactAperture"""
+    
+    def setup(self):
+        """Set up an off-center aperture."""
+        self.mask = np.zeros((12, 13), dtype=np.bool)
+        self.mask[2:9,3:7] = True
+        self.mask[4,10] = True
+        self.mask[2,3] = False
+        self.compact = CompactAperture(self.mask)
+        
+    def test_representation(self):
+        """the compact representation describes the mask"""
+        nt.eq_(self.compact.shape, self.mask.shape)
+        nt.eq_(self.compact.npix, np.count_nonzero(self.mask))
+        npeq_(self.mask, self.compact.mask, "Mask mismatch")
+        npeq_(np.flatnonzero(self.mask), self.compact.indices, "Index mismatch")
+        nt.eq_(self.compact.packed.nbytes, int(np.ceil(self.mask.size / 8)))
+        nt.ok_(not self.compact.indices.flags.writeable)
+        
+    def test_extents(self):
+        """row and column extents match the mask"""
+        npeq_(np.arange(2, 9), self.compact.rows, "Row mismatch")
+        first, last = self.compact.row_extents
+        npeq_([4, 3, 3, 3, 3, 3, 3], first, "First column mismatch")
+        npeq_([6, 6, 10, 6, 6, 6, 6], last, "Last column mismatch")
+        npeq_([3, 4, 5, 6, 10], self.compact.columns, "Column mismatch")
+        first, last = self.compact.column_extents
+        npeq_([3, 2, 2, 2, 4], first, "First row mismatch")
+        npeq_([8, 8, 8, 8, 4], last, "Last row mismatch")
+        nt.eq_(self.compact.bounding_box, (slice(2, 9), slice(3, 11)))
+        
+    def test_take_put(self):
+        """take and put work only on the open pixels"""
+        frames = np.random.RandomState(5).randn(3, 12, 13)
+        values = self.compact.take(frames)
+        nt.eq_(values.shape, (3, self.compact.npix))
+        npeq_(frames[:,self.mask], values, "Take mismatch")
+        npeq_(frames * self.mask, self.compact.put(values), "Put mismatch")
+        out = np.ones_like(frames)
+        self.compact.put(values, out=out)
+        npeq_(np.where(self.mask, frames, 1.0), out, "Put mismatch")
+        
+    def test_empty(self):
+        """an empty aperture has an empty bounding box"""
+        compact = CompactAperture(np.zeros((4, 4)))
+        nt.eq_(compact.npix, 0)
+        nt.eq_(compact.bounding_box, (slice(0, 0), slice(0, 0)))
+        
+class test_aperture(object):
+    """aopy.aperture.core.Aperture"""
+    
+    def setup(self):
+        """Set up a circular aperture."""
+        self.response = disk(8.0)
+        self.ap = Aperture(self.response)
+        
+    def test_cached(self):
+        """pupil, response and compact are computed once and read-only"""
+        nt.ok_(self.ap.pupil is self.ap.pupil)
+        nt.ok_(not self.ap.pupil.flags.writeable)
+        npeq_((self.response != 0).astype(np.int), self.ap.pupil, "Pupil mismatch")
+        nt.ok_(self.ap.response is self.ap.response)
+        nt.ok_(not self.ap.response.flags.writeable)
+        nt.ok_(self.ap.compact is self.ap.compact)
+        npeq_(self.ap.pupil != 0, self.ap.compact.mask, "Compact mismatch")
+        
+    def test_reset(self):
+        """setting the response resets the cached pupil"""
+        pupil, compact = self.ap.pupil, self.ap.compact
+        self.ap.response = (20, 20)
+        nt.ok_(self.ap.pupil is not pupil)
+        nt.ok_(self.ap.compact is not compact)
+        nt.eq_(self.ap.compact.npix, 400)
+        
+    def test_consumers(self):
+        """apertures can be used wherever a mask is expected"""
+        phase = np.random.RandomState(5).randn(20, 20)
+        mask = self.response != 0
+        npeq_(depiston(phase, mask), depiston(phase, self.ap), "Depiston mismatch")
+        mask = disk(7.0) != 0
+        ap = Aperture(mask.astype(np.float))
+        nt.eq_(SlopeManagementPlan(ap)._y_edges[0].tolist(), SlopeManagementPlan(mask)._y_edges[0].tolist())
+        
+    def test_dm(self):
+        """DM apertures are compact"""
+        dm = DMAperture(10, 2, 8)
+        nt.eq_(dm.compact.bounding_box, (slice(2, 8), slice(2, 8)))
+        nt.eq_(dm.compact.npix, 36)
+        
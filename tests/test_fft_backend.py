@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# 
+#  test_fft_backend.py
+#  aopy
+#  
+#  Created by Alexander Rudy on 2014-08-02.
+#  Copyright 2014 Alexander Rudy. All rights reserved.
+# 
+
+from __future__ import (absolute_import, unicode_literals, division,
+                        print_function)
+
+import nose.tools as nt
+from nose.plugins.skip import SkipTest
+import numpy as np
+
+from .util import npeq_
+
+from aopy.util import fft
+
+class test_fft_backends(object):
+    """aopy.util.fft backends"""
+    
+    def setup(self):
+        """Set up some data to transform."""
+        self.data = np.random.RandomState(5).randn(3, 8, 10)
+        self.axes = (1, 2)
+        
+    @nt.nottest
+    def backend_tests(self, name, **kwargs):
+        """Compare a backend to numpy.fft."""
+        try:
+            backend = fft.get_backend(name, **kwargs)
+        except ImportError:
+            raise SkipTest("Backend {0:s} is not available.".format(name))
+        data_ft = np.fft.fftn(self.data, axes=self.axes)
+        npeq_(data_ft, backend.fftn(self.data, axes=self.axes), "fftn mismatch", atol=1e-10)
+        npeq_(self.data, backend.ifftn(data_ft, axes=self.axes), "ifftn mismatch", atol=1e-10)
+        data_rft = np.fft.rfftn(self.data, axes=self.axes)
+        npeq_(data_rft, backend.rfftn(self.data, axes=self.axes), "rfftn mismatch", atol=1e-10)
+        npeq_(self.data, backend.irfftn(data_rft, s=self.data.shape[1:], axes=self.axes), "irfftn mismatch", atol=1e-10)
+        
+    def test_numpy(self):
+        """numpy backend"""
+        self.backend_tests('numpy')
+        
+    def test_scipy(self):
+        """scipy backend"""
+        self.backend_tests('scipy')
+        self.backend_tests('scipy', workers=2)
+        
+    def test_concurrent(self):
+        """backends report whether they release the GIL"""
+        nt.ok_(fft.get_backend('numpy').concurrent())
+        backend = fft.get_backend('scipy')
+        nt.eq_(backend.concurrent(), backend._module is not None)
+        nt.ok_(backend.concurrent(real=True))
+        
+    def test_fftw(self):
+        """fftw backend"""
+        self.backend_tests('fftw', workers=2)
+        
+    def test_get_backend(self):
+        """get_backend and set_backend"""
+        backend = fft.get_backend('numpy')
+        nt.ok_(fft.get_backend(backend) is backend)
+        nt.ok_(fft.get_backend('numpy') is backend)
+        default = fft.get_backend()
+        try:
+            nt.ok_(fft.set_backend('numpy') is backend)
+            nt.ok_(fft.get_backend() is backend)
+        finally:
+            fft.set_backend(default)
+        
+    @nt.raises(ValueError)
+    def test_unknown_backend(self):
+        """get_backend rejects unknown names"""
+        fft.get_backend('not-a-backend')
+        
+    def test_ftr_backend(self):
+        """reconstructor with a numpy backend"""
+        from aopy.reconstructors.ftr import FourierTransformReconstructor
+        xs, ys = self.data[0,:8,:8], self.data[1,:8,:8]
+        FTR = FourierTransformReconstructor(8, filter='mod_hud')
+        expected = FTR.reconstruct(xs, ys)
+        FTR.fft = 'numpy'
+        nt.ok_(isinstance(FTR.fft, fft.NumpyBackend))
+        npeq_(expected, FTR.reconstruct(xs, ys), "Reconstruction mismatch", atol=1e-10)
+        
+class test_fftw_plan_cache(object):
+    """aopy.util.fft.FFTWPlanCache"""
+    
+    def setup(self):
+        """Set up a plan cache."""
+        import tempfile
+        try:
+            self.cache = fft.FFTWPlanCache(workers=1, planner_effort='FFTW_ESTIMATE')
+        except ImportError:
+            raise SkipTest("pyfftw is not available.")
+        self.data = np.random.RandomState(5).randn(3, 8, 8)
+        self.wisdom = tempfile.mktemp(suffix='.pkl')
+        
+    def teardown(self):
+        """Remove the wisdom file."""
+        from .util import remove
+        remove(self.wisdom)
+        
+    def test_prepare(self):
+        """prepare plans transforms once"""
+        self.cache.prepare(self.data.shape, axes=(1,2), real=True)
+        nt.eq_(len(self.cache), 2)
+        data_rft = self.cache.rfftn(self.data, axes=(1,2))
+        npeq_(np.fft.rfftn(self.data, axes=(1,2)), data_rft, "rfftn mismatch", atol=1e-10)
+        npeq_(self.data, self.cache.irfftn(data_rft, s=(8,8), axes=(1,2)), "irfftn mismatch", atol=1e-10)
+        nt.eq_(len(self.cache), 2)
+        
+    def test_wisdom(self):
+        """wisdom is saved when plans are made"""
+        import os.path
+        self.cache.wisdom = self.wisdom
+        self.cache.prepare(self.data.shape[1:])
+        nt.ok_(os.path.exists(self.wisdom))
+        nt.ok_(self.cache.load_wisdom(self.wisdom) is not None)
+        
+    def test_ftr_prepare(self):
+        """reconstructor prepared with a plan cache"""
+        from aopy.reconstructors.ftr import FourierTransformReconstructor
+        FTR = FourierTransformReconstructor(8, filter='fried')
+        expected = FTR.reconstruct_many(self.data, self.data, batch_size=3)
+        FTR.fft = self.cache
+        FTR.prepare(batch=3)
+        nt.eq_(len(self.cache), 2)
+        npeq_(expected, FTR.reconstruct_many(self.data, self.data, batch_size=3), "Reconstruction mismatch", atol=1e-10)
+        
+        
+    def test_threads(self):
+        """each thread uses its own plans"""
+        from multiprocessing.pool import ThreadPool
+        self.cache.prepare(self.data.shape[1:])
+        pool = ThreadPool(3)
+        try:
+            results = pool.map(lambda frame: (self.cache.fftn(frame), len(self.cache)), list(self.data) * 4)
+        finally:
+            pool.close()
+            pool.join()
+        for frame, (frame_ft, count) in zip(list(self.data) * 4, results):
+            npeq_(np.fft.fftn(frame), frame_ft, "fftn mismatch", atol=1e-10)
+            nt.ok_(count <= 1)
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+#
+#  test_ftr.py
+#  aopy
+#
+#  Created by Alexander Rudy on 2014-08-02.
+#  Copyright 2014 Alexander Rudy. All rights reserved.
+#
+
+from __future__ import (absolute_import, unicode_literals, division,
+                        print_function)
+
+import nose.tools as nt
+import numpy as np
+
+from .util import npeq_
+
+from aopy.reconstructors.ftr import FourierTransformReconstructor
+
+class test_ftr_batches(object):
+    """aopy.reconstructors.ftr batched reconstruction"""
+    
+    def setup(self):
+        """Set up some random slopes."""
+        self.size = 16
+        self.nt = 10
+        random = np.random.RandomState(5)
+        self.xs = random.randn(self.nt, self.size, self.size)
+        self.ys = random.randn(self.nt, self.size, self.size)
+        self.FTR = FourierTransformReconstructor(self.size, filter='mod_hud')
+    
+    def test_reconstruct_many(self):
+        """reconstruct_many matches frame-by-frame reconstruction"""
+        single = np.array([self.FTR.reconstruct(xs, ys) for xs, ys in zip(self.xs, self.ys)])
+        for batch_size in [1, 3, self.nt, 2 * self.nt]:
+            many = self.FTR.reconstruct_many(self.xs, self.ys, batch_size=batch_size)
+            nt.eq_(many.shape, self.xs.shape)
+            npeq_(single, many, "Batch size {0:d} mismatch".format(batch_size), atol=1e-10)
+    
+    @nt.raises(ValueError)
+    def test_reconstruct_many_shape(self):
+        """reconstruct_many rejects mismatched cubes"""
+        self.FTR.reconstruct_many(self.xs, self.ys[:-1])
+        
+    def test_reconstruct_parallel(self):
+        """reconstruct_parallel matches batched reconstruction"""
+        many = self.FTR.reconstruct_many(self.xs, self.ys)
+        for workers, batch_size in [(1, None), (2, None), (4, 1), (3, 4)]:
+            parallel = self.FTR.reconstruct_parallel(self.xs, self.ys, workers=workers, batch_size=batch_size)
+            npeq_(many, parallel, "Parallel mismatch with {0:d} workers".format(workers), atol=1e-10)
+        self.FTR.rfft = True
+        npeq_(many, self.FTR.reconstruct_parallel(self.xs, self.ys, workers=4), "Parallel rfft mismatch", atol=1e-10)
+
+
+    def test_reconstruct_parallel_serial(self):
+        """reconstruct_parallel doesn't start threads for backends which hold the GIL"""
+        import threading
+        from aopy.util.fft import NumpyBackend
+        threads = set()
+        class SerialBackend(NumpyBackend):
+            def concurrent(self, real=False):
+                return False
+            def fftn(self, a, s=None, axes=None):
+                threads.add(threading.current_thread().ident)
+                return super(SerialBackend, self).fftn(a, s=s, axes=axes)
+        many = self.FTR.reconstruct_many(self.xs, self.ys)
+        self.FTR.fft = SerialBackend()
+        npeq_(many, self.FTR.reconstruct_parallel(self.xs, self.ys, workers=4, batch_size=2), "Serial mismatch", atol=1e-10)
+        nt.eq_(threads, set([threading.current_thread().ident]))
+        
+    @nt.raises(ZeroDivisionError)
+    def test_reconstruct_parallel_errors(self):
+        """errors in reconstruct_parallel threads are raised"""
+        from aopy.util.fft import NumpyBackend
+        class FailingBackend(NumpyBackend):
+            def fftn(self, a, s=None, axes=None):
+                raise ZeroDivisionError("Failed")
+        self.FTR.fft = FailingBackend()
+        self.FTR.reconstruct_parallel(self.xs, self.ys, workers=4, batch_size=2)
+        
+class test_ftr_kernels(object):
+    """aopy.reconstructors.ftr cached filter kernels"""
+    
+    def setup(self):
+        """Set up a reconstructor and some transformed slopes."""
+        self.size = 16
+        random = np.random.RandomState(5)
+        self.xs_ft = np.fft.fftn(random.randn(self.size, self.size))
+        self.ys_ft = np.fft.fftn(random.randn(self.size, self.size))
+        self.FTR = FourierTransformReconstructor(self.size, filter='fried')
+    
+    def test_apply_filter(self):
+        """apply_filter matches the direct filter expression"""
+        FTR = self.FTR
+        expected = (self.xs_ft * np.conj(FTR.gx) + self.ys_ft * np.conj(FTR.gy)) / FTR.denominator
+        npeq_(expected, FTR.apply_filter(self.xs_ft, self.ys_ft), "Filter mismatch", atol=1e-10)
+    
+    def test_apply_filter_fresh(self):
+        """apply_filter returns a new array, unless given one"""
+        first = self.FTR.apply_filter(self.xs_ft, self.ys_ft)
+        expected = first.copy()
+        second = self.FTR.apply_filter(self.ys_ft, self.xs_ft)
+        nt.ok_(second is not first)
+        npeq_(expected, first, "Estimate was overwritten")
+        self.FTR.reconstruct(np.zeros((self.size, self.size)), np.zeros((self.size, self.size)))
+        npeq_(expected, first, "Estimate was overwritten")
+        out = np.empty_like(first)
+        nt.ok_(self.FTR.apply_filter(self.xs_ft, self.ys_ft, out=out) is out)
+        npeq_(expected, out, "Filter mismatch", atol=1e-10)
+        
+    def test_kernel_invalidation(self):
+        """kernels are reset when the filter changes"""
+        kx, ky = self.FTR.kernels
+        nt.ok_(self.FTR.kernels[0] is kx)
+        self.FTR.use('mod_hud')
+        nt.ok_(self.FTR.kernels[0] is not kx)
+        expected = (self.xs_ft * np.conj(self.FTR.gx) + self.ys_ft * np.conj(self.FTR.gy)) / self.FTR.denominator
+        npeq_(expected, self.FTR.apply_filter(self.xs_ft, self.ys_ft), "Filter mismatch", atol=1e-10)
+
+class test_ftr_rfft(object):
+    """aopy.reconstructors.ftr real-input FFT reconstruction"""
+    
+    def setup(self):
+        """Set up some random slopes."""
+        self.random = np.random.RandomState(5)
+        
+    @nt.nottest
+    def rfft_tests(self, name, size):
+        """Compare the real-input and complex reconstructions."""
+        xs = self.random.randn(4, size, size)
+        ys = self.random.randn(4, size, size)
+        FTR = FourierTransformReconstructor(size, filter=name)
+        full = FTR.reconstruct_many(xs, ys)
+        FTR.rfft = True
+        half = FTR.reconstruct_many(xs, ys)
+        single = FTR.reconstruct(xs[0], ys[0])
+        npeq_(full, half, "rfft mismatch for {0:s} ({1:d})".format(name, size), atol=1e-10)
+        npeq_(full[0], single, "rfft mismatch for {0:s} ({1:d})".format(name, size), atol=1e-10)
+        
+    def test_rfft_mod_hud(self):
+        """rfft reconstruction with mod_hud"""
+        self.rfft_tests('mod_hud', 16)
+        self.rfft_tests('mod_hud', 15)
+        
+    def test_rfft_fried(self):
+        """rfft reconstruction with fried"""
+        self.rfft_tests('fried', 16)
+        self.rfft_tests('fried', 15)
+        
+    def test_rfft_ideal(self):
+        """rfft reconstruction with ideal"""
+        self.rfft_tests('ideal', 16)
+        self.rfft_tests('ideal', 15)
+        
+class test_ftr_filter_cache(object):
+    """aopy.reconstructors.ftr filter cache"""
+    
+    def setup(self):
+        """Clear the filter cache."""
+        FourierTransformReconstructor.clear_filter_cache()
+        
+    def teardown(self):
+        """Clear the filter cache, and remove test filters."""
+        FourierTransformReconstructor._REGISTRY.pop('test_cache', None)
+        FourierTransformReconstructor.clear_filter_cache()
+        
+    def test_shared_filters(self):
+        """reconstructors share cached, read-only filters"""
+        a = FourierTransformReconstructor(16, filter='fried')
+        b = FourierTransformReconstructor(16, filter='fried')
+        nt.ok_(a.gx is b.gx)
+        nt.ok_(not a.gx.flags.writeable)
+        nt.eq_(b.name, 'fried')
+        c = FourierTransformReconstructor(8, filter='fried')
+        nt.ok_(c.gx is not a.gx)
+        
+    def test_cache_size(self):
+        """the filter cache is limited in size"""
+        size = FourierTransformReconstructor.filter_cache_size
+        try:
+            FourierTransformReconstructor.filter_cache_size = 2
+            for n in [8, 10, 12]:
+                FourierTransformReconstructor(n, filter='mod_hud')
+            nt.eq_(len(FourierTransformReconstructor._FILTER_CACHE), 2)
+            nt.ok_(('mod_hud', 8) not in FourierTransformReconstructor._FILTER_CACHE)
+        finally:
+            FourierTransformReconstructor.filter_cache_size = size
+            
+    def test_register_invalidates(self):
+        """registering a filter discards its cached filters"""
+        from aopy.reconstructors.ftr import fried_filter, mod_hud_filter
+        FourierTransformReconstructor.register('test_cache', fried_filter)
+        a = FourierTransformReconstructor(8, filter='test_cache')
+        FourierTransformReconstructor.register('test_cache', mod_hud_filter)
+        b = FourierTransformReconstructor(8, filter='test_cache')
+        nt.eq_(b.name, 'mod_hud')
+        nt.ok_(not np.allclose(a.gx, b.gx))
+        
+class test_ftr_float32(object):
+    """aopy.reconstructors.ftr single precision reconstruction"""
+    
+    def setup(self):
+        """Set up some random slopes."""
+        random = np.random.RandomState(5)
+        self.xs = random.randn(4, 16, 16)
+        self.ys = random.randn(4, 16, 16)
+        
+    def test_float32(self):
+        """float32 reconstruction matches float64"""
+        FTR = FourierTransformReconstructor(16, filter='mod_hud')
+        expected = FTR.reconstruct_many(self.xs, self.ys)
+        for rfft in [False, True]:
+            FTR32 = FourierTransformReconstructor(16, filter='mod_hud', rfft=rfft, dtype=np.float32)
+            nt.eq_(FTR32.kernels[0].dtype, np.complex64)
+            for phase in [FTR32.reconstruct_many(self.xs, self.ys), FTR32.reconstruct_parallel(self.xs, self.ys, workers=2),
+                FTR32.reconstruct(self.xs[0], self.ys[0])[np.newaxis]]:
+                nt.eq_(phase.dtype, np.float32)
+                npeq_(expected[:phase.shape[0]], phase, "float32 mismatch", atol=1e-5 * np.abs(expected).max())
+        
+    @nt.raises(ValueError)
+    def test_dtype_complex(self):
+        """dtype must be a real floating point type"""
+        FourierTransformReconstructor(16, filter='mod_hud', dtype=np.complex64)
+        
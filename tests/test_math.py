@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+#
+#  test_math.py
+#  aopy
+#
+#  Created by Alexander Rudy on 2014-08-02.
+#  Copyright 2014 Alexander Rudy. All rights reserved.
+#
+
+from __future__ import (absolute_import, unicode_literals, division,
+                        print_function)
+
+import nose.tools as nt
+import numpy as np
+
+from .util import npeq_
+
+from aopy.util.math import fast_shift, Shifter
+
+class test_fast_shift(object):
+    """aopy.util.math.fast_shift"""
+    
+    def setup(self):
+        """Set up a random source."""
+        self.source = np.random.RandomState(5).randn(20, 16)
+        self.shape = (8, 6)
+        
+    def test_integer_shift(self):
+        """integer shifts wrap around the source"""
+        for shift in [(0, 0), (3, -2), (-25, 17)]:
+            expected = np.roll(np.roll(self.source, shift[0], axis=0), shift[1], axis=1)[:8,:6]
+            npeq_(expected, fast_shift(self.source, shift, shape=self.shape), "Shift mismatch for {0!r}".format(shift), atol=1e-12)
+            
+    def test_fractional_shift(self):
+        """fractional shifts interpolate in the direction of the shift"""
+        for shift in [(0.25, 0.0), (-3.5, 2.75)]:
+            expected = self.source
+            for axis, s in enumerate(shift):
+                floor = int(np.floor(s))
+                expected = (1.0 - (s - floor)) * np.roll(expected, floor, axis=axis) + (s - floor) * np.roll(expected, floor + 1, axis=axis)
+            npeq_(expected[:8,:6], fast_shift(self.source, shift, shape=self.shape), "Shift mismatch for {0!r}".format(shift), atol=1e-12)
+            
+    def test_shifter(self):
+        """shifters are cached, and take windows with 1-D indices"""
+        shifter = Shifter.cached(self.source.shape, self.shape, pad=2)
+        nt.ok_(Shifter.cached(self.source.shape, self.shape, pad=2) is shifter)
+        nt.ok_(Shifter.cached(self.source.shape, self.shape, pad=1) is not shifter)
+        nt.eq_(shifter.window_shape, (12, 10))
+        window = np.empty(shifter.window_shape)
+        shifter.take(self.source, (3, -2), out=window)
+        npeq_(shifter.take(self.source, (3, -2)), window, "Window mismatch", atol=1e-12)
+        npeq_(fast_shift(self.source, (3, -2), shape=self.shape), shifter.crop(window), "Window mismatch", atol=1e-12)
+        
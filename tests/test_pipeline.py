@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+#  test_pipeline.py
+#  aopy
+#
+#  Created by Alexander Rudy on 2014-08-02.
+#  Copyright 2014 Alexander Rudy. All rights reserved.
+#
+
+from __future__ import (absolute_import, unicode_literals, division,
+                        print_function)
+
+import os, os.path
+import shutil
+import tempfile
+
+import nose.tools as nt
+import numpy as np
+
+from .util import npeq_
+
+from aopy.reconstructors.ftr import FourierTransformReconstructor
+from aopy.reconstructors.pipeline import read_slopes, reconstruct_file
+
+class test_pipeline(object):
+    """aopy.reconstructors.pipeline streaming reconstruction"""
+    
+    def setup(self):
+        """Set up some random slope telemetry."""
+        self.size = 16
+        self.nt = 11
+        random = np.random.RandomState(5)
+        self.slopes = random.randn(self.nt, 2, self.size, self.size)
+        self.FTR = FourierTransformReconstructor(self.size, filter='mod_hud')
+        self.expected = self.FTR.reconstruct_many(self.slopes[:,0], self.slopes[:,1])
+        self.directory = tempfile.mkdtemp()
+        
+    def teardown(self):
+        """Remove the temporary files."""
+        shutil.rmtree(self.directory)
+        
+    def test_read_slopes(self):
+        """read_slopes yields batches of frames"""
+        filename = os.path.join(self.directory, "slopes.npy")
+        np.save(filename, self.slopes)
+        batches = list(read_slopes(filename, batch_size=4))
+        nt.eq_([xs.shape[0] for xs, ys in batches], [4, 4, 3])
+        npeq_(np.concatenate([ys for xs, ys in batches]), self.slopes[:,1], "Slopes mismatch")
+        
+    def test_npy(self):
+        """reconstruct_file with .npy files"""
+        infile = os.path.join(self.directory, "slopes.npy")
+        outfile = os.path.join(self.directory, "phase.npy")
+        np.save(infile, self.slopes)
+        nt.eq_(reconstruct_file(self.FTR, infile, outfile, batch_size=4), self.nt)
+        npeq_(np.load(outfile), self.expected, "Phase mismatch", atol=1e-10)
+        
+    def test_fits(self):
+        """reconstruct_file with FITS files"""
+        from astropy.io import fits
+        infile = os.path.join(self.directory, "slopes.fits")
+        outfile = os.path.join(self.directory, "phase.fits")
+        fits.PrimaryHDU(self.slopes).writeto(infile)
+        nt.eq_(reconstruct_file(self.FTR, infile, outfile, batch_size=4), self.nt)
+        npeq_(fits.getdata(outfile), self.expected, "Phase mismatch", atol=1e-10)
+        
+    def test_hdf5(self):
+        """reconstruct_file with HDF5 files"""
+        try:
+            import h5py
+        except ImportError:
+            from nose.plugins.skip import SkipTest
+            raise SkipTest("h5py is not installed.")
+        infile = os.path.join(self.directory, "slopes.hdf5")
+        outfile = os.path.join(self.directory, "phase.hdf5")
+        with h5py.File(infile, 'w') as f:
+            f.create_dataset('slopes', data=self.slopes)
+        nt.eq_(reconstruct_file(self.FTR, infile, outfile, batch_size=4), self.nt)
+        with h5py.File(outfile, 'r') as f:
+            npeq_(f['phase'][...], self.expected, "Phase mismatch", atol=1e-10)
+        
+    def test_float32(self):
+        """reconstruct_file in single precision"""
+        from astropy.io import fits
+        FTR = FourierTransformReconstructor(self.size, filter='mod_hud', dtype=np.float32)
+        for ext in ['.npy', '.fits']:
+            infile = os.path.join(self.directory, "slopes" + ext)
+            outfile = os.path.join(self.directory, "phase32" + ext)
+            if ext == '.npy':
+                np.save(infile, self.slopes)
+            else:
+                fits.PrimaryHDU(self.slopes).writeto(infile)
+            reconstruct_file(FTR, infile, outfile, batch_size=4)
+            phase = np.load(outfile) if ext == '.npy' else fits.getdata(outfile)
+            nt.eq_(phase.dtype.kind, 'f')
+            nt.eq_(phase.dtype.itemsize, 4)
+            npeq_(self.expected, phase, "Phase mismatch", atol=1e-5 * np.abs(self.expected).max())
+        
+    @nt.raises(ValueError)
+    def test_shape_mismatch(self):
+        """reconstruct_file rejects frames of the wrong size"""
+        infile = os.path.join(self.directory, "slopes.npy")
+        np.save(infile, self.slopes[...,:-1,:-1])
+        reconstruct_file(self.FTR, infile, os.path.join(self.directory, "phase.npy"))
+        
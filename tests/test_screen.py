@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+#
+#  test_screen.py
+#  aopy
+#
+#  Created by Alexander Rudy on 2014-08-02.
+#  Copyright 2014 Alexander Rudy. All rights reserved.
+#
+
+from __future__ import (absolute_import, unicode_literals, division,
+                        print_function)
+
+import os
+import shutil
+import tempfile
+
+import nose.tools as nt
+import numpy as np
+import astropy.units as u
+
+from .util import npeq_
+
+from aopy.atmosphere import screen
+
+def loop_subharmonics(shape, shf, shn, du):
+    """A looping subharmonic generator, for reference."""
+    n,m = shape
+    dkx = 2.0*np.pi/(n*du)
+    dky = 2.0*np.pi/(m*du)
+    y, x = (np.mgrid[0:n,0:m]).astype(np.float64) * du
+    rn = np.ones((8,),dtype=np.complex128)
+    s = np.zeros(shape, dtype=np.complex128)
+    for i in range(shf.shape[1]):
+        rn[0:4] = shn
+        rn[7] = np.conj(rn[0])
+        rn[6] = np.conj(rn[1])
+        rn[5] = np.conj(rn[2])
+        rn[4] = np.conj(rn[3])
+        dkx = dkx/3.0
+        dky = dky/3.0
+        s = s + rn[0]*shf[0,i]*np.exp(1j*(-dkx*x-dky*y))
+        s = s + rn[1]*shf[1,i]*np.exp(1j*(-dky*y))
+        s = s + rn[2]*shf[2,i]*np.exp(1j*(dkx*x-dky*y))
+        s = s + rn[3]*shf[3,i]*np.exp(1j*(-dkx*y))
+        s = s + rn[4]*shf[4,i]*np.exp(1j*(dkx*y))
+        s = s + rn[5]*shf[5,i]*np.exp(1j*(-dkx*x+dky*y))
+        s = s + rn[6]*shf[6,i]*np.exp(1j*(dky*y))
+        s = s + rn[7]*shf[7,i]*np.exp(1j*(dkx*x+dky*y))
+    return s
+
+class test_screen_subharmonics(object):
+    """aopy.atmosphere.screen subharmonics"""
+    
+    def setup(self):
+        """Set up the screen parameters."""
+        self.shape = (12, 10)
+        self.du = 0.25
+        self.r0 = 4.0
+        _shn = np.random.RandomState(5).randn(8)
+        self.shn = (_shn[:4] + 1j*_shn[4:])/np.sqrt(2.0)
+    
+    def test_subharmonics(self):
+        """_generate_subharmonics matches the looping algorithm"""
+        for nsh in [1, 3, 8]:
+            f, shf = screen._generate_filter(self.shape, self.r0, self.du, nsh=nsh)
+            npeq_(loop_subharmonics(self.shape, shf, self.shn, self.du),
+                screen._generate_subharmonics(self.shape, shf, self.shn, self.du),
+                "Subharmonic mismatch for nsh={0:d}".format(nsh), atol=1e-12)
+    
+    def test_screen_subharmonics(self):
+        """_generate_screen_with_noise includes the subharmonics"""
+        f, shf = screen._generate_filter(self.shape, self.r0, self.du, nsh=2)
+        noise = np.random.RandomState(5).randn(*self.shape)
+        expected = screen._generate_screen_with_noise(f, noise, du=self.du)
+        expected += np.real(loop_subharmonics(self.shape, shf, self.shn, self.du))
+        npeq_(expected, screen._generate_screen_with_noise(f, noise, shf, self.shn, self.du), "Screen mismatch", atol=1e-12)
+    
+    def test_subharmonics_stack(self):
+        """_generate_subharmonics with a stack of noise"""
+        f, shf = screen._generate_filter(self.shape, self.r0, self.du, nsh=3)
+        shn = np.array([self.shn, self.shn[::-1], np.zeros(4)])
+        stack = screen._generate_subharmonics(self.shape, shf, shn, self.du)
+        nt.eq_(stack.shape, (3,) + self.shape)
+        for i in range(3):
+            npeq_(loop_subharmonics(self.shape, shf, shn[i], self.du), stack[i], "Subharmonic mismatch", atol=1e-12)
+
+class test_screen_batch(object):
+    """aopy.atmosphere.screen.Screen.generate_batch"""
+    
+    def setup(self):
+        """Set up a screen."""
+        self.screen = screen.Screen((12, 10), r0=4.0, du=0.25, nsh=2, seed=5)
+        self.seeds = [1, 2, 3, 4, 5]
+    
+    def test_generate_batch(self):
+        """generate_batch matches single screens"""
+        current = self.screen.screen
+        for batch_size in [1, 2, 5]:
+            stack = self.screen.generate_batch(5, seeds=self.seeds, batch_size=batch_size)
+            nt.eq_(stack.shape, (5, 12, 10))
+            for seed, s in zip(self.seeds, stack):
+                npeq_(screen._generate_screen(self.screen._filter, seed, self.screen._shf, 0.25), s, "Screen mismatch for seed {0:d}".format(seed), atol=1e-12)
+        npeq_(current, self.screen.screen, "Current screen changed")
+        npeq_(stack[-1], current, "Screen mismatch", atol=1e-12)
+    
+    def test_generate_batch_memmap(self):
+        """generate_batch into a memory mapped file"""
+        import os, tempfile, shutil
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "screens.npy")
+            stack = self.screen.generate_batch(5, seeds=self.seeds, out=filename, batch_size=2)
+            nt.ok_(isinstance(stack, np.memmap))
+            npeq_(self.screen.generate_batch(5, seeds=self.seeds), np.load(filename), "Memory mapped mismatch")
+            del stack
+        finally:
+            shutil.rmtree(directory)
+    
+    @nt.raises(ValueError)
+    def test_generate_batch_seeds(self):
+        """generate_batch requires one seed per screen"""
+        self.screen.generate_batch(3, seeds=self.seeds)
+
+class test_screen_spectral(object):
+    """aopy.atmosphere.screen spectral noise"""
+    
+    def setup(self):
+        """Set up the screen parameters."""
+        self.shape = (12, 10)
+        self.du = 0.25
+        self.r0 = 4.0
+        self.f, self.shf = screen._generate_filter(self.shape, self.r0, self.du, nsh=2)
+    
+    def test_hermitian_noise(self):
+        """spectral noise is equivalent to real noise with a Hermitian transform"""
+        noise, shn = screen._generate_noise(self.shape, 5, spectral=True)
+        n, m = self.shape
+        Z = noise / np.sqrt(2.0)
+        W = (Z + np.conj(Z[np.ix_(-np.arange(n) % n, -np.arange(m) % m)])) / np.sqrt(2.0)
+        rn = np.fft.ifft2(W) * np.sqrt(n * m)
+        npeq_(np.zeros(self.shape), np.imag(rn), "Noise is not real", atol=1e-12)
+        expected = screen._generate_screen_with_noise(self.f, np.real(rn), self.shf, shn, self.du)
+        npeq_(expected, screen._generate_screen(self.f, 5, self.shf, self.du, spectral=True), "Screen mismatch", atol=1e-12)
+    
+    def test_statistics(self):
+        """spectral screens have the same variance as real noise screens"""
+        f, shf = screen._generate_filter((16, 16), self.r0, self.du)
+        seeds = range(400)
+        real = np.array([screen._generate_screen(f, seed, du=self.du) for seed in seeds])
+        spectral = np.array([screen._generate_screen(f, seed, du=self.du, spectral=True) for seed in seeds])
+        nt.ok_(np.abs(np.var(spectral) / np.var(real) - 1.0) < 0.05)
+    
+    def test_screen_spectral(self):
+        """Screen with spectral noise"""
+        S = screen.Screen(self.shape, r0=self.r0, du=self.du, nsh=2, seed=5, spectral=True)
+        nt.ok_(S.spectral)
+        npeq_(screen._generate_screen(self.f, 5, self.shf, self.du, spectral=True), S.screen, "Screen mismatch", atol=1e-12)
+        npeq_(S.screen, S.generate_batch(2, seeds=[1, 5])[1], "Batch mismatch", atol=1e-12)
+
+class test_screen_generator(object):
+    """aopy.atmosphere.screen with numpy Generators and SeedSequences"""
+    
+    def setup(self):
+        """Set up the screen parameters."""
+        if not hasattr(np.random, 'SeedSequence'):
+            from nose.plugins.skip import SkipTest
+            raise SkipTest("numpy.random.SeedSequence requires numpy >= 1.17")
+        self.shape = (12, 10)
+        self.f, self.shf = screen._generate_filter(self.shape, 4.0, 0.25, nsh=2)
+    
+    def test_seed_sequence(self):
+        """noise from a SeedSequence is reproducible and uses independent streams"""
+        noise, shn = screen._generate_noise(self.shape, np.random.SeedSequence(5))
+        again, shn_again = screen._generate_noise(self.shape, np.random.SeedSequence(5))
+        npeq_(noise, again, "Noise is not reproducible")
+        npeq_(shn, shn_again, "Subharmonic noise is not reproducible")
+        nt.ok_(not np.allclose(noise.flat[:8], np.sqrt(2.0) * np.concatenate([shn.real, shn.imag])))
+    
+    def test_generator(self):
+        """children spawned from a Generator keep its bit generator"""
+        children = screen._spawn_seeds(np.random.Generator(np.random.Philox(5)), 3)
+        nt.eq_(len(children), 3)
+        nt.ok_(all(isinstance(child.bit_generator, np.random.Philox) for child in children))
+        noise = [screen._generate_noise(self.shape, child)[0] for child in children]
+        nt.ok_(not np.allclose(noise[0], noise[1]))
+    
+    def test_generate_batch(self):
+        """generate_batch spawns a stream for each screen"""
+        S = screen.Screen(self.shape, r0=4.0, du=0.25, nsh=2, seed=np.random.SeedSequence(5))
+        stack = S.generate_batch(3, seeds=np.random.SeedSequence(7))
+        for child, s in zip(np.random.SeedSequence(7).spawn(3), stack):
+            npeq_(screen._generate_screen(self.f, child, self.shf, 0.25), s, "Screen mismatch", atol=1e-12)
+        nt.ok_(not np.allclose(stack[0], stack[1]))
+
+class test_screen_float32(object):
+    """aopy.atmosphere.screen single precision screens"""
+    
+    def test_float32(self):
+        """float32 screens match float64 screens"""
+        for spectral in [False, True]:
+            S = screen.Screen((12, 10), r0=4.0, du=0.25, nsh=2, seed=5, spectral=spectral)
+            S32 = screen.Screen((12, 10), r0=4.0, du=0.25, nsh=2, seed=5, spectral=spectral, dtype=np.float32)
+            nt.eq_(S32.screen.dtype, np.float32)
+            npeq_(S.screen, S32.screen, "float32 mismatch", atol=1e-5 * np.abs(S.screen).max())
+            stack = S32.generate_batch(2, seeds=[5, 6])
+            nt.eq_(stack.dtype, np.float32)
+            npeq_(S.generate_batch(2, seeds=[5, 6]), stack, "float32 mismatch", atol=1e-5 * np.abs(S.screen).max())
+    
+    def test_blowing_float32(self):
+        """float32 blowing screens"""
+        from aopy.atmosphere.wind import BlowingScreen
+        B = BlowingScreen((8, 8), r0=0.3, du=0.1, seed=5, vel=[1.0, 0.0], tmax=1, dtype=np.float32)
+        nt.eq_(B._filtered_screen.dtype, np.float32)
+
+class test_infinite_screen(object):
+    """aopy.atmosphere.infinite extruded screens"""
+    
+    def setup(self):
+        """Set up the screen parameters."""
+        self.r0 = 0.2
+        self.du = 0.05
+        self.L0 = 10.0
+    
+    def test_extrusion_covariance(self):
+        """extruded rows have the von Karman covariance"""
+        from aopy.atmosphere.infinite import _extrusion_operators, _distances, phase_covariance
+        A, B = _extrusion_operators(8, 2, self.du, self.r0, self.L0)
+        j = np.arange(8, dtype=np.float64)
+        x = np.column_stack((np.zeros_like(j), j)) * self.du
+        z = np.column_stack((np.repeat([-2.0, -1.0], 8), np.tile(j, 2))) * self.du
+        czz = phase_covariance(_distances(z, z), self.r0, self.L0)
+        cxx = phase_covariance(_distances(x, x), self.r0, self.L0)
+        cxz = phase_covariance(_distances(x, z), self.r0, self.L0)
+        npeq_(cxz, np.dot(A, czz), "Cross covariance mismatch", atol=1e-6 * cxx.max())
+        npeq_(cxx, np.dot(A, np.dot(czz, A.T)) + np.dot(B, B.T), "Covariance mismatch", atol=1e-6 * cxx.max())
+    
+    def test_frozen_flow(self):
+        """infinite screens blow without wrapping, in every direction"""
+        from aopy.atmosphere import InfiniteScreen
+        for vel, step in [([self.du, 0.0], (1, 0)), ([-self.du, 0.0], (-1, 0)), ([0.0, 2 * self.du], (0, 2)), ([0.0, -self.du], (0, -1))]:
+            S = InfiniteScreen((12, 12), r0=self.r0, du=self.du, L0=self.L0, seed=5, vel=vel, order=1)
+            last = S.screen
+            for t in range(40):
+                frame = S.screen
+                i, j = step
+                npeq_(frame[max(i,0):12+min(i,0),max(j,0):12+min(j,0)], last[max(-i,0):12+min(-i,0),max(-j,0):12+min(-j,0)],
+                    "Frozen flow mismatch for {0!r}".format(vel), atol=1e-12)
+                last = frame
+            nt.ok_(np.isfinite(frame).all())
+            nt.eq_(S._screen.shape, (12 + 2 * S._pad + 2,) * 2)
+    
+    def test_statistics(self):
+        """infinite screens keep the structure function as they blow"""
+        from aopy.atmosphere import InfiniteScreen
+        from aopy.atmosphere.infinite import phase_covariance
+        S = InfiniteScreen((32, 32), r0=self.r0, du=self.du, L0=self.L0, seed=1, vel=[self.du, 0.0], order=1)
+        D = [np.mean((frame[1:] - frame[:-1])**2) for frame in (S.get_screen(t) for t in range(100, 1000, 20))]
+        expected = 2 * (phase_covariance(0.0, self.r0, self.L0) - phase_covariance(self.du, self.r0, self.L0))
+        nt.ok_(np.abs(np.mean(D) / expected - 1.0) < 0.1, "Structure function {0:g} != {1:g}".format(np.mean(D), expected))
+    
+    def test_initial_statistics(self):
+        """the first frames of infinite screens have the von Karman structure function"""
+        from aopy.atmosphere import InfiniteScreen
+        from aopy.atmosphere.infinite import phase_covariance
+        times, separations = [0, 20], [1, 8]
+        D = np.zeros((len(times), len(separations)))
+        for seed in range(30):
+            S = InfiniteScreen((32, 32), r0=self.r0, du=self.du, L0=self.L0, seed=seed, vel=[self.du, 0.0], order=1)
+            for i, t in enumerate(times):
+                frame = S.get_screen(t)
+                for j, d in enumerate(separations):
+                    D[i,j] += (np.mean((frame[d:] - frame[:-d])**2) + np.mean((frame[:,d:] - frame[:,:-d])**2)) / 60.0
+        for j, d in enumerate(separations):
+            expected = 2 * (phase_covariance(0.0, self.r0, self.L0) - phase_covariance(d * self.du, self.r0, self.L0))
+            for i, t in enumerate(times):
+                nt.ok_(np.abs(D[i,j] / expected - 1.0) < 0.12,
+                    "Structure function at t={0:d}, r={1:d}: {2:g} != {3:g}".format(t, d, D[i,j], expected))
+    
+    @nt.raises(TypeError)
+    def test_length(self):
+        """infinite screens have no length"""
+        from aopy.atmosphere import InfiniteScreen
+        len(InfiniteScreen((8, 8), r0=self.r0, du=self.du, L0=self.L0, seed=5, vel=[self.du, 0.0]))
+
+class test_many_layer_screen(object):
+    """aopy.atmosphere.wind multi-layer shifting"""
+    
+    def setup(self):
+        """Set up a two layer screen."""
+        from aopy.atmosphere.wind import ManyLayerScreen
+        self.screen = ManyLayerScreen((8, 10), r0=0.3, du=0.1, seed=5,
+            vel=[[1.0, 0.0], [-0.2, 0.3]], strength=[1.0, 2.0], tmax=4, order=1)
+    
+    @nt.nottest
+    def expected(self, t):
+        """Shift each layer by rolling and linear interpolation, for reference."""
+        expected = np.zeros(self.screen._outshape)
+        for vel, layer in zip(self.screen.velocity, self.screen._screens):
+            for axis, shift in enumerate((t * u.s * vel / self.screen.du).to(1).value):
+                floor = int(np.floor(shift))
+                fraction = shift - floor
+                layer = (1.0 - fraction) * np.roll(layer, floor, axis=axis) + fraction * np.roll(layer, floor + 1, axis=axis)
+            expected += layer[:self.screen._outshape[0],:self.screen._outshape[1]]
+        return expected
+    
+    def test_shape(self):
+        """the layers are large enough for every velocity"""
+        nt.eq_(self.screen._shape, (48, 22))
+        nt.ok_(all(isinstance(s, int) for s in self.screen._shape))
+    
+    def test_get_screen(self):
+        """layers are shifted and summed"""
+        for t in [0, 1, 2.5, 3, 40]:
+            npeq_(self.expected(t), self.screen.get_screen(t), "Shift mismatch at {0!r}".format(t), atol=1e-10)
+    
+    def test_spline_seam(self):
+        """spline shifts are continuous across the wrapped edge of each layer"""
+        from aopy.atmosphere.wind import ManyLayerScreen
+        S = ManyLayerScreen((8, 10), r0=0.3, du=0.1, seed=5, vel=[[1.0, 0.0], [-0.2, 0.3]], tmax=4, order=3)
+        for t in [1, 4, 6]:
+            npeq_(S.get_screen(t), S.get_screen(t + 1e-9), "Seam mismatch at {0!r}".format(t), atol=1e-6)
+    
+    def test_blowing_screen(self):
+        """single layer screens are shifted like each layer"""
+        from aopy.atmosphere.wind import BlowingScreen
+        S = BlowingScreen((8, 10), r0=0.3, du=0.1, seed=5, vel=[-0.2, 0.3], tmax=4, order=1)
+        self.screen._screens = S._screen[np.newaxis]
+        self.screen._vel = S.velocity[np.newaxis]
+        for t in [0, 1, 2.5, 3]:
+            npeq_(self.expected(t), S.get_screen(t), "Shift mismatch at {0!r}".format(t), atol=1e-10)
+    
+    def test_contiguous_filter(self):
+        """filtered screens are contiguous, so shifts don't copy them"""
+        from aopy.atmosphere.wind import BlowingScreen
+        for order in [1, 3]:
+            S = BlowingScreen((8, 10), r0=0.3, du=0.1, seed=5, vel=[-0.2, 0.3], tmax=4, order=order)
+            nt.ok_(S._filtered_screen.flags['C_CONTIGUOUS'])
+
+class test_fourier_shift(object):
+    """aopy.atmosphere.wind Fourier sub-pixel shifts"""
+    
+    def setup(self):
+        """Set up a two layer screen."""
+        from aopy.atmosphere.wind import ManyLayerScreen
+        self.screen = ManyLayerScreen((8, 10), r0=0.3, du=0.1, seed=5, vel=[[1.0, 0.0], [-0.2, 0.3]],
+            strength=[1.0, 2.0], tmax=4, shift_method='fourier')
+        
+    @nt.nottest
+    def expected(self, t):
+        """Shift each layer with a full Fourier transform, for reference."""
+        expected = np.zeros(self.screen._outshape)
+        for vel, layer in zip(self.screen.velocity, self.screen._screens):
+            shift = (t * u.s * vel / self.screen.du).to(1).value
+            kx, ky = np.meshgrid(np.fft.fftfreq(layer.shape[0]), np.fft.fftfreq(layer.shape[1]), indexing='ij')
+            shifted = np.fft.ifft2(np.fft.fft2(layer) * np.exp(-2j * np.pi * (kx * shift[0] + ky * shift[1]))).real
+            expected += shifted[:self.screen._outshape[0],:self.screen._outshape[1]]
+        return expected
+        
+    def test_get_screen(self):
+        """layers are shifted with phase ramps"""
+        nt.eq_(self.screen._filtered_screens, None)
+        for t in [0, 1, 2.5, 3.05]:
+            npeq_(self.expected(t), self.screen.get_screen(t), "Shift mismatch at {0!r}".format(t), atol=1e-10)
+            
+    def test_integer_shift(self):
+        """integer Fourier shifts roll the layers"""
+        expected = np.roll(self.screen._screens[0], 10, axis=0) + np.roll(np.roll(self.screen._screens[1], -2, axis=0), 3, axis=1)
+        npeq_(expected[:8,:10], self.screen.get_screen(1), "Shift mismatch", atol=1e-10)
+        
+    def test_get_screens(self):
+        """batches of Fourier shifts match single shifts"""
+        ts = [0, 1.05, 2.5, 3.05, 17]
+        single = np.array([self.screen.get_screen(t) for t in ts])
+        for batch_size in [None, 1, 2, 10]:
+            npeq_(single, self.screen.get_screens(ts, batch_size=batch_size), "Batch mismatch", atol=1e-10)
+        
+    def test_fast_shape(self):
+        """Fourier shifted layers have fast FFT sizes"""
+        nt.eq_(self.screen._shape, (48, 24))
+        
+    def test_spline_agreement(self):
+        """spline and Fourier shifts agree on a shared screen"""
+        from aopy.atmosphere.wind import BlowingScreen
+        kwargs = dict(r0=0.3, du=0.1, seed=5, vel=[0.8, 0.6], tmax=2)
+        S = BlowingScreen((8, 8), shift_method='spline', **kwargs)
+        F = BlowingScreen((8, 8), shift_method='fourier', **kwargs)
+        nt.eq_(S._shape, F._shape)
+        npeq_(S._screen, F._screen, "Screen mismatch")
+        scale = np.std(S._screen)
+        for t in [0, 0.5, 1.0]:
+            npeq_(S.get_screen(t), F.get_screen(t), "Integer shift mismatch at {0!r}".format(t), atol=1e-10)
+        for t in [1.05, 1.55, 1.97]:
+            difference = S.get_screen(t) - F.get_screen(t)
+            nt.ok_(np.sqrt(np.mean(difference**2)) < 0.1 * scale, "Sub-pixel shift mismatch at {0!r}".format(t))
+            nt.ok_(np.abs(difference).max() < 0.25 * scale, "Sub-pixel shift mismatch at {0!r}".format(t))
+        
+    @nt.raises(ValueError)
+    def test_shift_method(self):
+        """shift methods are validated"""
+        from aopy.atmosphere.wind import BlowingScreen
+        BlowingScreen((8, 8), r0=0.3, du=0.1, seed=5, shift_method='linear')
+        
+class test_blowing_all(object):
+    """aopy.atmosphere.wind lazy and cached screens"""
+    
+    def setup(self):
+        """Set up a blowing screen, and a temporary directory."""
+        from aopy.atmosphere.wind import BlowingScreen
+        self.screen = BlowingScreen((8, 10), r0=0.3, du=0.1, seed=5, vel=[1.0, -0.35], tmax=11)
+        self.screen.console = False
+        self.expected = np.array([self.screen.get_screen(t) for t in range(11)])
+        self.directory = tempfile.mkdtemp()
+        
+    def teardown(self):
+        """Remove the temporary files."""
+        shutil.rmtree(self.directory)
+        
+    def test_all(self):
+        """all screens are computed in parallel chunks"""
+        npeq_(self.expected, self.screen.all, "All mismatch", atol=1e-12)
+        nt.ok_(not self.screen.all.flags.writeable)
+        for workers, chunk_size in [(1, None), (3, 2), (4, 20)]:
+            npeq_(self.expected, self.screen.compute_all(workers=workers, chunk_size=chunk_size), "All mismatch", atol=1e-12)
+            
+    def test_cache(self):
+        """all screens are cached on disk"""
+        from aopy.atmosphere.wind import BlowingScreen
+        for name in ["screens.npy", "screens.hdf5"]:
+            filename = os.path.join(self.directory, name)
+            S = BlowingScreen((8, 10), r0=0.3, du=0.1, seed=5, vel=[1.0, -0.35], tmax=11, cache=filename)
+            S.console = False
+            nt.eq_(S.all.shape, (11, 8, 10))
+            npeq_(self.expected, S.all[...], "Cache mismatch for {0:s}".format(name), atol=1e-12)
+            nt.ok_(os.path.exists(filename))
+        nt.ok_(isinstance(np.load(os.path.join(self.directory, "screens.npy"), mmap_mode='r'), np.memmap))
+        
+    def test_cache_rewrite(self):
+        """HDF5 caches are closed before they are written again"""
+        from aopy.atmosphere.wind import BlowingScreen
+        filename = os.path.join(self.directory, "screens.hdf5")
+        S = BlowingScreen((8, 10), r0=0.3, du=0.1, seed=5, vel=[1.0, -0.35], tmax=11, cache=filename)
+        S.console = False
+        first = S.compute_all()
+        nt.ok_(S._cache_file is not None)
+        npeq_(self.expected, S.compute_all(workers=2)[...], "Cache mismatch", atol=1e-12)
+        nt.ok_(not first.id.valid)
+        S.close_cache()
+        nt.eq_(S._cache_file, None)
+        npeq_(self.expected, S.all[...], "Cache mismatch", atol=1e-12)
+        S.close_cache()
+        
+    def test_serial(self):
+        """screens are computed serially when shifts hold the GIL"""
+        from aopy.atmosphere.wind import BlowingScreen
+        from aopy.util.fft import ScipyBackend
+        S = BlowingScreen((8, 10), r0=0.3, du=0.1, seed=5, vel=[1.0, -0.35], tmax=11, shift_method='fourier', fft=ScipyBackend())
+        S.console = False
+        nt.eq_(S.concurrent, S.fft.concurrent())
+        nt.ok_(self.screen.concurrent)
+        expected = np.array([S.get_screen(t) for t in range(11)])
+        npeq_(expected, S.compute_all(workers=3, chunk_size=2), "All mismatch", atol=1e-12)
+        
+    def test_frames(self):
+        """frames are computed lazily, and recently used frames are kept"""
+        frames = self.screen.frames
+        frames.cache_size = 3
+        nt.eq_(len(frames), 11)
+        npeq_(self.expected[4], frames[4], "Frame mismatch", atol=1e-12)
+        nt.ok_(frames[4] is frames[4])
+        npeq_(self.expected[-1], frames[-1], "Frame mismatch", atol=1e-12)
+        npeq_(self.expected[2:9:3], frames[2:9:3], "Frame mismatch", atol=1e-12)
+        nt.eq_(list(frames._cache.keys()), [2, 5, 8])
+        npeq_(self.expected[[1, 3]], frames[[1, 3]], "Frame mismatch", atol=1e-12)
+        nt.assert_raises(IndexError, lambda : frames[11])
+        self.screen.seed = 6
+        nt.ok_(self.screen.frames is not frames)
+        
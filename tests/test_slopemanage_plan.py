@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# 
+#  test_slopemanage_plan.py
+#  aopy
+#  
+#  Created by Alexander Rudy on 2014-08-02.
+#  Copyright 2014 Alexander Rudy. All rights reserved.
+# 
+
+from __future__ import (absolute_import, unicode_literals, division,
+                        print_function)
+import nose.tools as nt
+import numpy as np
+
+from .util import npeq_
+
+from aopy.aperture.slopemanage import SlopeManagementPlan, slope_management, EdgeExtensionPlan, edge_extend
+from aopy.reconstructors.slopemanage import SlopeManagedFTR
+
+def loop_slope_management(ap, xs, ys):
+    """The original, looping, slope management algorithm, for reference."""
+    n = xs.shape[0]
+    xs_c = xs * ap
+    ys_c = ys * ap
+    ysr_sum = np.sum(ys_c, axis=0)
+    xsc_sum = np.sum(xs_c, axis=1)
+    for j in range(n):
+        loc = np.where(ap[:,j] != 0)[0]
+        if len(loc):
+            ys_c[loc[0]-1, j] = -0.5 * ysr_sum[j]
+            ys_c[loc[-1]+1, j] = -0.5 * ysr_sum[j]
+        loc = np.where(ap[j,:] != 0)[0]
+        if len(loc):
+            xs_c[j, loc[0]-1] = -0.5 * xsc_sum[j]
+            xs_c[j, loc[-1]+1] = -0.5 * xsc_sum[j]
+    return xs_c, ys_c
+
+class test_slopemanage_plan(object):
+    """aopy.aperture.slopemanage.SlopeManagementPlan"""
+    
+    def setup(self):
+        """Set up an aperture and random slopes."""
+        self.size = 20
+        self.radius = 8.5
+        X, Y = np.mgrid[-self.size/2:self.size/2,-self.size/2:self.size/2] + 0.5
+        self.ap = (np.sqrt(X**2.0 + Y**2.0) < self.radius).astype(np.int)
+        random = np.random.RandomState(5)
+        self.xs = random.randn(4, self.size, self.size)
+        self.ys = random.randn(4, self.size, self.size)
+        
+    def test_single_frame(self):
+        """plan matches looping slope management"""
+        xs_loop, ys_loop = loop_slope_management(self.ap, self.xs[0], self.ys[0])
+        xs_plan, ys_plan = slope_management(self.ap, self.xs[0], self.ys[0])
+        npeq_(xs_loop, xs_plan, "X Slope Mismatch", atol=1e-12)
+        npeq_(ys_loop, ys_plan, "Y Slope Mismatch", atol=1e-12)
+        
+    def test_stack(self):
+        """plan applies to a stack of frames"""
+        plan = SlopeManagementPlan(self.ap)
+        xs_plan, ys_plan = plan(self.xs, self.ys)
+        for i in range(self.xs.shape[0]):
+            xs_loop, ys_loop = loop_slope_management(self.ap, self.xs[i], self.ys[i])
+            npeq_(xs_loop, xs_plan[i], "X Slope Mismatch", atol=1e-12)
+            npeq_(ys_loop, ys_plan[i], "Y Slope Mismatch", atol=1e-12)
+        
+    def test_float32(self):
+        """plan preserves single precision"""
+        xs, ys = SlopeManagementPlan(self.ap)(self.xs.astype(np.float32), self.ys.astype(np.float32))
+        nt.eq_(xs.dtype, np.float32)
+        nt.eq_(ys.dtype, np.float32)
+        
+    @nt.raises(ValueError)
+    def test_edge_space(self):
+        """plan requires space on the aperture edges"""
+        ap = np.ones((self.size, self.size))
+        SlopeManagementPlan(ap)
+        
+    def test_slope_managed_ftr(self):
+        """slope managed reconstruction of a stack of frames"""
+        FTR = SlopeManagedFTR(self.size, self.ap, filter='mod_hud', manage_tt=True, suppress_tt=False)
+        many = FTR.reconstruct_many(self.xs, self.ys, batch_size=3)
+        for i in range(self.xs.shape[0]):
+            npeq_(FTR.reconstruct(self.xs[i], self.ys[i]), many[i], "Reconstruction Mismatch", atol=1e-10)
+        
+    def test_slope_managed_ftr_float32(self):
+        """slope managed reconstruction in single precision"""
+        FTR = SlopeManagedFTR(self.size, self.ap, filter='mod_hud', manage_tt=True, suppress_tt=False)
+        FTR32 = SlopeManagedFTR(self.size, self.ap, filter='mod_hud', manage_tt=True, suppress_tt=False, dtype=np.float32)
+        expected = FTR.reconstruct_many(self.xs, self.ys)
+        phase = FTR32.reconstruct_many(self.xs, self.ys)
+        nt.eq_(phase.dtype, np.float32)
+        npeq_(expected, phase, "float32 mismatch", atol=1e-5 * np.abs(expected).max())
+        from aopy.reconstructors import slopemanage
+        for helper in [slopemanage.slope_management, slopemanage.edge_extend]:
+            xs, ys = helper(self.ap, self.xs[0], self.ys[0], dtype=np.float32)
+            nt.eq_(xs.dtype, np.float32)
+        
+    def test_slope_managed_ftr_parallel(self):
+        """slope managed reconstruction with a thread pool"""
+        FTR = SlopeManagedFTR(self.size, self.ap, filter='mod_hud', manage_tt=True, suppress_tt=False)
+        many = FTR.reconstruct_many(self.xs, self.ys)
+        for workers, batch_size in [(1, None), (2, 1), (3, None)]:
+            parallel = FTR.reconstruct_parallel(self.xs, self.ys, workers=workers, batch_size=batch_size)
+            npeq_(many, parallel, "Parallel mismatch with {0:d} workers".format(workers), atol=1e-10)
+        
+def loop_edge_extend(ap, xs, ys):
+    """A looping edge extension algorithm, for reference."""
+    n = xs.shape[0]
+    ap = ap != 0
+    xs = xs * ap
+    ys = ys * ap
+    xs_ap = ap.copy()
+    ys_ap = ap.copy()
+    for i in range(n-1):
+        for j in range(n-1):
+            loop = [(xs, xs_ap, (i,j), 1), (xs, xs_ap, (i+1,j), -1), (ys, ys_ap, (i,j+1), 1), (ys, ys_ap, (i,j), -1)]
+            known = [ap[index] for slopes, slopes_ap, index, sign in loop]
+            if sum(known) != 3:
+                continue
+            missing = known.index(False)
+            slopes, slopes_ap, index, sign = loop.pop(missing)
+            if slopes_ap[index]:
+                continue
+            slopes[index] = -sign * sum(s[idx] * sg for s, s_ap, idx, sg in loop)
+            slopes_ap[index] = True
+    for j in range(n):
+        loc = np.flatnonzero(xs_ap[:,j])
+        if len(loc):
+            xs[:loc[0],j] = xs[loc[0],j]
+            xs[loc[-1]+1:,j] = xs[loc[-1],j]
+        loc = np.flatnonzero(ys_ap[j,:])
+        if len(loc):
+            ys[j,:loc[0]] = ys[j,loc[0]]
+            ys[j,loc[-1]+1:] = ys[j,loc[-1]]
+    for k in range(n):
+        xs[k,n-1] = -xs[k,:n-1].sum()
+        ys[n-1,k] = -ys[:n-1,k].sum()
+    return xs, ys
+    
+class test_edge_extension_plan(object):
+    """aopy.aperture.slopemanage.EdgeExtensionPlan"""
+    
+    def setup(self):
+        """Set up an aperture and random slopes."""
+        self.size = 20
+        self.radius = 8.5
+        X, Y = np.mgrid[-self.size/2:self.size/2,-self.size/2:self.size/2] + 0.5
+        self.ap = (np.sqrt(X**2.0 + Y**2.0) < self.radius).astype(np.int)
+        random = np.random.RandomState(5)
+        self.xs = random.randn(4, self.size, self.size)
+        self.ys = random.randn(4, self.size, self.size)
+        
+    def test_single_frame(self):
+        """plan matches looping edge extension"""
+        xs_loop, ys_loop = loop_edge_extend(self.ap, self.xs[0], self.ys[0])
+        xs_plan, ys_plan = edge_extend(self.ap, self.xs[0], self.ys[0])
+        npeq_(xs_loop, xs_plan, "X Slope Mismatch", atol=1e-12)
+        npeq_(ys_loop, ys_plan, "Y Slope Mismatch", atol=1e-12)
+        
+    def test_stack(self):
+        """plan applies to a stack of frames"""
+        plan = EdgeExtensionPlan(self.ap)
+        xs_plan, ys_plan = plan(self.xs, self.ys)
+        for i in range(self.xs.shape[0]):
+            xs_loop, ys_loop = loop_edge_extend(self.ap, self.xs[i], self.ys[i])
+            npeq_(xs_loop, xs_plan[i], "X Slope Mismatch", atol=1e-12)
+            npeq_(ys_loop, ys_plan[i], "Y Slope Mismatch", atol=1e-12)
+        
+    def test_periodic(self):
+        """extended slopes sum to zero across the grid"""
+        xs, ys = EdgeExtensionPlan(self.ap)(self.xs, self.ys)
+        npeq_(xs.sum(axis=-1), 0.0, "X Slopes are not periodic", atol=1e-10)
+        npeq_(ys.sum(axis=-2), 0.0, "Y Slopes are not periodic", atol=1e-10)
+        
+    def test_edge_loops(self):
+        """edge loops with three known slopes are closed"""
+        xs, ys = EdgeExtensionPlan(self.ap)(self.xs[0], self.ys[0])
+        ap = self.ap != 0
+        curl = xs - np.roll(xs, -1, axis=0) + np.roll(ys, -1, axis=1) - ys
+        known = 2 * ap.astype(np.int) + np.roll(ap, -1, axis=0) + np.roll(ap, -1, axis=1)
+        npeq_(curl[known == 3], 0.0, "Edge loops are not closed", atol=1e-10)
+        
+    @nt.nottest
+    def edge_tests(self, ap):
+        """Edge extension rejects an aperture."""
+        with nt.assert_raises(ValueError):
+            EdgeExtensionPlan(ap)
+        
+    def test_edge_space(self):
+        """plan requires space on the last row and column"""
+        for k in [(slice(None), self.size - 1), (self.size - 1, slice(None))]:
+            ap = self.ap.copy()
+            ap[k] = 1
+            self.edge_tests(ap)
+        ap = np.roll(self.ap, 2, axis=0)
+        self.edge_tests(ap)
+        ap = np.roll(self.ap, -2, axis=1)
+        EdgeExtensionPlan(ap)
+        
+    def test_slope_managed_ftr(self):
+        """edge extended reconstruction of a stack of frames"""
+        FTR = SlopeManagedFTR(self.size, self.ap, filter='mod_hud', extend=True)
+        many = FTR.reconstruct_many(self.xs, self.ys, batch_size=3)
+        for i in range(self.xs.shape[0]):
+            npeq_(FTR.reconstruct(self.xs[i], self.ys[i]), many[i], "Reconstruction Mismatch", atol=1e-10)
+        
+            
+    def test_low_order(self):
+        """edge extended reconstruction of low order aberrations"""
+        # x is along the last axis, the direction of the x slopes.
+        y, x = (np.mgrid[-self.size/2:self.size/2,-self.size/2:self.size/2] + 0.5) / self.radius
+        rho2 = x**2 + y**2
+        ap = self.ap != 0
+        extended = SlopeManagedFTR(self.size, self.ap, filter='mod_hud', manage_tt=True, suppress_tt=False, extend=True)
+        managed = SlopeManagedFTR(self.size, self.ap, filter='mod_hud', manage_tt=True, suppress_tt=False)
+        for name, phase, tolerance in [("defocus", 2 * rho2 - 1, 1e-8), ("astig", x**2 - y**2, 1e-8), ("coma", (3 * rho2 - 2) * x, 0.15)]:
+            xs = np.zeros_like(phase)
+            ys = np.zeros_like(phase)
+            xs[:,:-1] = phase[:,1:] - phase[:,:-1]
+            ys[:-1,:] = phase[1:,:] - phase[:-1,:]
+            scale = np.std(phase[ap])
+            residuals = []
+            for FTR in [extended, managed]:
+                residual = (FTR(xs * ap, ys * ap) - phase)[ap]
+                residuals.append(np.std(residual))
+            nt.ok_(residuals[0] < tolerance * scale, "Edge extended {0:s} residual {1:g} of {2:g}".format(name, residuals[0], scale))
+            nt.ok_(residuals[0] < residuals[1], "Edge extension doesn't improve {0:s} residual {1:g} > {2:g}".format(name, residuals[0], residuals[1]))
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+#
+#  test_zernike_basis.py
+#  aopy
+#
+#  Created by Alexander Rudy on 2014-08-02.
+#  Copyright 2014 Alexander Rudy. All rights reserved.
+#
+
+from __future__ import (absolute_import, unicode_literals, division,
+                        print_function)
+
+import nose.tools as nt
+import numpy as np
+
+from .util import npeq_
+
+from aopy.wavefront import zernike
+
+class test_zernike_basis(object):
+    """aopy.wavefront.zernike.ZernikeBasis"""
+    
+    def setup(self):
+        """Set up a grid."""
+        zernike.ZernikeBasis.clear_cache()
+        self.size = 40
+        self.radius = 19.0
+        self.X, self.Y = np.mgrid[-self.size/2:self.size/2,-self.size/2:self.size/2] / self.radius
+        self.ap = (np.sqrt(self.X**2 + self.Y**2) < 1)
+        self.nmodes = 28
+        self.basis = zernike.ZernikeBasis((self.X, self.Y), self.nmodes, self.ap)
+        
+    def test_matrix(self):
+        """basis modes match zernike_noll_cartesian"""
+        nt.eq_(self.basis.matrix.shape, (self.nmodes, np.count_nonzero(self.ap)))
+        for j in range(self.nmodes):
+            npeq_(zernike.zernike_noll_cartesian(j, self.X, self.Y)[self.ap], self.basis.matrix[j], "Mode {0:d} mismatch".format(j), atol=1e-10)
+            
+    def test_cache(self):
+        """bases on the same grid share a matrix"""
+        basis = zernike.ZernikeBasis((self.X.copy(), self.Y.copy()), self.nmodes, self.ap.astype(np.int))
+        nt.ok_(basis.matrix is self.basis.matrix)
+        nt.ok_(not basis.matrix.flags.writeable)
+        nt.ok_(basis.projector is self.basis.projector)
+        nt.ok_(zernike.ZernikeBasis((self.X, self.Y), self.nmodes).matrix is not self.basis.matrix)
+        
+    def test_decompose(self):
+        """decompose and synthesize are inverses over batches of frames"""
+        coeffs = np.random.RandomState(5).randn(3, 4, self.nmodes)
+        phase = self.basis.synthesize(coeffs)
+        nt.eq_(phase.shape, (3, 4, self.size, self.size))
+        nt.ok_((phase[...,~self.ap] == 0.0).all())
+        single = np.zeros((self.nmodes,))
+        single[[0, 5]] = coeffs[1,2,[0, 5]]
+        expected = (zernike.zernike_noll_cartesian(0, self.X, self.Y) * coeffs[1,2,0] +
+            zernike.zernike_noll_cartesian(5, self.X, self.Y) * coeffs[1,2,5]) * self.ap
+        npeq_(expected, self.basis.synthesize(single), "Synthesis mismatch", atol=1e-10)
+        npeq_(coeffs, self.basis.decompose(phase), "Decomposition mismatch", atol=1e-8)
+        npeq_(coeffs[0,0], self.basis.decompose(phase[0,0]), "Decomposition mismatch", atol=1e-8)
+        
+    @nt.raises(ValueError)
+    def test_decompose_shape(self):
+        """decompose checks the grid shape"""
+        self.basis.decompose(np.zeros((3, self.size, self.size + 1)))
+        
+class test_zernike_radial(object):
+    """aopy.wavefront.zernike radial recurrence"""
+    
+    def test_explicit(self):
+        """the recurrence matches the explicit sum"""
+        Rho = np.linspace(0.0, 1.0, 11)
+        radial = zernike.zernike_rho_all(16, Rho)
+        nt.eq_(len(radial), 81)
+        for (n, m), R in radial.items():
+            ks, kterm = zernike.zernike_ks(n, m)
+            expected = np.sum(np.power(Rho[...,np.newaxis], n - 2.0 * ks) * kterm, axis=-1)
+            npeq_(expected, R, "R({0:d},{1:d}) mismatch".format(n, m), atol=1e-9)
+            npeq_(expected, zernike.zernike_rho(n, m, Rho), "R({0:d},{1:d}) mismatch".format(n, m), atol=1e-9)
+        npeq_(np.zeros_like(Rho), zernike.zernike_rho(5, 2, Rho), "Odd R mismatch")
+        
+    def test_orthogonality(self):
+        """high order radial components are orthogonal"""
+        x, w = np.polynomial.legendre.leggauss(200)
+        Rho = (x + 1.0) / 2.0
+        w = w / 2.0
+        nmax = 80
+        radial = zernike.zernike_rho_all(nmax, Rho)
+        edge = zernike.zernike_rho_all(nmax, 1.0)
+        for m in [0, 1, 7, 40]:
+            ns = range(m, nmax + 1, 2)
+            R = np.array([radial[(n, m)] for n in ns])
+            gram = np.dot(R * w * Rho, R.T)
+            npeq_(np.diag(1.0 / (2.0 * (np.array(ns) + 1))), gram, "Orthogonality mismatch for m={0:d}".format(m), atol=1e-10)
+            npeq_(np.ones(len(ns)), [edge[(n, m)] for n in ns], "R(1) mismatch for m={0:d}".format(m), atol=1e-10)
+            
+class test_zernike_slope_basis(object):
+    """aopy.wavefront.zernike.ZernikeSlopeBasis"""
+    
+    def setup(self):
+        """Set up a grid of subaperture centers."""
+        zernike.ZernikeBasis.clear_cache()
+        self.size = 20
+        self.X, self.Y = (np.mgrid[0:self.size,0:self.size] - (self.size - 1) / 2.0) / (self.size / 2.0)
+        self.ap = (np.sqrt(self.X**2 + self.Y**2) < 1)
+        self.nmodes = 21
+        self.basis = zernike.ZernikeSlopeBasis((self.X, self.Y), self.nmodes, self.ap)
+        
+    def test_matrix(self):
+        """slope basis modes match zernike_slope_cartesian"""
+        nt.eq_(self.basis.matrix.shape, (self.nmodes, 2, np.count_nonzero(self.ap)))
+        for j in range(1, self.nmodes):
+            n, m = zernike.noll_to_zern(j)
+            expected = zernike.zernike_slope_cartesian(n, m, self.X, self.Y)
+            npeq_(expected[0][self.ap], self.basis.matrix[j,0], "Mode {0:d} x mismatch".format(j), atol=1e-10)
+            npeq_(expected[1][self.ap], self.basis.matrix[j,1], "Mode {0:d} y mismatch".format(j), atol=1e-10)
+        npeq_(np.zeros((2, self.basis.npix)), self.basis.matrix[0], "Piston mismatch")
+        
+    def test_gradient(self):
+        """slopes match a numerical gradient, including at the origin"""
+        X, Y = np.array([0.0, 0.3, -0.5]), np.array([0.0, -0.2, 0.1])
+        matrix = zernike.ZernikeSlopeBasis._compute(X, Y, self.nmodes)
+        h = 1e-6
+        for j in range(self.nmodes):
+            dx = (zernike.zernike_noll_cartesian(j, X + h, Y) - zernike.zernike_noll_cartesian(j, X - h, Y)) / (2 * h)
+            dy = (zernike.zernike_noll_cartesian(j, X, Y + h) - zernike.zernike_noll_cartesian(j, X, Y - h)) / (2 * h)
+            npeq_(dx, matrix[j,0], "Mode {0:d} x mismatch".format(j), atol=1e-6)
+            npeq_(dy, matrix[j,1], "Mode {0:d} y mismatch".format(j), atol=1e-6)
+            
+    def test_radial_slope(self):
+        """the radial slope recurrence matches a numerical derivative"""
+        Rho = np.linspace(0.05, 0.95, 7)
+        h = 1e-6
+        radial = zernike.zernike_rho_all(12, Rho, slope=True)
+        high, low = zernike.zernike_rho_all(12, Rho + h), zernike.zernike_rho_all(12, Rho - h)
+        for (n, m), (R, dR) in radial.items():
+            npeq_((high[(n, m)] - low[(n, m)]) / (2 * h), dR, "dR({0:d},{1:d}) mismatch".format(n, m), atol=1e-5)
+            
+    def test_cache(self):
+        """slope bases are cached separately from phase bases"""
+        basis = zernike.ZernikeSlopeBasis((self.X, self.Y), self.nmodes, self.ap)
+        nt.ok_(basis.matrix is self.basis.matrix)
+        phase = zernike.ZernikeBasis((self.X, self.Y), self.nmodes, self.ap)
+        nt.eq_(phase.matrix.shape, (self.nmodes, self.basis.npix))
+        
+    def test_decompose(self):
+        """slopes decompose into their coefficients, except piston"""
+        coeffs = np.random.RandomState(5).randn(3, self.nmodes)
+        coeffs[:,0] = 0.0
+        slopes = self.basis.synthesize(coeffs)
+        nt.eq_(slopes.shape, (3, 2, self.size, self.size))
+        npeq_(coeffs, self.basis.decompose(slopes), "Decomposition mismatch", atol=1e-8)
+        
+class test_modal_reconstructor(object):
+    """aopy.reconstructors.modal.ModalReconstructor"""
+    
+    def setup(self):
+        """Set up a reconstructor."""
+        from aopy.reconstructors.modal import ModalReconstructor
+        zernike.ZernikeBasis.clear_cache()
+        self.n = 16
+        self.nmodes = 15
+        self.MR = ModalReconstructor(self.n, nmodes=self.nmodes)
+        
+    def test_reconstruct(self):
+        """the modal reconstructor recovers modes from their slopes"""
+        coeffs = np.random.RandomState(5).randn(4, self.nmodes)
+        coeffs[:,0] = 0.0
+        Y, X = np.mgrid[0:self.n,0:self.n] - (self.n - 1) / 2.0
+        phase = np.array([np.sum([c * zernike.zernike_noll_cartesian(j, X / self.MR.radius, Y / self.MR.radius)
+            for j, c in enumerate(frame)], axis=0) for frame in coeffs])
+        slopes = self.MR.slope_basis.synthesize(coeffs) / self.MR.radius
+        npeq_(coeffs, self.MR.coefficients(slopes[:,0], slopes[:,1]), "Coefficient mismatch", atol=1e-8)
+        npeq_(phase * self.MR.ap, self.MR(slopes[:,0], slopes[:,1]), "Phase mismatch", atol=1e-8)
+        
+    def test_ftr_orientation(self):
+        """the modal and Fourier transform reconstructors agree on the same slopes"""
+        from aopy.reconstructors.modal import ModalReconstructor
+        from aopy.reconstructors.slopemanage import SlopeManagedFTR
+        n = 24
+        i, j = np.mgrid[0:n,0:n] - (n - 1) / 2.0
+        ap = np.hypot(i, j) < n / 2.0 - 2
+        MR = ModalReconstructor(n, ap, nmodes=15, radius=n / 2.0 - 2)
+        FTR = SlopeManagedFTR(n, ap.astype(np.int), filter='mod_hud', manage_tt=True, suppress_tt=False, extend=True)
+        for phi, atol in [(j, 1e-8), (i, 1e-8), (0.05 * (j**2 - i**2) + 0.03 * i * j + 0.2 * j, 0.25)]:
+            xs = (np.roll(phi, -1, axis=1) - phi) * ap
+            ys = (np.roll(phi, -1, axis=0) - phi) * ap
+            difference = (MR(xs, ys) - FTR(xs, ys))[ap]
+            rms = np.sqrt(np.mean((difference - difference.mean())**2))
+            nt.ok_(rms < atol * np.std(phi[ap]), "Reconstructors disagree, rms={0:g}".format(rms))
+        
+    @nt.raises(ValueError)
+    def test_shape(self):
+        """slopes must match the reconstructor"""
+        self.MR.coefficients(np.zeros((self.n, self.n)), np.zeros((self.n, self.n + 1)))
+        
+class test_zernike_indices(object):
+    """aopy.wavefront.zernike index conversion"""
+    
+    def test_scalar(self):
+        """scalar conversions return integers"""
+        nt.eq_(zernike.noll_to_zern(0), (0, 0))
+        nt.eq_(zernike.noll_to_zern(4), (2, 0))
+        nt.eq_(zernike.zern_to_noll(2, 0), 4)
+        nt.ok_(isinstance(zernike.noll_to_zern(np.int64(7))[0], int))
+        nt.ok_(isinstance(zernike.zern_to_noll(3, -1), int))
+        
+    def test_arrays(self):
+        """array conversions match scalar conversions, inside and outside the lookup table"""
+        nmax = zernike.noll_table_order
+        j = np.arange(2 * (nmax + 4) * (nmax + 5)).reshape((-1, 4))
+        n, m = zernike.noll_to_zern(j)
+        nt.eq_(n.shape, j.shape)
+        nt.eq_(n.dtype.kind, 'i')
+        npeq_(j, zernike.zern_to_noll(n, m), "Round trip mismatch")
+        for jj in [0, 1, 2, 9, 100, j.size - 1]:
+            nt.eq_(zernike.noll_to_zern(jj), (n.flat[jj], m.flat[jj]))
+        npeq_(n[:2], zernike.noll_to_zern(j[:2])[0], "Table mismatch")
+        npeq_(n, zernike.noll_to_zern(j.astype(np.float64))[0], "Float mismatch")
+        nt.ok_((np.abs(m) <= n).all())
+        
+    def test_large(self):
+        """very large indices are converted exactly"""
+        n = np.array([10**6, 10**6 + 1, 3 * 10**7])
+        m = np.array([-10**6, 10**6 - 1, 0])
+        j = zernike.zern_to_noll(n, m)
+        rn, rm = zernike.noll_to_zern(j)
+        npeq_(n, rn, "n mismatch")
+        npeq_(m, rm, "m mismatch")
+        
+    def test_table(self):
+        """lookup tables are shared and read-only"""
+        n, m = zernike.noll_table(4)
+        nt.eq_(n.shape, (15,))
+        nt.ok_(zernike.noll_table(4)[0] is n)
+        nt.ok_(not n.flags.writeable)
+        npeq_([0, 1, 1, 2, 2, 2], n[:6], "n mismatch")
+        npeq_([0, -1, 1, -2, 0, 2], m[:6], "m mismatch")
+        
+    @nt.raises(ValueError)
+    def test_negative(self):
+        """Noll indices must be positive"""
+        zernike.noll_to_zern(np.array([3, -1]))
+        
+    @nt.raises(ValueError)
+    def test_negative_scalar(self):
+        """a single Noll index must be positive"""
+        zernike.noll_to_zern(-1)
+        
+    @nt.raises(ValueError)
+    def test_odd(self):
+        """Zernike indices must have n-m even"""
+        zernike.zern_to_noll(np.array([2, 3]), np.array([0, 0]))
+        
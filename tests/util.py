@@ -26,7 +26,7 @@ def remove(path, warn=False, name='path'):
         if warn:
             warnings.warn("{name} '{path}' does not exist!".format(
                 name=name.capitalize(), path=path
-            )
+            ))
 
 def npeq_(a,b,msg, rtol=1e-8, atol=1e-4):
     """Assert numpy equal"""